@@ -78,10 +78,80 @@ DB_CONFIG = {
     "password": os.getenv("PGPASSWORD", "password1"),
 }
 
+# "postgres" (DB_CONFIG) or "sqlite" (a local WAL-mode database file, no server needed),
+# overridable with LMSUTURE_DB / LMSUTURE_SQLITE_PATH; with `auto_migrate` the tables
+# and indexes of helper/schema.py are created/updated on the first connection
+STORAGE = {
+    "auto_migrate": os.getenv("LMSUTURE_DB_MIGRATE", "1") == "1",
+    "backend": os.getenv("LMSUTURE_DB", "postgres"),
+    "sqlite_path": os.getenv("LMSUTURE_SQLITE_PATH",
+                             os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lmsuture.db")),
+}
+
+# prompts/responses of at least `min_size` characters are stored once in llm_blobs,
+# keyed by their sha256; `compress` zlib-compresses them on SQLite (Postgres
+# compresses them itself, see helper/schema.py)
+LOG_BLOBS = {
+    "min_size": 1024,
+    "compress": os.getenv("LMSUTURE_BLOB_COMPRESS", "1") == "1",
+}
+
+# Postgres connections per process, idle connections older than `health_check_interval`
+# seconds are checked with `SELECT 1` before they are reused
+DB_POOL = {
+    "max_size": 8,
+    "health_check_interval": 30.0,
+}
+
+# LLM logs and case results are committed in batches by a background thread,
+# once `batch_size` writes are queued or `flush_interval` seconds after the first one
+# (DB_WRITE_BEHIND=0 commits every write synchronously)
+DB_WRITER = {
+    "write_behind": os.getenv("DB_WRITE_BEHIND", "1") == "1",
+    "batch_size": 200,
+    "flush_interval": 2.0,
+}
+
 MODEL_ABBR = {
     "sonnet": "claude-3-5-sonnet-latest",
     "opus": "claude-3-opus-latest",
     "haiku": "claude-3-5-haiku-latest",
     "ds": "deepseek-reasoner",
     "dsv3": "deepseek-chat"
-}
\ No newline at end of file
+}
+
+# per-provider quota shared by all workers, in requests / tokens per minute
+# (None = no limit on that axis); tune these to the tier of your account
+RATE_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 2000000},
+    "anthropic": {"rpm": 50, "tpm": 40000},
+    "deepseek": {"rpm": None, "tpm": None},
+    "gemini": {"rpm": 150, "tpm": 2000000},
+    "openrouter": {"rpm": 200, "tpm": None},
+    "ollama": {"rpm": None, "tpm": None},
+}
+
+# on-disk cache of LLM responses, mode is one of "off", "record", "replay"
+# (see prompts/response_cache.py), can be overridden with `--cache_mode`
+RESPONSE_CACHE = {
+    "dir": "cache/cache_llm",
+    "mode": os.getenv("LLM_CACHE_MODE", "off"),
+    "size_limit": 4 * 1024 ** 3,
+}
+
+# cache of the code lookups (codequery locations and the sources read from them),
+# one on-disk store for every lookup kind with an in-memory LRU in front (see helper/lookup_cache.py)
+LOOKUP_CACHE = {
+    "dir": "cache/cache_lookup",
+    "size_limit": 2 * 1024 ** 3,
+    "memory_items": 4096,
+}
+
+# keep-alive connection pool shared by the OpenRouter and OpenAI-compatible clients,
+# timeouts in seconds (reasoning models may think for minutes before answering)
+HTTP_POOL = {
+    "pool_size": 32,
+    "connect_timeout": 10,
+    "read_timeout": 600,
+    "http2": os.getenv("LLM_HTTP2", "0") == "1",
+}
@@ -1,17 +1,13 @@
 # logic.py
 import csv
-import os
 import re
-import psycopg2
-
-DB_CONFIG = {
-    "host": os.getenv("PGHOST", "localhost"),
-    "port": int(os.getenv("PGPORT", 5432)),
-    "dbname": os.getenv("PGDATABASE", "lmsuture"),
-    "user": os.getenv("PGUSER", "lmsuture_user"),
-    "password": os.getenv("PGPASSWORD", "password1"),
-}
 
+# the storage backend (Postgres or SQLite) is configured in common/config.py,
+# the demo runs with the repository root on the path (see "Demo" in README.md)
+from helper.storage import create_backend
+
+# one backend (and connection pool) for every request of the app
+__backend = create_backend()
 
 GROUND_TRUTH_FILE = "ground_truth.csv"
 
@@ -97,17 +93,19 @@ def get_data():
       SELECT case_id, model, sanitize_result
       FROM cases
       WHERE model IN ({placeholders})
-      and case_id like 'msm-sound:%%'
+      and case_id like %s
       ORDER BY case_id, model
     """
 
+    def _query(conn):
+        cur = conn.cursor()
+        cur.execute(query, tuple(MODELS) + ('msm-sound:%',))  # pass the models as parameters
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
     # Connect to DB
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    cur.execute(query, tuple(MODELS))  # pass the models as parameters
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = __backend.run(_query)
     
     # data dict: {case_int => {"case_id_str": <orig case_id>, "models": {model_name => sanitize_result, ...}}}
     data = {}
@@ -0,0 +1,124 @@
+import atexit
+import logging
+import threading
+import time
+
+
+class BatchWriter:
+    """
+    Write-behind queue for the DB: log rows and `cases` upserts are buffered
+    and handed to `flush_func(logs, upserts)` in one batch, by a background
+    thread, once `batch_size` writes are pending or `flush_interval` seconds
+    after the first pending write, and at exit.
+
+    `logs` is a list of (columns, values) and `upserts` maps
+    (case_id, model) -> {column: value}; repeated upserts of the same column
+    are coalesced so the latest value wins, as it would with one commit per call.
+    """
+
+    def __init__(self, flush_func, batch_size=200, flush_interval=2.0, background=True):
+        self._flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self._cond = threading.Condition()
+        # serializes flushes so batches reach the DB in submission order
+        self._flush_lock = threading.Lock()
+        self._logs = []
+        self._upserts = {}
+        # upserts taken by a flush that has not committed yet, still visible to `pending`
+        self._in_flight = {}
+        self._first_pending = None
+        self._thread = None
+        self._closed = False
+
+    def _pending_count(self):
+        return len(self._logs) + len(self._upserts)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _submitted(self):
+        # called with self._cond held
+        if self._first_pending is None:
+            self._first_pending = time.monotonic()
+        if not self.background or self._closed:
+            return True
+        self._start()
+        if self._pending_count() >= self.batch_size:
+            self._cond.notify()
+        return False
+
+    def add_log(self, columns, values):
+        with self._cond:
+            self._logs.append((tuple(columns), tuple(values)))
+            flush_now = self._submitted()
+        if flush_now:
+            self.flush()
+
+    def upsert(self, case_id, model, column, value):
+        with self._cond:
+            self._upserts.setdefault((case_id, model), {})[column] = value
+            flush_now = self._submitted()
+        if flush_now:
+            self.flush()
+
+    def pending(self, case_id, model, column):
+        """
+        (True, value) if a not yet committed upsert sets `column` of the case,
+        so readers see their own writes, else (False, None)
+        """
+        with self._cond:
+            for upserts in (self._upserts, self._in_flight):
+                row = upserts.get((case_id, model))
+                if row is not None and column in row:
+                    return True, row[column]
+        return False, None
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                logs, upserts = self._logs, self._upserts
+                self._logs, self._upserts = [], {}
+                self._in_flight = upserts
+                self._first_pending = None
+            try:
+                if logs or upserts:
+                    self._flush_func(logs, upserts)
+            finally:
+                with self._cond:
+                    self._in_flight = {}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending_count() >= self.batch_size:
+                        break
+                    if self._first_pending is not None:
+                        timeout = self._first_pending + self.flush_interval - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Failed to flush DB writes: {e}")
+
+    def close(self):
+        """
+        Stop the background thread and write everything still pending
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -68,7 +68,6 @@ def _get_func_callback(task, args):
     return response
 
 
-_current_caller_pos = {}
 def _get_caller_callback(task, args):
     call_chain = task['context'].call_chain
     cur_call = args[0]
@@ -76,13 +75,14 @@ def _get_caller_callback(task, args):
     # if task starts with "codeql", get the last caller definition
     if task['case_id'].startswith("codeql"):
         function_call_chain = task['context'].bug_group.func_list
-        if task['case_id'] not in _current_caller_pos:
-            _current_caller_pos[task['case_id']] = len(function_call_chain) - 1
-        if _current_caller_pos[task['case_id']] == 0:
+        # the position lives in the task so concurrent cases do not share it
+        if 'caller_pos' not in task:
+            task['caller_pos'] = len(function_call_chain) - 1
+        if task['caller_pos'] == 0:
             return f"No caller of {cur_call}"
         else:
-            last_call = function_call_chain[_current_caller_pos[task['case_id']] - 1]
-            _current_caller_pos[task['case_id']] -= 1
+            last_call = function_call_chain[task['caller_pos'] - 1]
+            task['caller_pos'] -= 1
             response = f"The caller of {cur_call} is defined as follow:\n"
             response += f"```c\n{last_call.function_definition}\n```\n"
             return response
@@ -97,8 +97,8 @@ def _get_caller_callback(task, args):
     response = f"The caller of {cur_call} is {caller}\n"
     return response + _get_func_callback(task, [caller])
 
-def clear_counter():
-    _current_caller_pos.clear()
+def clear_counter(task):
+    task.pop('caller_pos', None)
 
 def _get_struct_callback(task, args):
     proj_path = task['proj_dir']
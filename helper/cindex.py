@@ -0,0 +1,371 @@
+"""
+Pure-Python index of the top-level C definitions of a project, used when
+cscope/ctags/cqmakedb are not installed.
+
+The sources are scanned on a multiprocessing pool, line by line with brace
+counting (no preprocessing), for functions, structs, unions, enums and
+their constants, typedefs, macros and global variables. Only definitions
+are recorded, in an SQLite file with the tables of `cq.db` (see
+helper/cqdb.py), so the lookups of helper/codequery.py read it unchanged.
+
+    python -m helper.cindex <project dir> [--jobs N] [--force]
+"""
+import fnmatch
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from multiprocessing import Pool
+
+from helper.cqbuild import SOURCE_PATTERNS, build_lock
+
+INDEX_FILE = 'cq_py.db'
+
+# symType of the definitions, the cscope marks of helper/cqdb.py SYMBOL_KINDS
+FUNCTION = '$'
+MACRO = '#'
+STRUCT = 's'
+UNION = 'u'
+ENUM = 'e'
+ENUM_CONSTANT = 'm'
+TYPEDEF = 't'
+GLOBAL = 'g'
+
+_AGGREGATES = {'struct': STRUCT, 'union': UNION, 'enum': ENUM}
+_KEYWORDS = {'if', 'while', 'for', 'switch', 'return', 'sizeof', 'do', 'else', 'case',
+             '__attribute__', '__typeof__', 'typeof', 'defined'}
+
+LITERAL_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+DEFINE_PATTERN = re.compile(r'^\s*#\s*define\s+(\w+)')
+# `__packed`, `__aligned(8)`, `____cacheline_aligned`, `__attribute__((aligned(8)))`
+_ATTRIBUTE = r'__\w+(?:\s*\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\))?'
+# the name between attributes (`struct __packed foo`), see _aggregate_name
+AGGREGATE_PATTERN = re.compile(r'^\s*(typedef\s+)?(struct|union|enum)\b((?:\s*' + _ATTRIBUTE + r')*(?:\s+(?!__)\w+)?'
+                               r'(?:\s*' + _ATTRIBUTE + r')*)\s*$')
+CALL_PATTERN = re.compile(r'(\w+)\s*\(')
+INITIALIZED_PATTERN = re.compile(r'(\w+)\s*(?:\[[^\]]*\]\s*)*=')
+FUNCTION_POINTER_PATTERN = re.compile(r'\(\s*\*\s*(\w+)\s*\)')
+DECLARED_PATTERN = re.compile(r'(\w+)\s*(?:\[[^\]]*\]\s*)*(?:__\w+(?:\(\(.*\)\))?\s*)*$')
+ENUMERATOR_PATTERN = re.compile(r'(?:^|,)\s*([A-Za-z_]\w*)\s*(?==|,|$)')
+IDENTIFIER_PATTERN = re.compile(r'\w+')
+ATTRIBUTE_PATTERN = re.compile(r'\b' + _ATTRIBUTE)
+# anywhere in the statement, a macro without `;` (`__BEGIN_DECLS`) may precede them
+EXTERN_PATTERN = re.compile(r'\bextern\b')
+TYPEDEF_PATTERN = re.compile(r'\btypedef\b')
+
+
+def _aggregate_name(declarator):
+    """
+    The name of `struct <declarator> {`: the identifier that is not an
+    attribute, else the last `__` one (`struct __randomize_layout __kernel_foo`)
+    """
+    plain = IDENTIFIER_PATTERN.findall(ATTRIBUTE_PATTERN.sub(' ', declarator))
+    if plain:
+        return plain[0]
+    # `__attribute__((packed))`, `__aligned(8)` are never names
+    names = [name for name in ATTRIBUTE_PATTERN.findall(declarator) if '(' not in name]
+    return names[-1] if names else None
+
+
+def _strip_comments(line, in_comment):
+    """
+    (code of `line` without comments and literals, whether a /* comment is still open)
+    """
+    code = []
+    i = 0
+    while i < len(line):
+        if in_comment:
+            end = line.find('*/', i)
+            if end == -1:
+                return ''.join(code), True
+            i = end + 2
+            in_comment = False
+            code.append(' ')
+            continue
+        start = line.find('/*', i)
+        segment = line[i:] if start == -1 else line[i:start]
+        line_comment = segment.find('//')
+        if line_comment != -1:
+            code.append(segment[:line_comment])
+            break
+        code.append(segment)
+        if start == -1:
+            break
+        i = start + 2
+        in_comment = True
+    return LITERAL_PATTERN.sub('""', ''.join(code)), in_comment
+
+
+class _Scanner:
+    """
+    Definitions of one source file: [(name, symType, line number, line text), ...]
+    """
+
+    def __init__(self):
+        self.symbols = []
+        self.depth = 0
+        # (line number, code fragment, line) of the top-level statement being read
+        self.statement = []
+        # what the block opened at depth 0 is: 'enum', 'aggregate', 'function', 'other'
+        self.block = None
+        # a struct/union/enum definition continues after its closing brace (`} name_t;`)
+        self.tail = None
+
+    def _add(self, name, sym_type, fragments=None, lineno=None, line=None):
+        if not name or name in _KEYWORDS or name[0].isdigit():
+            return
+        if fragments is not None:
+            # the line of the statement the name is on (the last one, for `static int\nfoo(void)`)
+            lineno, line = fragments[-1][0], fragments[-1][2]
+            for fragment_lineno, code, fragment_line in reversed(fragments):
+                if re.search(r'\b' + re.escape(name) + r'\b', code):
+                    lineno, line = fragment_lineno, fragment_line
+                    break
+        self.symbols.append((name, sym_type, lineno, line.rstrip('\n')))
+
+    def _open_block(self):
+        text = ' '.join(code for _, code, _ in self.statement)
+        aggregate = AGGREGATE_PATTERN.match(text)
+        if aggregate:
+            typedef, keyword, declarator = aggregate.groups()
+            name = _aggregate_name(declarator)
+            if name:
+                self._add(name, _AGGREGATES[keyword], self.statement)
+            self.block = 'enum' if keyword == 'enum' else 'aggregate'
+            self.tail = 'typedef' if typedef else 'declaration'
+        elif '=' in text:
+            # `static struct x y[] = {`, the braces are its initializer
+            pointer = FUNCTION_POINTER_PATTERN.search(text.split('=')[0])
+            match = pointer or INITIALIZED_PATTERN.search(text)
+            if match:
+                self._add(match.group(1), GLOBAL, self.statement)
+            self.block = 'other'
+        else:
+            # the first call-like name that is not an attribute: `static int __init foo(void)`
+            names = [name for name in CALL_PATTERN.findall(text) if name not in _KEYWORDS]
+            if names:
+                self._add(names[0], FUNCTION, self.statement)
+                self.block = 'function'
+            else:
+                self.block = 'other'
+        self.statement = []
+
+    def _close_statement(self):
+        text = ' '.join(code for _, code, _ in self.statement).strip()
+        statement, self.statement = self.statement, []
+        if self.tail is not None:
+            # `} name_t;` of a typedef, `} var;` of a definition with a variable
+            tail, self.tail = self.tail, None
+            # `} __packed;` declares nothing, the attributes are not names
+            match = DECLARED_PATTERN.search(ATTRIBUTE_PATTERN.sub(' ', text).strip())
+            if match:
+                self._add(match.group(1), TYPEDEF if tail == 'typedef' else GLOBAL, statement)
+            return
+        if not text or EXTERN_PATTERN.search(text) or AGGREGATE_PATTERN.match(text):
+            # declarations of things defined elsewhere, forward declarations
+            return
+        if TYPEDEF_PATTERN.search(text):
+            pointer = FUNCTION_POINTER_PATTERN.search(text)
+            match = pointer or DECLARED_PATTERN.search(text)
+            if match:
+                self._add(match.group(1), TYPEDEF, statement)
+            return
+        before_init = text.split('=')[0]
+        pointer = FUNCTION_POINTER_PATTERN.search(before_init)
+        if pointer:
+            self._add(pointer.group(1), GLOBAL, statement)
+        elif '(' in before_init:
+            # prototypes and top-level macro invocations (EXPORT_SYMBOL(x);)
+            return
+        elif '=' in text:
+            match = INITIALIZED_PATTERN.search(text)
+            if match:
+                self._add(match.group(1), GLOBAL, statement)
+        else:
+            match = DECLARED_PATTERN.search(text)
+            # a lone word is not a declaration (a macro use like `__init`)
+            if match and len(IDENTIFIER_PATTERN.findall(text)) > 1:
+                self._add(match.group(1), GLOBAL, statement)
+
+    def _enumerators(self, lineno, code, line):
+        for name in ENUMERATOR_PATTERN.findall(code.strip()):
+            self._add(name, ENUM_CONSTANT, lineno=lineno, line=line)
+
+    def scan(self, lines):
+        in_comment = False
+        continued = False
+        for lineno, line in enumerate(lines, 1):
+            code, in_comment = _strip_comments(line, in_comment)
+            if continued:
+                # continuation of a preprocessor line
+                continued = code.rstrip().endswith('\\')
+                continue
+            if code.lstrip().startswith('#'):
+                define = DEFINE_PATTERN.match(code)
+                if define:
+                    self._add(define.group(1), MACRO, lineno=lineno, line=line)
+                continued = code.rstrip().endswith('\\')
+                continue
+            if line.startswith('}') and self.depth > 1:
+                # kernel style closes top-level blocks in the first column, resync
+                # after braces unbalanced by #ifdef branches
+                self.depth = 1
+            start = 0
+            for match in re.finditer(r'[{};]', code):
+                fragment = code[start:match.start()]
+                start = match.end()
+                if self.depth == 0:
+                    self.statement.append((lineno, fragment, line))
+                elif self.depth == 1 and self.block == 'enum':
+                    self._enumerators(lineno, fragment, line)
+                char = match.group()
+                if char == '{':
+                    if self.depth == 0:
+                        self._open_block()
+                    self.depth += 1
+                elif char == '}':
+                    self.depth = max(0, self.depth - 1)
+                    if self.depth == 0:
+                        if self.tail is None:
+                            self.block = None
+                            self.statement = []
+                elif char == ';' and self.depth == 0:
+                    self._close_statement()
+            rest = code[start:]
+            if self.depth == 0 and rest.strip():
+                self.statement.append((lineno, rest, line))
+            elif self.depth == 1 and self.block == 'enum':
+                self._enumerators(lineno, rest, line)
+        return self.symbols
+
+
+def scan_source(path):
+    """
+    The definitions of the source file at `path`: [(name, symType, line number, line text), ...]
+    """
+    with open(path, 'r', errors='ignore') as f:
+        return _Scanner().scan(f)
+
+
+def _scan_file(args):
+    project_path, source = args
+    try:
+        return source, scan_source(os.path.join(project_path, source))
+    except OSError as e:
+        logging.warning(f"Cannot index {source}: {e}")
+        return source, []
+
+
+def list_sources(project_path):
+    """
+    Sources of the project relative to its root, as `find` lists them for cscope
+    """
+    sources = []
+    for root, dirs, files in os.walk(project_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in SOURCE_PATTERNS):
+                sources.append(os.path.relpath(os.path.join(root, name), project_path))
+    return sources
+
+
+def __create_tables(conn):
+    conn.executescript("""
+    CREATE TABLE filestbl (fileID INTEGER PRIMARY KEY, filePath TEXT);
+    CREATE TABLE linestbl (lineID INTEGER PRIMARY KEY, linenum INTEGER, fileID INTEGER, linetext TEXT);
+    CREATE TABLE symtbl (symID INTEGER PRIMARY KEY, symName TEXT, symType TEXT, lineID INTEGER);
+    """)
+
+
+def __create_indexes(conn):
+    conn.executescript("""
+    CREATE INDEX symtbl_name_idx ON symtbl (symName);
+    CREATE INDEX linestbl_line_idx ON linestbl (lineID);
+    """)
+
+
+def __is_stale(project_path, index_path):
+    # sources added, removed or modified since the index was built
+    index_mtime = os.stat(index_path).st_mtime_ns
+    sources = list_sources(project_path)
+    conn = sqlite3.connect(index_path)
+    try:
+        indexed = {row[0] for row in conn.execute("SELECT filePath FROM filestbl;")}
+    finally:
+        conn.close()
+    if indexed != {os.path.join(project_path, source) for source in sources}:
+        return True
+    for source in sources:
+        try:
+            if os.stat(os.path.join(project_path, source)).st_mtime_ns > index_mtime:
+                return True
+        except FileNotFoundError:
+            return True
+    return False
+
+
+def __is_current(project_path, index_path, force, refresh):
+    if force or not os.path.exists(index_path):
+        return False
+    return not refresh or not __is_stale(project_path, index_path)
+
+
+def build_index(project_path, jobs=None, force=False, refresh=False):
+    """
+    Build the index of `project_path` unless it exists (or `force`, or with
+    `refresh` its sources changed since), on `jobs` processes (default: one
+    per core); the path of the index
+    """
+    index_path = os.path.join(project_path, INDEX_FILE)
+    if __is_current(project_path, index_path, force, refresh):
+        return index_path
+    with build_lock(project_path):
+        if __is_current(project_path, index_path, force, refresh):
+            return index_path
+
+        start_time = time.perf_counter()
+        sources = list_sources(project_path)
+        logging.info(f"Indexing {len(sources)} source files of {project_path} in Python "
+                     f"(cscope/ctags/cqmakedb are not installed)")
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + INDEX_FILE, dir=project_path)
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp_path)
+            __create_tables(conn)
+            n_symbols = 0
+            with Pool(jobs or os.cpu_count()) as pool:
+                results = pool.imap_unordered(_scan_file, [(project_path, source) for source in sources],
+                                              chunksize=64)
+                for file_id, (source, symbols) in enumerate(results, 1):
+                    conn.execute("INSERT INTO filestbl (fileID, filePath) VALUES (?, ?);",
+                                 (file_id, os.path.join(project_path, source)))
+                    for name, sym_type, lineno, text in symbols:
+                        line_id = conn.execute("INSERT INTO linestbl (linenum, fileID, linetext) VALUES (?, ?, ?);",
+                                               (lineno, file_id, text)).lastrowid
+                        conn.execute("INSERT INTO symtbl (symName, symType, lineID) VALUES (?, ?, ?);",
+                                     (name, sym_type, line_id))
+                    n_symbols += len(symbols)
+            __create_indexes(conn)
+            conn.commit()
+            conn.close()
+            os.replace(tmp_path, index_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.info(f"Indexed {n_symbols} definitions of {project_path} "
+                     f"in {time.perf_counter() - start_time} seconds")
+    return index_path
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Index the C definitions of a project without cscope/ctags/cqmakedb')
+    parser.add_argument('project_path', type=str)
+    parser.add_argument('--jobs', type=int, help='Indexing processes (default: one per core)', default=None)
+    parser.add_argument('--force', action='store_true', help='Rebuild an existing index', default=False)
+    parser.add_argument('--refresh', action='store_true', help='Rebuild an existing index if its sources changed', default=False)
+    args = parser.parse_args()
+    build_index(args.project_path, args.jobs, args.force, args.refresh)
@@ -1,14 +1,15 @@
 import os
-import sys
+import re
 import glob
 import subprocess
 import logging
-from diskcache import Cache
+from helper.cindex import INDEX_FILE, build_index
+from helper.cqbuild import build_cq_db, build_cq_dbs
+from helper.cqdb import open_cq_db
+from helper.lookup_cache import lookup_cache
 from contextlib import contextmanager
 import time
 
-cache_dir = "cache"
-
 @contextmanager
 def log_time(desc):
     logging.info(f"Starting {desc}")
@@ -35,40 +36,69 @@ def __has_dependency():
                        capture_output=True, check=True)
         subprocess.run(['cqmakedb', '-v'], capture_output=True, check=True)
         return True
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
 
 __HAS_DEPENDENCY = __has_dependency()
 
 
-def create_cq_db(project_path):
-    try:
-        # find all source files (*.c, *.cpp, *.h, *.hpp) in the project directory
-        # and write to "cscope.files"
-        # with log_time("find source files"):
-        with open(os.path.join(project_path, 'cscope.files'), 'w') as f:
-            subprocess.run(
-                ['find', '.', '-type', 'f', '(', '-name', '*.c', '-o', '-name',
-                 '*.cpp', '-o', '-name', '*.h', '-o', '-name', '*.hpp', ')'],
-                cwd=project_path,
-                stdout=f,
-                stderr=sys.stderr, check=True)
-
-        with log_time("cscope database creation"):
-            subprocess.run(['cscope', '-b', '-c', '-k'],
-                           cwd=project_path, check=True)
-
-        with log_time("ctags database creation"):
-            subprocess.run(['ctags', '--fields=+i', '-n', '-L', './cscope.files'],
-                           cwd=project_path, check=True)
+def create_cq_db(project_path, jobs=None):
+    # waits if another worker is already building it, see helper/cqbuild.py
+    build_cq_db(project_path, jobs)
+
+
+def build_indexes(project_paths, jobs=None, force=False, incremental=False):
+    """
+    Build (or with `incremental` refresh) the cq.db of several projects, see
+    helper/cqbuild.py; the index of helper/cindex.py if cscope, ctags or
+    codequery are not installed
+    """
+    if __HAS_DEPENDENCY:
+        build_cq_dbs(project_paths, jobs, force, incremental)
+        return
+    for project_path in dict.fromkeys(project_paths):
+        if __exist_db_file(project_path):
+            logging.warning(f"{__get_db_file(project_path)} is used as is, "
+                            f"cscope/ctags/cqmakedb are needed to build it")
+            continue
+        # the index is rebuilt as a whole, refreshing it means rebuilding it if a source changed
+        build_index(project_path, jobs, force, refresh=incremental)
+
+
+def __open_index(project_path):
+    """
+    The CodeQueryDB to query: cq.db (built if missing), or the index of
+    helper/cindex.py if cscope, ctags or codequery are not installed
+    """
+    if __exist_db_file(project_path) or __HAS_DEPENDENCY:
+        if not __exist_db_file(project_path):
+            logging.info("Creating codequery database")
+            create_cq_db(project_path)
+        return open_cq_db(__get_db_file(project_path), project_path)
+    return open_cq_db(build_index(project_path), project_path)
+
+
+def __native_lookup(project_path, name, sym_types):
+    """
+    [[file, line], ...] read from the index in-process, None if it cannot
+    be queried directly (then cqsearch is used)
+    """
+    cq_db = __open_index(project_path)
+    if cq_db is None:
+        return None
+    return [[symbol.file, str(symbol.line)] for symbol in cq_db.lookup(name, sym_types)]
 
-        with log_time("codequery database creation"):
-            subprocess.run(['cqmakedb', '-s', './cq.db', '-c' './cscope.out', '-t', './tags', '-p'],
-                           cwd=project_path, check=True)
 
-    except subprocess.CalledProcessError:
-        raise Exception("Error creating codequery database")
+def find_symbols(project_path, names, sym_types=None):
+    """
+    Batched lookup: {name: [Symbol(name, file, line, kind, text), ...]},
+    None if the index cannot be queried directly
+    """
+    cq_db = __open_index(project_path)
+    if cq_db is None:
+        return None
+    return cq_db.lookup_many(names, sym_types)
 
 
 def __get_func_cq(project_path, function_name):
@@ -76,16 +106,13 @@ def __get_func_cq(project_path, function_name):
     # Construct the cqsearch command
     cqsearch_db = __get_db_file(project_path)
 
+    # functions and macros (same as `cqsearch -p 2`): function-like macros such as `roundup`
+    res = __native_lookup(project_path, function_name, ['$', '#'])
+    if res is not None:
+        return res
     if not __exist_db_file(project_path):
-        # print(f"Error: No .db file found in {project_path}", file=sys.stderr)
-        if not __HAS_DEPENDENCY:
-            logging.error(
-                "Error: Missing cscope, ctags, or codequery. Please install them first.")
-            # print("Error: Missing cscope, ctags, or codequery. Please install them first.", file=sys.stderr)
-            return None
-
-        logging.info("Creating codequery database")
-        create_cq_db(project_path)
+        logging.error("Error: Cannot index the project without cscope, ctags, or codequery.")
+        return None
 
     command = [
         'cqsearch',
@@ -103,7 +130,8 @@ def __get_func_cq(project_path, function_name):
             command, capture_output=True, text=True, check=True)
     except subprocess.CalledProcessError as e:
         print(f"Error executing cqsearch: {e}")
-        return res
+        # not "not found", must not be cached as such
+        return None
 
     # Extract the relevant file path from the output
     output_lines = result.stdout.splitlines()
@@ -136,16 +164,13 @@ def __get_struct_cq(project_path, struct_name):
     # Construct the cqsearch command
     cqsearch_db = __get_db_file(project_path)
 
+    # class/struct definitions (same as `cqsearch -p 3`)
+    res = __native_lookup(project_path, struct_name, ['c', 's'])
+    if res is not None:
+        return res
     if not __exist_db_file(project_path):
-        # print(f"Error: No .db file found in {project_path}", file=sys.stderr)
-        if not __HAS_DEPENDENCY:
-            logging.error(
-                "Error: Missing cscope, ctags, or codequery. Please install them first.")
-            # print("Error: Missing cscope, ctags, or codequery. Please install them first.", file=sys.stderr)
-            return None
-
-        logging.info("Creating codequery database")
-        create_cq_db(project_path)
+        logging.error("Error: Cannot index the project without cscope, ctags, or codequery.")
+        return None
 
     command = [
         'cqsearch',
@@ -163,7 +188,8 @@ def __get_struct_cq(project_path, struct_name):
             command, capture_output=True, text=True, check=True)
     except subprocess.CalledProcessError as e:
         print(f"Error executing cqsearch: {e}")
-        return res
+        # not "not found", must not be cached as such
+        return None
 
     # Extract the relevant file path from the output
     output_lines = result.stdout.splitlines()
@@ -191,167 +217,162 @@ def __get_struct_cq(project_path, struct_name):
     return res
 
 
-def __get_union_cq(project_path, union_name):
-    # some "struct" are actually "union", but we can't find from `__get_struct_cq`
-    # find symbole and `grep -e 'union.*{'`
-    
-    cq_db = __get_db_file(project_path)
-    command = [
-        'cqsearch',
-        '-s', cq_db,
-        '-p', '1',
-        '-u',
-        '-e',
-        '-t', union_name
-    ]
-    
-    res = []
-    cqsearch_result = subprocess.run(command, capture_output=True, text=True)
-    if cqsearch_result.returncode != 0:
-        logging.error("Error running cqsearch command.")
-        return None
-    
-    result = subprocess.run(
-        ['grep', '-e', 'union.*{'], input=cqsearch_result.stdout, capture_output=True, text=True)
-    if result.returncode not in [0, 1]:
-        logging.error("Error filtering cqsearch results with grep.")
-        return None
-    
-    output_lines = result.stdout.splitlines()
-    for line in output_lines:
-        line = line.split('\t')[1]
-        
-        if '$HOME' in line:
-            base_dir_pattern = os.path.basename(project_path)
-            start_index = line.find(base_dir_pattern)
-            if start_index != -1:
-                res.append(
-                    line[start_index + len(base_dir_pattern) + 1:].split(':'))
-        else:
-            base_dir_pattern = os.path.basename(project_path)
-            relative_path_start_index = line.find(
-                base_dir_pattern) + len(base_dir_pattern)
-            relative_path = line[relative_path_start_index:].split(':')
-            res.append(relative_path)
-            
-    return res
-    
+# kinds of definition a `cqsearch -p 1` line can be, most likely first;
+# a line is a candidate of every kind whose pattern it matches
+# struct: most global variables are an instance of a struct (or array of struct)
+# static: other file-scope variables
+# define/enum: macros and enum constants (patterns depend on the name)
+# union: some "struct" are actually "union", `-p 3` does not find them
+DEFINITION_KINDS = ('struct', 'static', 'define', 'enum', 'union')
+
+__DEFINITION_PATTERNS = {
+    'struct': re.compile(r'struct'),
+    'static': re.compile(r'static'),
+    'union': re.compile(r'union.*{'),
+}
+
+
+def __name_patterns(name):
+    return {
+        'define': re.compile(r'define ' + re.escape(name)),
+        'enum': re.compile(re.escape(name) + r','),
+    }
+
+
+def __classify(name, lines):
+    """
+    {kind: [[file, line], ...]} for every kind of DEFINITION_KINDS,
+    `lines` is [([file, line], text), ...]
+    """
+    patterns = dict(__DEFINITION_PATTERNS, **__name_patterns(name))
+    candidates = {kind: [] for kind in DEFINITION_KINDS}
+    for location, text in lines:
+        for kind in DEFINITION_KINDS:
+            if patterns[kind].search(text):
+                candidates[kind].append(location)
+    return candidates
+
+
+def __parse_cqsearch_line(project_path, line):
+    """
+    ([file, line], text) of a `cqsearch -u -e` output line "symbol\tpath:line\ttext"
+    """
+    fields = line.split('\t')
+    path = fields[1]
+    text = fields[2] if len(fields) > 2 else line
+    base_dir_pattern = os.path.basename(project_path)
+    start_index = path.find(base_dir_pattern)
+    if '$HOME' in path:
+        if start_index == -1:
+            return None
+        return path[start_index + len(base_dir_pattern) + 1:].split(':'), text
+    return path[start_index + len(base_dir_pattern):].split(':'), text
 
 
-def __get_global_var_cq(project_path, var_name, grep_pattern='struct'):
-    # def find_function_location(function_name, cqsearch_db, project_path):
-    # Construct the cqsearch command
+def __get_definition_candidates(project_path, name):
+    """
+    Every definition candidate of `name` by kind (see DEFINITION_KINDS),
+    from a single symbol query; None if the symbol search failed
+    """
     cqsearch_db = __get_db_file(project_path)
 
+    cq_db = __open_index(project_path)
+    if cq_db is not None:
+        return __classify(name, [([symbol.file, str(symbol.line)], symbol.text)
+                                 for symbol in cq_db.lookup(name)])
     if not __exist_db_file(project_path):
-        # print(f"Error: No .db file found in {project_path}", file=sys.stderr)
-        if not __HAS_DEPENDENCY:
-            logging.error(
-                "Error: Missing cscope, ctags, or codequery. Please install them first.")
-            # print("Error: Missing cscope, ctags, or codequery. Please install them first.", file=sys.stderr)
-            return None
-
-        logging.info("Creating codequery database")
-        create_cq_db(project_path)
+        logging.error("Error: Cannot index the project without cscope, ctags, or codequery.")
+        return None
 
+    # EXAMPLE: `cqsearch -s cq.db -p 1 -u -e -t "slim_rx_cfg"`
     command = [
         'cqsearch',
         '-s', cqsearch_db,
         '-p', '1',
         '-u',
         '-e',
-        '-t', var_name
+        '-t', name
     ]
-    res = []
-
-    # rune cqsearch and "grep 'struct'" with pipe
-    # heuristics: most global variables are an instance of a struct (or array of struct)
-    # EXAMPLE: `cqsearch -s cq.db -p 1 -u -e -t "slim_rx_cfg"
-
-    # run cqsearch
     cqsearch_result = subprocess.run(command, capture_output=True, text=True)
     if cqsearch_result.returncode != 0:
         logging.error("Error running cqsearch command.")
         return None
 
-    # pipe the output of cqsearch to grep pattern
-    result = subprocess.run(
-        ['grep', grep_pattern], input=cqsearch_result.stdout, capture_output=True, text=True)
-    # grep returns 1 if no matches are found
-    if result.returncode not in [0, 1]:
-        logging.error("Error filtering cqsearch results with grep.")
-        return None
-
-    # Extract the relevant file path from the output
-    output_lines = result.stdout.splitlines()
-
-    for line in output_lines:
-        line = line.split('\t')[1]
-        if '$HOME' in line:
-            # Extract the path after the project base dir
-            base_dir_pattern = os.path.basename(project_path)
-            start_index = line.find(base_dir_pattern)
-            if start_index != -1:
-                # Adjust to get the path relative to the project's base directory
-                # relative_path = line[start_index + len(base_dir_pattern) + 1:].split(':')[0]
-                # return line[start_index + len(base_dir_pattern) + 1:].split(':')
-                res.append(
-                    line[start_index + len(base_dir_pattern) + 1:].split(':'))
-        else:
-            base_dir_pattern = os.path.basename(project_path)
-            relative_path_start_index = line.find(
-                base_dir_pattern) + len(base_dir_pattern)
-            relative_path = line[relative_path_start_index:].split(':')
-            # return relative_path
-            res.append(relative_path)
-
-    return res
+    lines = [__parse_cqsearch_line(project_path, line) for line in cqsearch_result.stdout.splitlines()]
+    return __classify(name, [line for line in lines if line is not None])
+
+
+def __first_candidates(candidates, kinds):
+    # the candidates of the first kind in `kinds` that has any
+    for kind in kinds:
+        if candidates[kind]:
+            return candidates[kind]
+    return None
+
+
+def __index_version(proj):
+    """
+    Version of the index of `proj` (cq.db, or the one of helper/cindex.py)
+    the lookup cache keys are scoped to, a rebuilt (or refreshed) index is a
+    new file with a new mtime; None if there is no index yet
+    """
+    for index_file in [__get_db_file(proj), os.path.join(proj, INDEX_FILE)]:
+        try:
+            stat = os.stat(index_file)
+        except FileNotFoundError:
+            continue
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+    return None
+
+
+def __cached_lookup(namespace, proj, name, lookup):
+    """
+    lookup() -> locations, None if the search could not run or [] if
+    `name` was not found, through the lookup cache; misses are cached
+    too (as []) until the index changes
+    """
+    version = __index_version(proj)
+    cache_key = f"{proj}:{version}:{name}"
+    res = lookup_cache.get(namespace, cache_key)
+    if res is None:
+        res = lookup()
+        if res is None:
+            return None
+        if version is None:
+            # the lookup built the index
+            version = __index_version(proj)
+            cache_key = f"{proj}:{version}:{name}"
+        lookup_cache.set(namespace, cache_key, res)
+    return res or None
 
 
 def get_func_def_codequery(proj, req_func):
-    with Cache(cache_dir+"/cache_cq", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj}:{req_func}"
-        if cache_key not in cache:
-            res = __get_func_cq(proj, req_func)
-            if res is None or len(res) == 0:
-                return None
-            cache[cache_key] = res
-        return cache[cache_key]
+    return __cached_lookup('cq_func', proj, req_func, lambda: __get_func_cq(proj, req_func))
 
 
 def get_struct_def_codequery(proj, req_struct):
-    with Cache(cache_dir+"/cache_cq_struct", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj}:{req_struct}"
-        if cache_key not in cache:
-            res = __get_struct_cq(proj, req_struct)
-            if res is None or len(res) == 0:
-                # try to find union
-                res = __get_union_cq(proj, req_struct)
-                if len(res) == 0 or res is None:
-                    return None
-            cache[cache_key] = res
-        return cache[cache_key]
-    
+    def _lookup():
+        res = __get_struct_cq(proj, req_struct)
+        if res:
+            return res
+        # try to find union
+        candidates = __get_definition_candidates(proj, req_struct)
+        if res is None or candidates is None:
+            return None
+        return __first_candidates(candidates, ['union']) or []
+
+    return __cached_lookup('cq_struct', proj, req_struct, _lookup)
+
 
 def get_global_var_def_codequery(proj, req_var, is_marco=False):
-    with Cache(cache_dir+"/cache_cq_var", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj}:{req_var}"
-        if cache_key not in cache:
-            if is_marco:
-                res = __get_global_var_cq(proj, req_var, 'define '+req_var)
-                if res is None or len(res) == 0:
-                    # considering "enum" as well
-                    res = __get_global_var_cq(proj, req_var, req_var + ',')
-                    if res is None or len(res) == 0:
-                        return None
-            else:
-                res = __get_global_var_cq(proj, req_var)
-                if res is None or len(res) == 0:
-                    res = __get_global_var_cq(proj, req_var, 'static')
-                    if res is None or len(res) == 0:
-                        return None
-            cache[cache_key] = res
-        return cache[cache_key]
+    def _lookup():
+        candidates = __get_definition_candidates(proj, req_var)
+        if candidates is None:
+            return None
+        # considering "enum" as well for macros
+        kinds = ['define', 'enum'] if is_marco else ['struct', 'static']
+        return __first_candidates(candidates, kinds) or []
+
+    # a name is looked up as a macro and as a variable with different candidates
+    name = f"{req_var}:macro" if is_marco else req_var
+    return __cached_lookup('cq_var', proj, name, _lookup)
@@ -0,0 +1,349 @@
+"""
+Build of a project's CodeQuery database (`cq.db`).
+
+`find` lists the sources, then `cscope -b` and ctags (split in shards, one
+per core, merged into one sorted `tags`) run in parallel, and `cqmakedb`
+combines them. Everything is written in a temporary directory inside the
+project and renamed into place, so a reader never sees a partial `cq.db`.
+A lock file makes concurrent builders (workers or projects sharing a
+kernel tree) wait for the one that got there first instead of clobbering
+`cscope.files`/`tags`.
+
+`refresh_cq_db` (`--incremental`) indexes again only the sources changed
+since the last build, found with `git diff` against the revision recorded
+in `cq.manifest.json`, or by mtime and size outside of git work trees.
+
+    python -m helper.cqbuild <project dir> [--jobs N] [--force | --incremental]
+"""
+import fcntl
+import glob
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DB_FILE = 'cq.db'
+LOCK_FILE = 'cq.db.lock'
+MANIFEST_FILE = 'cq.manifest.json'
+__TMP_PREFIX = '.cq-build-'
+
+# sources indexed, as `find . -type f ( -name '*.c' -o ... )`
+SOURCE_PATTERNS = ['*.c', '*.cpp', '*.h', '*.hpp']
+
+
+@contextmanager
+def build_lock(project_path):
+    """
+    Exclusive lock of the index files of `project_path`, waits for the current holder
+    """
+    with open(os.path.join(project_path, LOCK_FILE), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info(f"Waiting for the codequery database build of {project_path}")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def __run(command, cwd, desc):
+    start_time = time.perf_counter()
+    try:
+        subprocess.run(command, cwd=cwd, check=True)
+    except subprocess.CalledProcessError:
+        raise Exception(f"Error creating codequery database ({desc} failed)")
+    logging.info(f"{desc} took {time.perf_counter() - start_time} seconds")
+
+
+def __list_sources(project_path, files_path):
+    find_names = []
+    for pattern in SOURCE_PATTERNS:
+        find_names += ['-o', '-name', pattern]
+    with open(files_path, 'w') as f:
+        subprocess.run(['find', '.', '-type', 'f', '('] + find_names[1:] + [')'],
+                       cwd=project_path, stdout=f, check=True)
+    with open(files_path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def __is_tag_header(line):
+    return line.startswith(b'!_TAG_')
+
+
+def merge_tags(shard_paths, tags_path):
+    """
+    Merge sorted ctags files into one sorted `tags` (the pseudo-tag header of the first shard is kept)
+    """
+    shards = [open(path, 'rb') for path in shard_paths]
+    try:
+        with open(tags_path, 'wb') as out:
+            entries = []
+            for i, shard in enumerate(shards):
+                header = []
+                line = shard.readline()
+                while line and __is_tag_header(line):
+                    header.append(line)
+                    line = shard.readline()
+                if i == 0:
+                    out.writelines(header)
+                # the first entry was read along with the header
+                entries.append(itertools.chain([line] if line else [], shard))
+            out.writelines(heapq.merge(*entries))
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+def __ctags(build_dir, sources, jobs):
+    shards = [sources[i::jobs] for i in range(jobs)]
+    shards = [shard for shard in shards if shard]
+    shard_paths = []
+    commands = []
+    for i, shard in enumerate(shards):
+        list_path = os.path.join(build_dir, f'tags.{i}.files')
+        with open(list_path, 'w') as f:
+            f.write('\n'.join(shard) + '\n')
+        shard_paths.append(os.path.join(build_dir, f'tags.{i}'))
+        commands.append(['ctags', '--fields=+i', '-n', '-f', shard_paths[-1], '-L', list_path])
+    return shard_paths, commands
+
+
+def __git(project_path, *args):
+    # None if `project_path` is not in a git work tree (or git is missing)
+    try:
+        result = subprocess.run(['git', *args], cwd=project_path, capture_output=True, text=True, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return result.stdout
+
+
+def __git_revision(project_path):
+    revision = __git(project_path, 'rev-parse', 'HEAD')
+    return revision.strip() if revision else None
+
+
+def __stat_sources(project_path, sources):
+    files = {}
+    for source in sources:
+        try:
+            stat = os.stat(os.path.join(project_path, source))
+        except FileNotFoundError:
+            continue
+        files[source] = [stat.st_mtime_ns, stat.st_size]
+    return files
+
+
+def read_manifest(project_path):
+    """
+    What the current `cq.db` was built from (see __write_manifest), None if unknown
+    """
+    try:
+        with open(os.path.join(project_path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def __git_changed(project_path, revision):
+    # sources changed since `revision` (between the revisions or in the work tree) and untracked ones
+    diff = __git(project_path, 'diff', '--name-only', '--no-renames', '--relative', revision)
+    untracked = __git(project_path, 'ls-files', '--others', '--exclude-standard')
+    if diff is None or untracked is None:
+        return None
+    return {'./' + path for path in (diff + untracked).splitlines() if path}
+
+
+def __write_manifest(project_path, build_dir, sources, index_version):
+    """
+    The manifest of a build: the git revision of the tree if it is a git
+    work tree (changed files are then found with `git diff`, only the files
+    differing from the revision are stat'ed), otherwise the mtime and size
+    of every source; `index_version` counts the builds
+    """
+    revision = __git_revision(project_path)
+    dirty = __git_changed(project_path, revision) if revision else None
+    if dirty is None:
+        revision = None
+        files = __stat_sources(project_path, sources)
+    else:
+        files = dict.fromkeys(sources)
+        files.update(__stat_sources(project_path, dirty & files.keys()))
+    manifest = {
+        'index_version': index_version,
+        'revision': revision,
+        'files': files,
+    }
+    with open(os.path.join(build_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+
+def changed_sources(project_path, manifest, sources):
+    """
+    (modified, added, removed) sources since the build of `manifest`,
+    `sources` is the current list (relative paths as in cscope.files)
+    """
+    old, new = set(manifest['files']), set(sources)
+    kept = old & new
+    candidates = kept
+    if manifest.get('revision'):
+        listed = __git_changed(project_path, manifest['revision'])
+        if listed is not None:
+            # a file dirty at that build differs from the index when it is
+            # back to the revision (e.g. `git checkout`), git does not list it
+            dirty = {source for source in kept if manifest['files'][source] is not None}
+            candidates = (listed | dirty) & kept
+        else:
+            logging.warning(f"Cannot diff {project_path} against {manifest['revision']}, comparing mtimes")
+    # a file without mtime and size was clean at that build
+    stats = __stat_sources(project_path, candidates)
+    modified = {source for source in candidates
+                if manifest['files'][source] is None or stats.get(source) != manifest['files'][source]}
+    return modified, new - old, old - new
+
+
+def __filter_tags(tags_path, out_path, dropped):
+    # the entries of `dropped` files removed, the order (and so the sorting) is kept
+    dropped = {path.encode('utf-8') for path in dropped}
+    with open(tags_path, 'rb') as tags, open(out_path, 'wb') as out:
+        for line in tags:
+            fields = line.split(b'\t', 2)
+            if len(fields) > 1 and fields[1] in dropped and not __is_tag_header(line):
+                continue
+            out.write(line)
+
+
+def __build(project_path, build_dir, jobs, manifest=None, changes=None):
+    """
+    cscope.out, tags and cq.db of `project_path` in `build_dir`; with the
+    `manifest` of the current build and its `changes`, only the changed
+    sources are indexed again
+    """
+    start_time = time.perf_counter()
+    files_path = os.path.join(build_dir, 'cscope.files')
+    sources = __list_sources(project_path, files_path)
+    cscope_out = os.path.join(build_dir, 'cscope.out')
+    tags_path = os.path.join(build_dir, 'tags')
+
+    if manifest is None:
+        logging.info(f"Indexing {len(sources)} source files of {project_path} with {jobs} jobs")
+        shard_paths, ctags_commands = __ctags(build_dir, sources, jobs)
+    else:
+        modified, added, removed = changes
+        logging.info(f"Indexing {len(modified)} modified and {len(added)} added source files of {project_path}, "
+                     f"dropping {len(removed)} removed ones")
+        # cscope reuses the cross-references of the sources older than its database
+        shutil.copy2(os.path.join(project_path, 'cscope.out'), cscope_out)
+        old_tags = os.path.join(build_dir, 'tags.old')
+        __filter_tags(os.path.join(project_path, 'tags'), old_tags, modified | removed)
+        shard_paths, ctags_commands = __ctags(build_dir, sorted(modified | added), jobs)
+        shard_paths = [old_tags] + shard_paths
+
+    with ThreadPoolExecutor(max_workers=len(ctags_commands) + 1) as executor:
+        futures = [executor.submit(__run, ['cscope', '-b', '-c', '-k', '-i', files_path, '-f', cscope_out],
+                                   project_path, "cscope database creation")]
+        futures += [executor.submit(__run, command, project_path, f"ctags shard {i}")
+                    for i, command in enumerate(ctags_commands)]
+        for future in futures:
+            future.result()
+    merge_tags(shard_paths, tags_path)
+
+    # cqmakedb has no incremental mode, it reads the updated cscope.out and tags again
+    __run(['cqmakedb', '-s', os.path.join(build_dir, DB_FILE), '-c', cscope_out, '-t', tags_path, '-p'],
+          project_path, "codequery database creation")
+
+    index_version = manifest['index_version'] + 1 if manifest else 1
+    __write_manifest(project_path, build_dir, sources, index_version)
+
+    # the inputs first, cq.db last: its presence means the build is complete
+    for name in ['cscope.files', 'cscope.out', 'tags', MANIFEST_FILE, DB_FILE]:
+        os.replace(os.path.join(build_dir, name), os.path.join(project_path, name))
+    logging.info(f"Codequery database of {project_path} (index version {index_version}) "
+                 f"built in {time.perf_counter() - start_time} seconds")
+
+
+@contextmanager
+def __build_dir(project_path):
+    # left behind by an interrupted build
+    for stale in glob.glob(os.path.join(project_path, __TMP_PREFIX + '*')):
+        shutil.rmtree(stale, ignore_errors=True)
+    build_dir = tempfile.mkdtemp(prefix=__TMP_PREFIX, dir=project_path)
+    try:
+        yield build_dir
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def build_cq_db(project_path, jobs=None, force=False):
+    """
+    Build `cq.db` of `project_path` unless it exists (or `force`),
+    with `jobs` parallel ctags shards (default: one per core)
+    """
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    db_path = os.path.join(project_path, DB_FILE)
+    with build_lock(project_path):
+        if os.path.exists(db_path) and not force:
+            # built by whoever held the lock before us
+            return db_path
+        with __build_dir(project_path) as build_dir:
+            __build(project_path, build_dir, jobs)
+    return db_path
+
+
+def refresh_cq_db(project_path, jobs=None):
+    """
+    Bring `cq.db` of `project_path` up to date with its sources: only the
+    sources modified, added or removed since the last build are indexed
+    again; a full build if there is no database or manifest yet
+    """
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    db_path = os.path.join(project_path, DB_FILE)
+    with build_lock(project_path):
+        manifest = read_manifest(project_path)
+        inputs = [os.path.join(project_path, name) for name in [DB_FILE, 'cscope.out', 'tags']]
+        with __build_dir(project_path) as build_dir:
+            if manifest is None or not all(map(os.path.exists, inputs)):
+                logging.info(f"No manifest of the codequery database of {project_path}, building it")
+                __build(project_path, build_dir, jobs)
+                return db_path
+
+            sources = __list_sources(project_path, os.path.join(build_dir, 'cscope.files'))
+            changes = changed_sources(project_path, manifest, sources)
+            if not any(changes):
+                logging.info(f"Codequery database of {project_path} is up to date "
+                             f"(index version {manifest['index_version']})")
+                return db_path
+            __build(project_path, build_dir, jobs, manifest, changes)
+    return db_path
+
+
+def build_cq_dbs(project_paths, jobs=None, force=False, incremental=False):
+    """
+    Build (or with `incremental` refresh) the databases of several projects,
+    a kernel tree shared by projects is built once
+    """
+    for project_path in dict.fromkeys(os.path.realpath(path) for path in project_paths):
+        if incremental:
+            refresh_cq_db(project_path, jobs)
+        else:
+            build_cq_db(project_path, jobs, force)
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Build the CodeQuery database of a project')
+    parser.add_argument('project_path', type=str, nargs='+')
+    parser.add_argument('--jobs', type=int, help='Parallel ctags shards (default: one per core)', default=None)
+    parser.add_argument('--force', action='store_true', help='Rebuild an existing database', default=False)
+    parser.add_argument('--incremental', action='store_true', help='Index only the sources changed since the last build', default=False)
+    args = parser.parse_args()
+    build_cq_dbs(args.project_path, args.jobs, args.force, args.incremental)
@@ -0,0 +1,146 @@
+"""
+Symbol lookups straight from CodeQuery's `cq.db` (an SQLite file written by
+`cqmakedb`), instead of one `cqsearch` process per lookup.
+
+Each definition found by cscope/ctags is a `symtbl` row whose `symType` is
+the cscope mark of the definition ('$' function, 's' struct, ...), linked to
+its line in `linestbl` and to its file in `filestbl`.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+# symType -> kind
+SYMBOL_KINDS = {
+    '$': 'function',
+    '#': 'macro',
+    'c': 'class',
+    's': 'struct',
+    'u': 'union',
+    'e': 'enum',
+    'g': 'global',
+    'm': 'member',
+    't': 'typedef',
+    'l': 'local',
+    'p': 'param',
+}
+
+# the tables/columns the queries below rely on
+_EXPECTED_SCHEMA = {
+    'symtbl': {'symName', 'symType', 'lineID'},
+    'linestbl': {'lineID', 'linenum', 'fileID', 'linetext'},
+    'filestbl': {'fileID', 'filePath'},
+}
+
+# SQLite's default limit of host parameters is 999
+_BATCH_SIZE = 500
+
+# file: path relative to the project root, line: 1-based, kind: see SYMBOL_KINDS
+Symbol = namedtuple('Symbol', ['name', 'file', 'line', 'kind', 'text'])
+
+
+def project_relative_path(project_path, path):
+    """
+    `cqmakedb` stores absolute paths (with the home directory as "$HOME"),
+    the lookups return them relative to the project root
+    """
+    base_dir = os.path.basename(os.path.normpath(project_path))
+    start_index = path.find(base_dir + '/')
+    if start_index != -1:
+        return path[start_index + len(base_dir) + 1:]
+    return os.path.normpath(path)
+
+
+class CodeQueryDB:
+    """
+    Read-only connection to one `cq.db`, shared by the threads of a process
+    """
+
+    def __init__(self, db_path, project_path):
+        self.db_path = db_path
+        self.project_path = project_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.supported = self._check_schema()
+
+    def _check_schema(self):
+        try:
+            for table, columns in _EXPECTED_SCHEMA.items():
+                found = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table});")}
+                if not columns <= found:
+                    logging.warning(f"Unexpected schema of {self.db_path} ({table} has {sorted(found)}), "
+                                    f"falling back to cqsearch")
+                    return False
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"Cannot read {self.db_path}: {e}, falling back to cqsearch")
+            return False
+
+    def lookup_many(self, names, sym_types=None):
+        """
+        {name: [Symbol, ...]} of every name in `names`, ordered by file and line
+        (as cqsearch lists them), only the definitions of `sym_types` if given
+        """
+        results = {name: [] for name in names}
+        names = list(results)
+        for i in range(0, len(names), _BATCH_SIZE):
+            batch = names[i:i + _BATCH_SIZE]
+            query = f"""
+            SELECT s.symName, f.filePath, l.linenum, s.symType, l.linetext
+            FROM symtbl s
+            JOIN linestbl l ON s.lineID = l.lineID
+            JOIN filestbl f ON l.fileID = f.fileID
+            WHERE s.symName IN ({', '.join(['?'] * len(batch))})
+            """
+            params = list(batch)
+            if sym_types:
+                query += f" AND s.symType IN ({', '.join(['?'] * len(sym_types))})"
+                params += list(sym_types)
+            query += " ORDER BY f.filePath, l.linenum;"
+            with self._lock:
+                rows = self._conn.execute(query, params).fetchall()
+            for name, file_path, line, sym_type, text in rows:
+                results[name].append(Symbol(name, project_relative_path(self.project_path, file_path), line,
+                                            SYMBOL_KINDS.get(sym_type, sym_type), text or ''))
+        return results
+
+    def lookup(self, name, sym_types=None):
+        return self.lookup_many([name], sym_types)[name]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+__lock = threading.Lock()
+# (pid, db path) -> (db file identity, CodeQueryDB)
+__dbs = {}
+
+
+def open_cq_db(db_path, project_path):
+    """
+    The process' CodeQueryDB of `db_path`, reopened if the file was rebuilt;
+    None if the file is missing or its schema is not the one we query
+    """
+    try:
+        stat = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    key = (os.getpid(), db_path)
+    with __lock:
+        cached = __dbs.get(key)
+        if cached is not None and cached[0] == identity:
+            db = cached[1]
+        else:
+            if cached is not None:
+                cached[1].close()
+            try:
+                db = CodeQueryDB(db_path, project_path)
+            except sqlite3.Error as e:
+                logging.warning(f"Cannot open {db_path}: {e}, falling back to cqsearch")
+                return None
+            __dbs[key] = (identity, db)
+    return db if db.supported else None
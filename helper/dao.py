@@ -1,150 +1,331 @@
+import hashlib
 import psycopg2
+import threading
 from datetime import datetime
-from common.config import DB_CONFIG
+from common.config import DB_CONFIG, DB_WRITER, LOG_BLOBS
+from helper.batch_writer import BatchWriter
+from helper.schema import LOG_USAGE_COLUMNS, LOG_BLOB_COLUMNS
+from helper.storage import create_backend
 import logging
 
 def create_connection():
     return psycopg2.connect(**DB_CONFIG)
 
-__conn = create_connection()
+# Postgres (pooled) or SQLite, see STORAGE in common/config.py; connections are
+# opened on first use, so importing this module needs no database
+__backend = create_backend()
 
-def insert_log(prompt, response, model, round, case_id):
-    try:
-        cur = __conn.cursor()
-        query = """
-        INSERT INTO llm_logs (prompt, response, response_at, model, round, case_id) 
-        VALUES (%s, %s, %s, %s, %s, %s);
-        """
-        cur.execute(query, (prompt, response, datetime.now(), model, round, case_id))
-        __conn.commit()
+
+def __write_log(cur, columns, rows):
+    query = f"INSERT INTO llm_logs ({', '.join(columns)}) VALUES %s;"
+    __backend.execute_values(cur, query, rows)
+
+
+def __write_upserts(cur, columns, rows):
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns)
+    query = f"""
+    INSERT INTO cases (case_id, model, {', '.join(columns)}) VALUES %s
+    ON CONFLICT (case_id, model) DO UPDATE SET {updates};
+    """
+    __backend.execute_values(cur, query, rows)
+
+
+def __write_blobs(cur, columns, rows):
+    query = f"INSERT INTO llm_blobs ({', '.join(columns)}) VALUES %s ON CONFLICT (hash) DO NOTHING;"
+    __backend.execute_values(cur, query, rows)
+
+
+def __to_blobs(logs):
+    """
+    Move the large prompts/responses of the queued log rows to llm_blobs,
+    the rows keep their sha256 in prompt_hash/response_hash
+    """
+    blobs = {}
+    blob_logs = []
+    for columns, values in logs:
+        row = dict(zip(columns, values))
+        for column, hash_column in LOG_BLOB_COLUMNS.items():
+            text = row.get(column)
+            # every row gets the hash columns, short and large texts share a statement
+            row.setdefault(hash_column, None)
+            if text is not None and len(text) >= LOG_BLOBS['min_size']:
+                digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+                blobs[digest] = text
+                row[column] = None
+                row[hash_column] = digest
+        blob_logs.append((tuple(row), tuple(row.values())))
+    blob_rows = [(digest,) + __backend.encode_blob(text) for digest, text in blobs.items()]
+    return blob_logs, blob_rows
+
+
+def __group(logs, upserts):
+    """
+    Group the queued writes by column list, one statement per group (per run
+    of consecutive log rows, see below)
+    """
+    logs, blob_rows = __to_blobs(logs)
+    # blobs first, log rows point to them
+    statements = [(__write_blobs, ('hash', 'compression', 'data'), blob_rows)] if blob_rows else []
+    # consecutive rows with the same columns share a statement, the ids of
+    # llm_logs follow the order the rows were queued in
+    log_groups = []
+    for columns, values in logs:
+        if log_groups and log_groups[-1][0] == columns:
+            log_groups[-1][1].append(values)
+        else:
+            log_groups.append((columns, [values]))
+    upsert_groups = {}
+    for (case_id, model), row in upserts.items():
+        columns = tuple(sorted(row))
+        upsert_groups.setdefault(columns, []).append((case_id, model) + tuple(row[c] for c in columns))
+    return (statements +
+            [(__write_log, columns, rows) for columns, rows in log_groups] +
+            [(__write_upserts, columns, rows) for columns, rows in upsert_groups.items()])
+
+
+def __flush_batch(logs, upserts):
+    statements = __group(logs, upserts)
+
+    def _write_batch(conn):
+        cur = conn.cursor()
+        for write, columns, rows in statements:
+            write(cur, columns, rows)
+        conn.commit()
         cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
 
-def insert_or_update_varname(case_id, var_name, model):
     try:
-        cur = __conn.cursor()
-        query = """
-        INSERT INTO cases (case_id, var_name, model) 
-        VALUES (%s, %s, %s)
-        ON CONFLICT (case_id, model) DO UPDATE SET var_name = %s;
-        """
-        cur.execute(query, (case_id, var_name, model, var_name))
-        __conn.commit()
-        cur.close()
+        __backend.run(_write_batch)
+        return
     except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
+        logging.error(f"Batch write of {len(logs)} logs and {len(upserts)} cases failed, "
+                      f"writing them one by one: {error}")
 
-def insert_or_update_analysis(case_id, analysis_result, model):
+    # keep the good rows of a batch with a bad one
+    for write, columns, rows in statements:
+        for row in rows:
+            def _write_row(conn):
+                cur = conn.cursor()
+                write(cur, columns, [row])
+                conn.commit()
+                cur.close()
+            try:
+                __backend.run(_write_row)
+            except (Exception, psycopg2.DatabaseError) as error:
+                logging.error(error)
+
+
+# log rows and `cases` upserts are queued and committed in batches by a
+# background thread (see helper/batch_writer.py); everything is flushed at exit
+__writer = BatchWriter(__flush_batch, DB_WRITER['batch_size'], DB_WRITER['flush_interval'],
+                       background=DB_WRITER['write_behind'])
+
+
+def flush_writes():
+    """
+    Commit every queued write now
+    """
+    __writer.flush()
+
+
+def insert_log(prompt, response, model, round, case_id, usage=None):
+    """
+    usage: optional dict of the telemetry columns (`LLMResult.to_log_fields()`)
+    """
+    columns = ['prompt', 'response', 'response_at', 'model', 'round', 'case_id']
+    values = [prompt, response, datetime.now(), model, round, case_id]
+    for column, value in (usage or {}).items():
+        if column in LOG_USAGE_COLUMNS:
+            columns.append(column)
+            values.append(value)
+    __writer.add_log(columns, values)
+
+
+# columns of `cases` served from the prefetched table
+CASE_COLUMNS = ['var_name', 'analysis_result', 'sanitize_result', 'required_sanitizer', 'detected_sanitizer']
+
+# (case_id, model) -> {column: value} of every prefetched case,
+# complete for each (case prefix, model) in __prefetched
+__case_table = {}
+__prefetched = set()
+__case_lock = threading.Lock()
+
+
+def __like_prefix(prefix):
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def prefetch_cases(case_prefix, model):
+    """
+    Load every `cases` row of (case_prefix, model) with one query, the
+    find_*/get_* lookups of these cases are then answered from memory
+    """
+    flush_writes()
     try:
-        cur = __conn.cursor()
-        query = """
-        INSERT INTO cases (case_id, analysis_result, model) 
-        VALUES (%s, %s, %s)
-        ON CONFLICT (case_id, model) DO UPDATE SET analysis_result = %s;
+        query = f"""
+        SELECT case_id, {', '.join(CASE_COLUMNS)} FROM cases WHERE case_id LIKE %s ESCAPE '\\' AND model = %s;
         """
-        cur.execute(query, (case_id, analysis_result, model, analysis_result))
-        __conn.commit()
-        cur.close()
+        rows = __fetch(query, (__like_prefix(case_prefix), model), fetch_all=True)
     except (Exception, psycopg2.DatabaseError) as error:
         logging.error(error)
-        
-def insert_or_update_sanitizer(case_id, sanitizer_result, model):
+        return
+    with __case_lock:
+        for row in rows:
+            __case_table[(row[0], model)] = dict(zip(CASE_COLUMNS, row[1:]))
+        __prefetched.add((case_prefix, model))
+    logging.info(f"Prefetched {len(rows)} cases of {case_prefix} ({model})")
+
+
+def get_completed_cases(case_prefix, model, column):
+    """
+    ids of the cases of (case_prefix, model) whose `column` holds a result
+    ("error" is written for failed cases and does not count)
+    """
+    if (case_prefix, model) not in __prefetched:
+        prefetch_cases(case_prefix, model)
+    with __case_lock:
+        return {case_id for (case_id, m), row in __case_table.items()
+                if m == model and case_id.startswith(case_prefix) and row[column] not in (None, 'error')}
+
+
+def get_logged_responses(case_id, model):
+    """
+    [(round, prompt, response), ...] logged for the case, oldest first
+    """
     try:
-        cur = __conn.cursor()
         query = """
-        INSERT INTO cases (case_id, sanitize_result, model) 
-        VALUES (%s, %s, %s)
-        ON CONFLICT (case_id, model) DO UPDATE SET sanitize_result = %s;
+        SELECT round, prompt, response FROM llm_logs_full WHERE case_id = %s AND model = %s ORDER BY id;
         """
-        cur.execute(query, (case_id, sanitizer_result, model, sanitizer_result))
-        __conn.commit()
-        cur.close()
+        return __fetch(query, (case_id, model), fetch_all=True)
     except (Exception, psycopg2.DatabaseError) as error:
         logging.error(error)
-        
-def insert_or_update_req_sanitizer(case_id, req_sanitizer_result, model):
-    try:
-        cur = __conn.cursor()
-        query = """
-        INSERT INTO cases (case_id, required_sanitizer, model) 
-        VALUES (%s, %s, %s)
-        ON CONFLICT (case_id, model) DO UPDATE SET required_sanitizer = %s;
-        """
-        cur.execute(query, (case_id, req_sanitizer_result, model, req_sanitizer_result))
-        __conn.commit()
+        return []
+
+
+def __lookup_case(case_id, model, column):
+    """
+    (True, row) if the prefetched table knows the case, row is None if it has no `cases` row
+    """
+    with __case_lock:
+        row = __case_table.get((case_id, model))
+        if row is not None:
+            return True, (row[column],)
+        if any(model == m and case_id.startswith(prefix) for prefix, m in __prefetched):
+            return True, None
+    return False, None
+
+
+def __update_case(case_id, model, column, value):
+    with __case_lock:
+        row = __case_table.get((case_id, model))
+        if row is not None:
+            row[column] = value
+        elif any(model == m and case_id.startswith(prefix) for prefix, m in __prefetched):
+            row = dict.fromkeys(CASE_COLUMNS)
+            row[column] = value
+            __case_table[(case_id, model)] = row
+
+
+def __upsert_case(case_id, model, column, value):
+    __update_case(case_id, model, column, value)
+    __writer.upsert(case_id, model, column, value)
+
+
+def __get_case_column(case_id, model, column):
+    found, value = __writer.pending(case_id, model, column)
+    if found:
+        return (value,)
+    found, row = __lookup_case(case_id, model, column)
+    if found:
+        return row
+    return __select_case_column(case_id, model, column)
+
+
+def __fetch(query, params, fetch_all=False):
+    def _query(conn):
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall() if fetch_all else cur.fetchone()
         cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
-        
-def get_req_sanitizer(case_id, model):
+        return rows
+    return __backend.run(_query)
+
+
+def __select_case_column(case_id, model, column):
     try:
-        cur = __conn.cursor()
-        query = """
-        SELECT required_sanitizer FROM cases WHERE case_id = %s AND model = %s;
+        query = f"""
+        SELECT {column} FROM cases WHERE case_id = %s AND model = %s;
         """
-        cur.execute(query, (case_id, model))
-        req_sanitizer = cur.fetchone()
-        cur.close()
-        return req_sanitizer
+        return __fetch(query, (case_id, model))
     except (Exception, psycopg2.DatabaseError) as error:
         logging.error(error)
         return None
-    
-    
-def insert_or_update_detected_sanitizer(case_id, detected_sanitizer, model):
+
+
+__USAGE_SUMS = """
+        COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(reasoning_tokens),
+        SUM(cached_tokens), SUM(latency_ms), SUM(retries)
+"""
+
+
+def __select_usage(group_by, model, case_prefix):
     try:
-        cur = __conn.cursor()
-        query = """
-        INSERT INTO cases (case_id, detected_sanitizer, model) 
-        VALUES (%s, %s, %s)
-        ON CONFLICT (case_id, model) DO UPDATE SET detected_sanitizer = %s;
+        query = f"""
+        SELECT {group_by}, {__USAGE_SUMS} FROM llm_logs
+        WHERE model = %s AND case_id LIKE %s ESCAPE '\\' GROUP BY {group_by} ORDER BY {group_by};
         """
-        cur.execute(query, (case_id, detected_sanitizer, model, detected_sanitizer))
-        __conn.commit()
-        cur.close()
+        return __fetch(query, (model, __like_prefix(case_prefix)), fetch_all=True)
     except (Exception, psycopg2.DatabaseError) as error:
         logging.error(error)
+        return []
+
+
+def get_usage_by_stage(model, case_prefix=''):
+    """
+    [(stage, calls, input, output, reasoning, cached tokens, latency_ms, retries), ...]
+    """
+    flush_writes()
+    return __select_usage('stage', model, case_prefix)
+
+
+def get_usage_by_case(model, case_prefix=''):
+    """
+    [(case_id, stage, calls, input, output, reasoning, cached tokens, latency_ms, retries), ...]
+    """
+    flush_writes()
+    return __select_usage('case_id, stage', model, case_prefix)
+
+
+def insert_or_update_varname(case_id, var_name, model):
+    __upsert_case(case_id, model, 'var_name', var_name)
+
+
+def insert_or_update_analysis(case_id, analysis_result, model):
+    __upsert_case(case_id, model, 'analysis_result', analysis_result)
+
+
+def insert_or_update_sanitizer(case_id, sanitizer_result, model):
+    __upsert_case(case_id, model, 'sanitize_result', sanitizer_result)
+
+
+def insert_or_update_req_sanitizer(case_id, req_sanitizer_result, model):
+    __upsert_case(case_id, model, 'required_sanitizer', req_sanitizer_result)
+
+
+def get_req_sanitizer(case_id, model):
+    return __get_case_column(case_id, model, 'required_sanitizer')
+
+
+def insert_or_update_detected_sanitizer(case_id, detected_sanitizer, model):
+    __upsert_case(case_id, model, 'detected_sanitizer', detected_sanitizer)
 
 
 def get_detected_sanitizer(case_id, model):
-    try:
-        cur = __conn.cursor()
-        query = """
-        SELECT detected_sanitizer FROM cases WHERE case_id = %s AND model = %s;
-        """
-        cur.execute(query, (case_id, model))
-        sanitizer = cur.fetchone()
-        cur.close()
-        return sanitizer
-    except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
-        return None
+    return __get_case_column(case_id, model, 'detected_sanitizer')
+
 
 def find_analysis_result(case_id, model):
-    try:
-        cur = __conn.cursor()
-        query = """
-        SELECT analysis_result FROM cases WHERE case_id = %s AND model = %s;
-        """
-        cur.execute(query, (case_id, model))
-        analysis_result = cur.fetchone()
-        cur.close()
-        return analysis_result
-    except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
-        return None
-    
+    return __get_case_column(case_id, model, 'analysis_result')
+
+
 def find_case_varname(case_id, model):
-    try:
-        cur = __conn.cursor()
-        query = """
-        SELECT var_name FROM cases WHERE case_id = %s AND model = %s;
-        """
-        cur.execute(query, (case_id, model))
-        var_name = cur.fetchone()
-        cur.close()
-        return var_name
-    except (Exception, psycopg2.DatabaseError) as error:
-        logging.error(error)
-        return None
\ No newline at end of file
+    return __get_case_column(case_id, model, 'var_name')
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+# errors after which a connection is assumed dead (server restart, dropped socket, ...)
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class ConnectionPool:
+    """
+    Lazily filled pool of DB connections, safe to share between threads.
+    Each operation checks out its own connection, so concurrent cases no
+    longer wait on (or abort) each other's transactions. A forked child
+    drops the parent's connections and opens its own.
+    """
+
+    def __init__(self, connect, max_size=8, health_check_interval=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        # idle connections older than this are pinged before they are reused
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+    def _check_pid(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # the sockets belong to the parent, closing them here would break it
+                self._reset()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self):
+        self._check_pid()
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                logging.warning("Dropping a dead DB connection")
+                self._close(conn)
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken):
+        if not broken and not conn.closed:
+            try:
+                # leave no transaction open on an idle connection
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+                conn = None
+            except Exception:
+                pass
+        if conn is not None:
+            self._close(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def run(self, func, retries=1):
+        """
+        func(conn) on a pooled connection, retried on a fresh connection
+        if the connection turned out to be dead
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return func(conn)
+            except CONNECTION_ERRORS as error:
+                if attempt == retries:
+                    raise
+                logging.warning(f"DB connection lost, reconnecting: {error}")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
@@ -1,6 +1,6 @@
 import os
 import re
-from diskcache import Cache
+from helper.lookup_cache import lookup_cache
 
 FORBIDDEN_KEYWORDS_PATTERN = re.compile(r'\b(if|while|for|else|switch|do)\b')
 
@@ -8,7 +8,6 @@ FORBIDDEN_KEYWORDS_PATTERN = re.compile(r'\b(if|while|for|else|switch|do)\b')
 __location__ = os.path.realpath(
     os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
-cache_dir = "cache"
 # _special_cases = json.load(
 #     open(__location__ + os.sep + "special_cases.json", 'r'))
 
@@ -270,45 +269,49 @@ def read_func_second_part(file_path: str, line_no, proj_path):
     
 
 
+def __source_key(proj_path, file_path, line_no):
+    # scoped to the mtime and size of the source, an edited file is read again
+    stat = os.stat(os.path.join(proj_path, file_path))
+    return f"{proj_path}:{file_path}:{stat.st_mtime_ns}:{stat.st_size}:{line_no}"
+
+
 def get_func_start_line(file_path: str, line_no, proj_path):
-    with Cache(cache_dir+"/cache_func_read", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj_path}:{file_path}:{line_no}"
-
-        # Check if the result is already in the cache
-        if cache_key in cache:
-            real_lineno = cache[cache_key]
-            return real_lineno
-
-        # find the start line of the function
-        with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
-            lines = f.readlines()
-            if __is_marco_expend(lines[line_no - 1]):
-                return None
-            
-            # find the start of this func
-            line_start = line_no - 2
-            while line_start >= 0:
-                # if __is_func_start(lines[line_start]):
-                # if __is_func_start_v2(lines[line_start]):
-                if __is_func_start_v3(lines[line_start]):
-                    break
-                line_start -= 1
+    cache_key = __source_key(proj_path, file_path, line_no)
+
+    # Check if the result is already in the cache
+    real_lineno = lookup_cache.get('func_start', cache_key)
+    if real_lineno is not None:
+        return real_lineno
+
+    # find the start line of the function
+    with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
+        lines = f.readlines()
+        if __is_marco_expend(lines[line_no - 1]):
+            return None
+        
+        # find the start of this func
+        line_start = line_no - 2
+        while line_start >= 0:
+            # if __is_func_start(lines[line_start]):
+            # if __is_func_start_v2(lines[line_start]):
+            if __is_func_start_v3(lines[line_start]):
+                break
+            line_start -= 1
 
-            # find the start of the prototype line
-            # proto_start = line_start - 1
-            # while proto_start >= 0:
-            #     # if __is_line_end(lines[proto_start]):
-            #     #     break
-            #     if not lines[proto_start].startswith('\t'):
-            #         break
-            #     proto_start -= 1
-            # # 1-based -> 1-based
-            # proto_start += 1
+        # find the start of the prototype line
+        # proto_start = line_start - 1
+        # while proto_start >= 0:
+        #     # if __is_line_end(lines[proto_start]):
+        #     #     break
+        #     if not lines[proto_start].startswith('\t'):
+        #         break
+        #     proto_start -= 1
+        # # 1-based -> 1-based
+        # proto_start += 1
 
-            real_lineno = line_start + 1
-            cache[cache_key] = real_lineno
-            return real_lineno
+        real_lineno = line_start + 1
+        lookup_cache.set('func_start', cache_key, real_lineno)
+        return real_lineno
 
 
 def __read_func(file_path: str, line_number, proj_path):
@@ -317,14 +320,13 @@ def __read_func(file_path: str, line_number, proj_path):
 
     # version = proj_path.split(os.sep)[-1]
 
-    with Cache(cache_dir+"/cache_func_helper", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj_path}:{file_path}:{line_number}"
+    cache_key = __source_key(proj_path, file_path, line_number)
 
-        # Check if the result is already in the cache
-        if cache_key in cache:
-            func_def, comment_start = cache[cache_key]
-            return func_def, comment_start
+    # Check if the result is already in the cache
+    cached = lookup_cache.get('func_read', cache_key)
+    if cached is not None:
+        func_def, comment_start = cached
+        return func_def, comment_start
 
     with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
         lines = f.readlines()
@@ -370,7 +372,7 @@ def __read_func(file_path: str, line_number, proj_path):
                 i += 1
 
             res_def = ''.join(function_definition)
-            cache[cache_key] = res_def, comment_start
+            lookup_cache.set('func_read', cache_key, (res_def, comment_start))
             return res_def, comment_start
 
         # Include the implementation code up to the closing brace of the function
@@ -383,64 +385,62 @@ def __read_func(file_path: str, line_number, proj_path):
             i += 1
 
         res_def = ''.join(function_definition)
-        cache[cache_key] = res_def, comment_start
+        lookup_cache.set('func_read', cache_key, (res_def, comment_start))
         return res_def, comment_start
 
 
 def read_struct_def(file_path: str, line_no, proj_path):
-    with Cache(cache_dir+"/cache_struct_read", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj_path}:{file_path}:{line_no}"
-
-        # Check if the result is already in the cache
-        if cache_key in cache:
-            real_lineno = cache[cache_key]
-            return real_lineno
-
-        # find the start line of the struct
-        with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
-            lines = f.readlines()
-            real_lineno = line_no - 1;
-            if __is_marco_expend(lines[real_lineno]):
-                return None
-
-            res = ""
-            
-            while real_lineno < len(lines):
-                # res += lines[real_lineno]
-                cur_line = lines[real_lineno]
-                res += cur_line
-                if cur_line.endswith(";\n") and cur_line.startswith("}"):
-                    break
-                real_lineno += 1
-            
-            return res
+    cache_key = __source_key(proj_path, file_path, line_no)
+
+    # Check if the result is already in the cache
+    res = lookup_cache.get('struct_read', cache_key)
+    if res is not None:
+        return res
+
+    # find the start line of the struct
+    with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
+        lines = f.readlines()
+        real_lineno = line_no - 1;
+        if __is_marco_expend(lines[real_lineno]):
+            return None
+
+        res = ""
+        
+        while real_lineno < len(lines):
+            # res += lines[real_lineno]
+            cur_line = lines[real_lineno]
+            res += cur_line
+            if cur_line.endswith(";\n") and cur_line.startswith("}"):
+                break
+            real_lineno += 1
+        
+        lookup_cache.set('struct_read', cache_key, res)
+        return res
         
 def read_global_var(file_path, line_no, proj_path):
-    with Cache(cache_dir+"/cache_global_var_read", size_limit=1 * 1024 ** 3) as cache:
-        # Create a cache key using the function name and version, with size limit = 1GB
-        cache_key = f"{proj_path}:{file_path}:{line_no}"
-
-        # Check if the result is already in the cache
-        if cache_key in cache:
-            real_lineno = cache[cache_key]
-            return real_lineno
-
-        # find the start line of the struct
-        with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
-            lines = f.readlines()
-            real_lineno = line_no - 1;
-            if __is_marco_expend(lines[real_lineno]):
-                return None
-
-            res = ""
-            
-            while real_lineno < len(lines):
-                # res += lines[real_lineno]
-                cur_line = lines[real_lineno]
-                res += cur_line
-                if cur_line.endswith(";\n"):
-                    break
-                real_lineno += 1
-            
-            return res
\ No newline at end of file
+    cache_key = __source_key(proj_path, file_path, line_no)
+
+    # Check if the result is already in the cache
+    res = lookup_cache.get('global_var_read', cache_key)
+    if res is not None:
+        return res
+
+    # find the start line of the struct
+    with open(os.path.join(proj_path, file_path), 'r', errors='ignore') as f:
+        lines = f.readlines()
+        real_lineno = line_no - 1;
+        if __is_marco_expend(lines[real_lineno]):
+            return None
+
+        res = ""
+        
+        while real_lineno < len(lines):
+            # res += lines[real_lineno]
+            cur_line = lines[real_lineno]
+            res += cur_line
+            if cur_line.endswith(";\n"):
+                break
+            real_lineno += 1
+        
+        lookup_cache.set('global_var_read', cache_key, res)
+        return res
\ No newline at end of file
@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from diskcache import Cache
+
+from common.config import LOOKUP_CACHE
+
+
+class LookupCache:
+    """
+    Cache of the code lookups (codequery locations, function/struct/global
+    variable sources), shared by every lookup kind of the process.
+
+    Each kind has its own namespace in a single diskcache store that is
+    opened once per process, so all of them share one size budget (diskcache
+    evicts the least recently stored entries past `size_limit`). A bounded
+    in-memory LRU of `memory_items` entries sits in front of the disk, the
+    hot lookups of a run do not go to SQLite at all. Cached values are
+    shared between callers and must not be modified.
+    """
+
+    def __init__(self, directory, size_limit=2 * 1024 ** 3, memory_items=4096):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.memory_items = memory_items
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = None
+        self._pid = None
+
+    def _get_disk(self):
+        with self._lock:
+            # the SQLite connections of diskcache must not cross a fork
+            if self._disk is None or self._pid != os.getpid():
+                self._disk = Cache(self.directory, size_limit=self.size_limit, tag_index=True)
+                self._pid = os.getpid()
+            return self._disk
+
+    def _remember(self, memory_key, value):
+        with self._lock:
+            self._memory[memory_key] = value
+            self._memory.move_to_end(memory_key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, namespace, key, default=None):
+        memory_key = (namespace, key)
+        with self._lock:
+            if memory_key in self._memory:
+                self._memory.move_to_end(memory_key)
+                return self._memory[memory_key]
+        marker = object()
+        value = self._get_disk().get(memory_key, marker)
+        if value is marker:
+            return default
+        self._remember(memory_key, value)
+        return value
+
+    def set(self, namespace, key, value):
+        memory_key = (namespace, key)
+        self._get_disk().set(memory_key, value, tag=namespace)
+        self._remember(memory_key, value)
+
+    def clear(self, namespace=None):
+        """
+        Drop the entries of `namespace`, or everything
+        """
+        with self._lock:
+            for memory_key in [k for k in self._memory if namespace is None or k[0] == namespace]:
+                del self._memory[memory_key]
+        disk = self._get_disk()
+        count = disk.clear() if namespace is None else disk.evict(namespace)
+        logging.info(f"Dropped {count} cached lookups of {namespace or 'every namespace'}")
+
+    def close(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+
+lookup_cache = LookupCache(LOOKUP_CACHE['dir'], LOOKUP_CACHE['size_limit'], LOOKUP_CACHE['memory_items'])
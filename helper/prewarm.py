@@ -0,0 +1,117 @@
+"""
+Ahead-of-time retrieval for the symbols a conversation is almost certain
+to ask for: the functions of the call chains (functions of `func_list` for
+SARIF bug groups) and the structs named in their signatures.
+
+They are resolved on a process pool through the same callbacks the LLM
+triggers, so the codequery locations and the sources read from them are
+in the lookup cache (see helper/lookup_cache.py) before the first model
+call, and a `find_function`/`find_struct` during the analysis is a cache
+hit.
+"""
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from helper.callbacks import function_retrieve_callback, struct_retrieve_callback
+from helper.get_func_def import is_comment_line
+from helper.lookup_cache import lookup_cache
+
+STRUCT_PATTERN = re.compile(r'\bstruct\s+(\w+)')
+FUNCTION_NAME_PATTERN = re.compile(r'(\w+)\s*\(')
+# the source in a callback response
+CODE_BLOCK_PATTERN = re.compile(r'```c\n(.*?)```', re.DOTALL)
+
+
+def signature(definition):
+    """
+    The prototype of a function definition: its lines up to the opening
+    brace, without the comments above it
+    """
+    lines = [line for line in definition.splitlines() if not is_comment_line(line.strip())]
+    return ' '.join(lines).split('{')[0].strip()
+
+
+def __sarif_functions(bug_group):
+    for func_call in bug_group.func_list:
+        if func_call.full_function_definition:
+            yield func_call.full_function_definition
+
+
+def collect_symbols(bug_groups):
+    """
+    (functions, structs) named by the call chains and signatures of
+    `bug_groups`, in order of first appearance
+    """
+    functions, structs = {}, {}
+    for bug_group in bug_groups:
+        if hasattr(bug_group, 'func_list'):
+            for definition in __sarif_functions(bug_group):
+                proto = signature(definition)
+                name = FUNCTION_NAME_PATTERN.search(proto)
+                if name:
+                    functions[name.group(1)] = None
+                structs.update(dict.fromkeys(STRUCT_PATTERN.findall(proto)))
+            continue
+        for warn in bug_group.warns:
+            for order in warn.orders:
+                for context in order.contexts_and_instructions:
+                    functions.update(dict.fromkeys(name.strip() for name in context.call_chain if name.strip()))
+    return list(functions), list(structs)
+
+
+def _init_worker(cache_directory):
+    # a spawned worker opens the configured cache, not the one of the parent
+    if lookup_cache.directory != cache_directory:
+        lookup_cache.close()
+        lookup_cache.directory = cache_directory
+
+
+def _resolve_function(proj_dir, function_name):
+    """
+    Run `find_function` of `function_name`, the structs of its signature
+    """
+    response = function_retrieve_callback.call({'proj_dir': proj_dir}, [function_name])
+    structs = []
+    for code in CODE_BLOCK_PATTERN.findall(response):
+        structs += STRUCT_PATTERN.findall(signature(code))
+    return structs
+
+
+def _resolve_struct(proj_dir, struct_name):
+    struct_retrieve_callback.call({'proj_dir': proj_dir}, [struct_name])
+    return []
+
+
+def __resolve_all(executor, resolve, proj_dir, names):
+    found = {}
+    futures = {executor.submit(resolve, proj_dir, name): name for name in names}
+    for future in as_completed(futures):
+        try:
+            found.update(dict.fromkeys(future.result()))
+        except Exception as e:
+            logging.warning(f"Prewarming {futures[future]} failed: {e}")
+    return list(found)
+
+
+def prewarm(proj_dir, bug_groups, workers=None):
+    """
+    Resolve the functions and structs of `bug_groups` into the lookup cache,
+    on `workers` processes (default: one per core); a missing cq.db is built
+    by the first worker, the others wait for it (see helper/cqbuild.py)
+    """
+    start_time = time.perf_counter()
+    functions, structs = collect_symbols(bug_groups)
+    logging.info(f"Prewarming {len(functions)} functions and {len(structs)} structs of {len(bug_groups)} bug groups")
+    if not functions and not structs:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(lookup_cache.directory,)) as executor:
+        signature_structs = __resolve_all(executor, _resolve_function, proj_dir, functions)
+        structs = list(dict.fromkeys(structs + signature_structs))
+        __resolve_all(executor, _resolve_struct, proj_dir, structs)
+    logging.info(f"Prewarmed {len(functions)} functions and {len(structs)} structs "
+                 f"in {time.perf_counter() - start_time} seconds")
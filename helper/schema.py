@@ -0,0 +1,247 @@
+"""
+Versioned schema of the `cases`, `llm_logs` and `llm_blobs` tables.
+
+`migrate(backend)` applies the migrations a database has not seen yet (the
+applied versions are kept in `schema_version`); the storage backends run it
+on their first connection, `python -m helper.schema` runs it by hand.
+Add new migrations at the end of MIGRATIONS, never edit an applied one.
+
+On Postgres a new `llm_logs` is range-partitioned by month on `response_at`,
+so old sweeps can be dropped or archived a partition at a time. A `llm_logs`
+created before this module existed stays a plain table.
+
+Prompts and responses of at least LOG_BLOBS['min_size'] characters are
+stored once in `llm_blobs`, keyed by their sha256 (the kernel source of a
+first prompt is repeated across votes, models and reruns); the
+`llm_logs_full` view returns the log rows with their texts put back.
+"""
+import logging
+from datetime import datetime
+
+# telemetry columns of llm_logs, see prompts/telemetry.py
+LOG_USAGE_COLUMNS = {
+    'stage': 'TEXT',
+    'provider': 'TEXT',
+    'input_tokens': 'INTEGER',
+    'output_tokens': 'INTEGER',
+    'reasoning_tokens': 'INTEGER',
+    'cached_tokens': 'INTEGER',
+    'ttft_ms': 'INTEGER',
+    'latency_ms': 'INTEGER',
+    'retries': 'INTEGER',
+}
+
+# large texts of llm_logs stored in llm_blobs: text column -> hash column
+LOG_BLOB_COLUMNS = {
+    'prompt': 'prompt_hash',
+    'response': 'response_hash',
+}
+
+# serializes migrations of concurrent processes (pg_advisory_xact_lock key)
+__MIGRATION_LOCK_ID = 0x4c4d53
+
+# monthly llm_logs partitions kept ahead of the current month
+LOG_PARTITIONS_AHEAD = 1
+
+__CASES_TABLE = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    var_name TEXT,
+    analysis_result TEXT,
+    sanitize_result TEXT,
+    required_sanitizer TEXT,
+    detected_sanitizer TEXT,
+    PRIMARY KEY (case_id, model)
+);
+"""
+
+
+def __add_usage_columns(backend, cur):
+    backend.add_columns(cur, 'llm_logs', LOG_USAGE_COLUMNS)
+
+
+def __add_blob_columns(backend, cur):
+    backend.add_columns(cur, 'llm_logs', {column: 'TEXT' for column in LOG_BLOB_COLUMNS.values()})
+
+
+def __set_blob_compression(backend, cur):
+    # lz4 needs Postgres 14 built with lz4, the default (pglz) compression is kept otherwise
+    cur.execute("SAVEPOINT blob_compression;")
+    try:
+        cur.execute("ALTER TABLE llm_blobs ALTER COLUMN data SET COMPRESSION lz4;")
+        cur.execute("RELEASE SAVEPOINT blob_compression;")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT blob_compression;")
+        logging.info(f"Keeping the default compression of llm_blobs: {e}")
+
+
+def __logs_view(blob_text):
+    """
+    llm_logs_full: llm_logs with the prompts/responses moved to llm_blobs put back
+    """
+    columns = ", ".join(f"l.{column}" for column in LOG_USAGE_COLUMNS)
+    return f"""
+    CREATE VIEW llm_logs_full AS
+    SELECT l.id,
+           COALESCE({blob_text('p')}, l.prompt) AS prompt,
+           COALESCE({blob_text('r')}, l.response) AS response,
+           l.response_at, l.model, l.round, l.case_id, {columns}
+    FROM llm_logs l
+    LEFT JOIN llm_blobs p ON p.hash = l.prompt_hash
+    LEFT JOIN llm_blobs r ON r.hash = l.response_hash;
+    """
+
+
+# (version, description, {backend name: [SQL statement or func(backend, cursor), ...]})
+MIGRATIONS = [
+    (1, "cases and llm_logs tables", {
+        "postgres": [
+            __CASES_TABLE,
+            """
+            CREATE TABLE IF NOT EXISTS llm_logs (
+                id BIGSERIAL,
+                prompt TEXT,
+                response TEXT,
+                response_at TIMESTAMP NOT NULL DEFAULT now(),
+                model TEXT,
+                round TEXT,
+                case_id TEXT,
+                PRIMARY KEY (id, response_at)
+            ) PARTITION BY RANGE (response_at);
+            """,
+        ],
+        "sqlite": [
+            __CASES_TABLE,
+            """
+            CREATE TABLE IF NOT EXISTS llm_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prompt TEXT,
+                response TEXT,
+                response_at TIMESTAMP,
+                model TEXT,
+                round TEXT,
+                case_id TEXT
+            );
+            """,
+        ],
+    }),
+    (2, "llm_logs telemetry columns", {
+        "postgres": [__add_usage_columns],
+        "sqlite": [__add_usage_columns],
+    }),
+    (3, "lookup indexes", {
+        # text_pattern_ops lets `case_id LIKE 'msm-sound:%'` use the index under any collation
+        "postgres": [
+            "CREATE INDEX IF NOT EXISTS llm_logs_case_model_round_idx ON llm_logs (case_id, model, round);",
+            "CREATE INDEX IF NOT EXISTS cases_model_case_idx ON cases (model, case_id text_pattern_ops);",
+        ],
+        # SQLite uses plain indexes for LIKE prefixes with case_sensitive_like (see helper/storage.py)
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS llm_logs_case_model_round_idx ON llm_logs (case_id, model, round);",
+            "CREATE INDEX IF NOT EXISTS cases_model_case_idx ON cases (model, case_id);",
+        ],
+    }),
+    (4, "content-addressed llm_blobs for large prompts/responses", {
+        "postgres": [
+            "CREATE TABLE IF NOT EXISTS llm_blobs (hash TEXT PRIMARY KEY, compression TEXT, data TEXT NOT NULL);",
+            __set_blob_compression,
+            __add_blob_columns,
+            "DROP VIEW IF EXISTS llm_logs_full;",
+            __logs_view(lambda b: f"{b}.data"),
+        ],
+        # blobs may be zlib-compressed by the SQLite backend (LOG_BLOBS['compress'])
+        "sqlite": [
+            "CREATE TABLE IF NOT EXISTS llm_blobs (hash TEXT PRIMARY KEY, compression TEXT, data BLOB NOT NULL);",
+            __add_blob_columns,
+            "DROP VIEW IF EXISTS llm_logs_full;",
+            __logs_view(lambda b: f"CASE WHEN {b}.compression = 'zlib' THEN unzip_text({b}.data) ELSE {b}.data END"),
+        ],
+    }),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def __add_months(month_start, months):
+    month = month_start.month - 1 + months
+    return month_start.replace(year=month_start.year + month // 12, month=month % 12 + 1)
+
+
+def ensure_log_partitions(cur, now=None, ahead=LOG_PARTITIONS_AHEAD):
+    """
+    Create the monthly partitions of a partitioned llm_logs (Postgres only)
+    up to `ahead` months from now, plus a default partition
+    """
+    cur.execute("""
+    SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+    WHERE c.relname = 'llm_logs' AND pg_table_is_visible(c.oid);
+    """)
+    if cur.fetchone() is None:
+        return
+
+    month_start = (now or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for i in range(ahead + 1):
+        start = __add_months(month_start, i)
+        end = __add_months(month_start, i + 1)
+        # fails if the default partition already holds rows of that month, which must not abort the migration
+        cur.execute("SAVEPOINT llm_logs_partition;")
+        try:
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS llm_logs_y{start.year}m{start.month:02d} PARTITION OF llm_logs
+            FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}');
+            """)
+            cur.execute("RELEASE SAVEPOINT llm_logs_partition;")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT llm_logs_partition;")
+            logging.warning(f"Cannot create the llm_logs partition of {start:%Y-%m}: {e}")
+    cur.execute("CREATE TABLE IF NOT EXISTS llm_logs_default PARTITION OF llm_logs DEFAULT;")
+
+
+def current_version(cur):
+    cur.execute("SELECT MAX(version) FROM schema_version;")
+    return cur.fetchone()[0] or 0
+
+
+def migrate(backend):
+    """
+    Bring the database of `backend` to LATEST_VERSION
+    """
+    def _migrate(conn):
+        cur = conn.cursor()
+        if backend.name == "postgres":
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (__MIGRATION_LOCK_ID,))
+        else:
+            cur.execute("BEGIN IMMEDIATE;")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP
+        );
+        """)
+        version = current_version(cur)
+        for migration_version, description, steps in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            logging.info(f"Applying schema migration {migration_version}: {description}")
+            for step in steps[backend.name]:
+                if callable(step):
+                    step(backend, cur)
+                else:
+                    cur.execute(step)
+            cur.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s);",
+                        (migration_version, description, datetime.now()))
+        if backend.name == "postgres":
+            ensure_log_partitions(cur)
+        conn.commit()
+        cur.close()
+
+    backend.run(_migrate)
+
+
+if __name__ == "__main__":
+    from helper.storage import create_backend
+    logging.basicConfig(level=logging.INFO)
+    migrate(create_backend())
+    print(f"Schema is at version {LATEST_VERSION}")
@@ -0,0 +1,185 @@
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+from common.config import DB_CONFIG, DB_POOL, LOG_BLOBS, STORAGE
+from helper import schema
+
+# sqlite3's default datetime adapter is deprecated, store the same text it did
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+
+
+class _Backend:
+    name = None
+
+    def __init__(self, auto_migrate=True):
+        self._schema_ready = not auto_migrate
+        self._migrating = False
+        self._schema_lock = threading.RLock()
+
+    def _ensure_schema(self):
+        """
+        Apply the pending schema migrations once per process, before the first operation
+        """
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            # `migrate` runs its own operation through `run`
+            if self._schema_ready or self._migrating:
+                return
+            self._migrating = True
+            try:
+                schema.migrate(self)
+                self._schema_ready = True
+            except Exception as e:
+                logging.error(f"Schema migration on {self.name} failed: {e}")
+                raise
+            finally:
+                self._migrating = False
+
+    def run(self, func):
+        self._ensure_schema()
+        return self._run(func)
+
+
+class PostgresBackend(_Backend):
+    """
+    Postgres through the pooled psycopg2 connections of helper/db_pool.py
+    """
+    name = "postgres"
+
+    def __init__(self, config, max_size=8, health_check_interval=30.0, auto_migrate=True):
+        super().__init__(auto_migrate)
+        import psycopg2
+        from helper.db_pool import ConnectionPool
+        self._pool = ConnectionPool(lambda: psycopg2.connect(**config), max_size, health_check_interval)
+
+    def _run(self, func):
+        return self._pool.run(func)
+
+    def encode_blob(self, text):
+        """
+        (compression, data) stored in llm_blobs, Postgres compresses large TEXT values itself
+        """
+        return None, text
+
+    def execute_values(self, cur, query, rows):
+        """
+        Run `query`, whose "VALUES %s" stands for all of `rows`, as one statement
+        """
+        import psycopg2.extras
+        psycopg2.extras.execute_values(cur, query, rows)
+
+    def add_columns(self, cur, table, columns):
+        for column, column_type in columns.items():
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type};")
+
+
+class SQLiteBackend(_Backend):
+    """
+    Embedded SQLite database file in WAL mode: readers do not block the
+    writer thread and a commit does not wait for a network round trip.
+    Queries are written for psycopg2 (`%s` placeholders) and translated.
+    """
+    name = "sqlite"
+
+    def __init__(self, path, busy_timeout=30.0, auto_migrate=True, compress=False):
+        super().__init__(auto_migrate)
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.compress = compress
+        self._local = threading.local()
+
+    def _connection(self):
+        # one connection per thread (and per process, sqlite connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            # case ids are matched exactly, and a case sensitive LIKE 'prefix%' can use an index
+            conn.execute("PRAGMA case_sensitive_like=ON;")
+            # used by the llm_logs_full view to read compressed blobs
+            conn.create_function("unzip_text", 1, _unzip_text, deterministic=True)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _run(self, func):
+        conn = _SQLiteConnection(self._connection())
+        try:
+            return func(conn)
+        except Exception:
+            conn.rollback()
+            raise
+
+    def execute_values(self, cur, query, rows):
+        if not rows:
+            return
+        values = "(" + ", ".join(["?"] * len(rows[0])) + ")"
+        cur.executemany(query.replace("VALUES %s", "VALUES " + values), rows)
+
+    def encode_blob(self, text):
+        if self.compress:
+            return "zlib", zlib.compress(text.encode('utf-8'))
+        return None, text
+
+    def add_columns(self, cur, table, columns):
+        cur.execute(f"PRAGMA table_info({table});")
+        existing = {row[1] for row in cur.fetchall()}
+        for column, column_type in columns.items():
+            if column not in existing:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+
+
+def _unzip_text(data):
+    return zlib.decompress(data).decode('utf-8') if data is not None else None
+
+
+class _SQLiteCursor:
+    """
+    sqlite3 cursor accepting psycopg2-style `%s` placeholders
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        return self._cursor.execute(query.replace("%s", "?"), params)
+
+    def executemany(self, query, rows):
+        return self._cursor.executemany(query.replace("%s", "?"), rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _SQLiteCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def create_backend(kind=None):
+    """
+    The storage backend selected by STORAGE['backend'] ("postgres" or "sqlite")
+    """
+    kind = kind or STORAGE['backend']
+    if kind == "postgres":
+        return PostgresBackend(DB_CONFIG, DB_POOL['max_size'], DB_POOL['health_check_interval'],
+                               auto_migrate=STORAGE['auto_migrate'])
+    if kind == "sqlite":
+        logging.info(f"Using the SQLite database {STORAGE['sqlite_path']}")
+        return SQLiteBackend(STORAGE['sqlite_path'], auto_migrate=STORAGE['auto_migrate'],
+                             compress=LOG_BLOBS['compress'])
+    raise ValueError(f"Unknown storage backend {kind}")
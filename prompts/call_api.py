@@ -1,52 +1,27 @@
 import logging
-from time import sleep
-import openai
-import anthropic
-import os
 import re
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 # from helper.get_func_def import get_func_def
 from helper.dao import insert_log, find_case_varname, find_analysis_result, get_req_sanitizer, get_detected_sanitizer
 import helper.callbacks as cb
 
 from prompts.openrouter import open_router_request_single_provider
+from prompts.providers import route
+from prompts.rate_limit import rate_limiter, estimate_tokens
+from prompts.retry import RetryPolicy, LLMRequestError
+from prompts.response_cache import response_cache
+from prompts.conversation import anthropic_messages
+from prompts.telemetry import LLMResult, usage_tracker, get_stage
+from prompts.resume import resume_log
 
 import read_result as rr
-import ollama
 
 __CALLBACK_ITER_MAX_LIMIT = 15
 __API_RETRY_LIMIT = 3
-__RETRY_TIMEOUT = [60, 120, 300]
-
-api_key = "../openai.key"
-if 'OPENAI_API_KEY' not in os.environ:
-    if os.path.exists(api_key):
-        key_chain = open(api_key, 'r').read().splitlines()[0]
-        os.environ['OPENAI_API_KEY'] = key_chain
-
-claude_api_key = "../claude.key"
-if 'ANTHROPIC_API_KEY' not in os.environ:
-    if os.path.exists(claude_api_key):
-        key_chain = open(claude_api_key, 'r').read().splitlines()[0]
-        os.environ['ANTHROPIC_API_KEY'] = key_chain
-__claude_client = anthropic.Anthropic()
-
-deepseek_api_key = "../deepseek.key"
-if 'DEEPSEEK_API_KEY' not in os.environ:
-    if os.path.exists(deepseek_api_key):
-        key_chain = open(deepseek_api_key, 'r').read().splitlines()[0]
-        os.environ['DEEPSEEK_API_KEY'] = key_chain
-__deepseek_clinet = openai.OpenAI(
-    api_key=os.environ['DEEPSEEK_API_KEY'], base_url="https://api.deepseek.com")
-
-gemini_api_key = "../gemini.key"
-if 'GEMINI_API_KEY' not in os.environ:
-    if os.path.exists(gemini_api_key):
-        key_chain = open(gemini_api_key, 'r').read().splitlines()[0]
-        os.environ['GEMINI_API_KEY'] = key_chain
-__gemini_client = openai.OpenAI(
-    api_key=os.environ['GEMINI_API_KEY'], base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
+__retry_policy = RetryPolicy(max_retries=__API_RETRY_LIMIT)
 
 # def _get_tainted_value(task):
 #     case = find_case_varname(task["case_id, ctx.model)
@@ -109,273 +84,225 @@ CALLBACKS = {
 }
 
 
-def _ollama_do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
-    try:
-        response: ollama.ChatResponse = ollama.chat(model=model, messages=formatted_messages)
-        res = response['message']['content']
-        # if <think> xxx </think> in the response, remove it
-        res = re.sub(r'<think>.*?</think>', '', res, flags=re.DOTALL)
-        
-    except Exception as e:
-        logging.error(e)
-        emsg = str(e)
-
-        if last_emsg is not None and emsg[:60] == last_emsg[:60]:
-            logging.info("Same error")
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-        if _retry < __API_RETRY_LIMIT and ("context_length_exceeded" not in emsg):
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _ollama_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, emsg)
-        else:
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-    return res
-
-def _gemini_do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
-    try:
-        completion = __gemini_client.chat.completions.create(
-            model=model,
-            messages=formatted_messages,
-            n=1
-        )
-    except Exception as e:
-        logging.error(e)
-        emsg = str(e)
-
-        if last_emsg is not None and emsg[:60] == last_emsg[:60]:
-            logging.info("Same error")
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-        if _retry < __API_RETRY_LIMIT and ("context_length_exceeded" not in emsg):
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _gemini_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, emsg)
-        else:
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-    return completion.choices[0].message.content
-
-def _oai_do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
-    try:
-        # if model has "deepseek" in it, use deepseek API
-        if "deepseek" in model:
-            completion = __deepseek_clinet.chat.completions.create(
-                model=model,
-                messages=formatted_messages,
-                max_tokens=max_tokens,
-                stream=False,
-            )
-            # if 'reasoning_content' in completion.choices[0].message:
-            reasoning_content = getattr(
-                completion.choices[0].message, 'reasoning_content', None)
-            if reasoning_content:
-                logging.info(
-                    f"Deepseek API reasoning content: {reasoning_content}")
-        else:
-            completion = openai.chat.completions.create(
-                model=model,
-                messages=formatted_messages,
-            )
-
-    except Exception as e:
-        logging.error(e)
-        emsg = str(e)
-
-        if last_emsg is not None and emsg[:60] == last_emsg[:60]:
-            logging.info("Same error")
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-        if _retry < __API_RETRY_LIMIT and ("context_length_exceeded" not in emsg):
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, emsg)
-        else:
-            return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
-
-    return completion.choices[0].message.content
-
-def _claude_beta_do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
-    try:
-        # ststem_prompt = formatted_messages[0]['content']
-        # if len(formatted_messages) > 1:
-        #     formatted_messages = formatted_messages[1:]
-        # else:
-        #     formatted_messages = [
-        #         {
-        #             "role": "user",
-        #             "content": "Let's start the analysis: \n"
-        #         }
-        #     ]
-        
-        formatted_messages[0]['cache_control'] = {"type": "ephemeral"}
-        message = __claude_client.beta.messages.create(
-            model=model,
-            max_tokens=128000,
-            thinking={
-                "type": "enabled",
-                "budget_tokens": 32000
-            },
-            messages=formatted_messages, 
-            betas=["output-128k-2025-02-19"])
-    
-    except Exception as e:
-        msg = str(e)
-        logging.error(e)
-        if _retry < __API_RETRY_LIMIT and msg != last_emsg:
-            # sleep(1)
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, str(e))
-        else:
-            logging.error(f"Failed to call Claude API for many times")
-            return '{"ret": "failed", "response": "' + msg + '"}'
-
-    if message.content[0].type == "error" and ("exceeded" not in message.content[0].text):
+def _failed_response(emsg):
+    return '{"ret": "failed", "response": "' + emsg[:200] + '"}'
+
+
+def _ollama_do_request(client, model, temperature, max_tokens, formatted_messages):
+    response = client.chat(model=model, messages=formatted_messages)
+    res = response['message']['content']
+    # if <think> xxx </think> in the response, remove it
+    res = re.sub(r'<think>.*?</think>', '', res, flags=re.DOTALL)
+    return LLMResult(res, usage={'prompt_tokens': response.get('prompt_eval_count'),
+                                 'eval_count': response.get('eval_count')})
+
+def _open_router_do_request(client, model, temperature, max_tokens, formatted_messages):
+    # model: <provider>/<model name>
+    provider = model.split("/")[0]
+    model = model[len(provider) + 1:]
+    return open_router_request_single_provider(formatted_messages, model, provider, client)
+
+def _deepseek_do_request(client, model, temperature, max_tokens, formatted_messages):
+    completion = client.chat.completions.create(
+        model=model,
+        messages=formatted_messages,
+        max_tokens=max_tokens,
+        stream=False,
+    )
+    # if 'reasoning_content' in completion.choices[0].message:
+    reasoning_content = getattr(
+        completion.choices[0].message, 'reasoning_content', None)
+    if reasoning_content:
+        logging.info(
+            f"Deepseek API reasoning content: {reasoning_content}")
+    return LLMResult(completion.choices[0].message.content, usage=completion.usage)
+
+def _oai_do_request(client, model, temperature, max_tokens, formatted_messages):
+    # OpenAI and the OpenAI-compatible endpoints (Gemini)
+    completion = client.chat.completions.create(
+        model=model,
+        messages=formatted_messages,
+    )
+    return LLMResult(completion.choices[0].message.content, usage=completion.usage)
+
+def _check_claude_error(message):
+    # the API may answer without an exception but with an 'error' typed content
+    if message.content[0].type == "error":
         logging.info(
             f"no excpetion but return with 'error' type: {message.content[0].text}")
-        if _retry < __API_RETRY_LIMIT and message.content[0].text != last_emsg:
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, message.content[0].text)
-
-        return '{"ret": "failed", "response": "' + message.content[0].text + '"}'
-    return message.content[0].text
+        raise LLMRequestError(message.content[0].text)
+
+def _claude_beta_do_request(client, model, temperature, max_tokens, formatted_messages):
+    # ststem_prompt = formatted_messages[0]['content']
+    # if len(formatted_messages) > 1:
+    #     formatted_messages = formatted_messages[1:]
+    # else:
+    #     formatted_messages = [
+    #         {
+    #             "role": "user",
+    #             "content": "Let's start the analysis: \n"
+    #         }
+    #     ]
+    
+    message = client.beta.messages.create(
+        model=model,
+        max_tokens=128000,
+        thinking={
+            "type": "enabled",
+            "budget_tokens": 32000
+        },
+        messages=anthropic_messages(formatted_messages, cache_first=True), 
+        betas=["output-128k-2025-02-19"])
+
+    _check_claude_error(message)
+    return LLMResult(message.content[0].text, usage=message.usage)
 
 def _claude_beta_do_request_streaming(
-    model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None
+    client, model, temperature, max_tokens, formatted_messages
 ):
     """
     Example streaming function using the official doc approach.
     """
-    try:
-        # If ephemeral usage is causing no content, try removing this
-        # formatted_messages[0]["cache_control"] = {"type": "ephemeral"}
-
-        with __claude_client.beta.messages.stream(
-            model=model,
-            max_tokens=128000,
-            thinking={"type": "enabled", "budget_tokens": 32000},
-            messages=formatted_messages,
-            betas=["output-128k-2025-02-19"],
-            # temperature=temperature,  # optionally use if you want
-        ) as stream:
-
-            # Accumulate partial chunks
-            all_text_parts = []
-
-            # Iterate over partial text
-            for partial_text in stream.text_stream:
-                all_text_parts.append(partial_text)
-
-        # Combine into final response string
-        full_response = "".join(all_text_parts)
-
-        return full_response
+    start = time.perf_counter()
+    # breakpoints on the first prompt and the latest assistant turn, see prompts/conversation.py
+    with client.beta.messages.stream(
+        model=model,
+        max_tokens=128000,
+        thinking={"type": "enabled", "budget_tokens": 32000},
+        messages=anthropic_messages(formatted_messages, cache_first=True),
+        betas=["output-128k-2025-02-19"],
+        # temperature=temperature,  # optionally use if you want
+    ) as stream:
+
+        # Accumulate partial chunks
+        all_text_parts = []
+        ttft = None
+
+        # Iterate over partial text
+        for partial_text in stream.text_stream:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            all_text_parts.append(partial_text)
+
+        usage = stream.get_final_message().usage
+
+    # Combine into final response string
+    full_response = "".join(all_text_parts)
+
+    result = LLMResult(full_response, usage=usage)
+    result.ttft = ttft
+    return result
+
+def _claude_do_request(client, model, temperature, max_tokens, formatted_messages):
+    ststem_prompt = formatted_messages[0]['content']
+    if len(formatted_messages) > 1:
+        formatted_messages = formatted_messages[1:]
+    else:
+        formatted_messages = [
+            {
+                "role": "user",
+                "content": "Let's start the analysis: \n"
+            }
+        ]
+
+    message = client.messages.create(
+        max_tokens=max_tokens,
+        model=model,
+        # temperature=0.2,
+        system=[
+            {
+                "type": "text",
+                "text": "You are an expert in C and Linux kernel, help me finish the following analysis.\n",
+            },
+            {
+                "type": "text",
+                "text": ststem_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ],
+        # the system prompt caches the first prompt, this caches the history
+        messages=anthropic_messages(formatted_messages),
+    )
+
+    _check_claude_error(message)
+    return LLMResult(message.content[0].text, usage=message.usage)
+
+
+# request handlers named by the routing table in prompts/providers.py
+_HANDLERS = {
+    "ollama": _ollama_do_request,
+    "openrouter": _open_router_do_request,
+    "claude": _claude_do_request,
+    # "claude_thinking": _claude_beta_do_request,
+    "claude_thinking": _claude_beta_do_request_streaming,
+    "deepseek": _deepseek_do_request,
+    "openai_compatible": _oai_do_request,
+}
 
-    except Exception as e:
-        msg = str(e)
-        logging.error(e)
-        # For demonstration, simple retry logic:
-        if _retry < __API_RETRY_LIMIT and msg != last_emsg:
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _claude_beta_do_request_streaming(
-                model, temperature, max_tokens, formatted_messages, _retry + 1, msg
-            )
-        else:
-            logging.error("Failed to call Claude API many times")
-            return '{"ret": "failed", "response": "' + msg + '"}'
 
-def _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
+def _do_request(model, temperature, max_tokens, formatted_messages):
+    """
+    Returns a LLMResult, its text is the failed response payload if the call failed
+    """
+    model_route = route(model)
+    provider = model_route.provider.name
+    request_func = _HANDLERS[model_route.handler]
+    attempts = 0
+
+    def _attempt():
+        nonlocal attempts
+        attempts += 1
+        # wait only if the provider's request/token budget is exhausted
+        rate_limiter.acquire(provider, estimate_tokens(formatted_messages))
+        return request_func(client, model_route.model, temperature, max_tokens, formatted_messages)
+
+    start = time.perf_counter()
     try:
-        ststem_prompt = formatted_messages[0]['content']
-        if len(formatted_messages) > 1:
-            formatted_messages = formatted_messages[1:]
-        else:
-            formatted_messages = [
-                {
-                    "role": "user",
-                    "content": "Let's start the analysis: \n"
-                }
-            ]
-
-        message = __claude_client.messages.create(
-            max_tokens=max_tokens,
-            model=model,
-            # temperature=0.2,
-            system=[
-                {
-                    "type": "text",
-                    "text": "You are an expert in C and Linux kernel, help me finish the following analysis.\n",
-                },
-                {
-                    "type": "text",
-                    "text": ststem_prompt,
-                    "cache_control": {"type": "ephemeral"}
-                }
-            ],
-            messages=formatted_messages,
-        )
+        # missing keys or SDKs fail here once, they are not worth retrying
+        client = model_route.provider.client
+        result = __retry_policy.call(_attempt)
     except Exception as e:
-        msg = str(e)
-        if _retry < __API_RETRY_LIMIT and msg != last_emsg:
-            # sleep(1)
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, str(e))
-        else:
-            logging.error(f"Failed to call Claude API: {msg}")
-            return '{"ret": "failed", "response": "' + msg + '"}'
-
-    if message.content[0].type == "error" and ("exceeded" not in message.content[0].text):
-        logging.info(
-            f"no excpetion but return with 'error' type: {message.content[0].text}")
-        if _retry < __API_RETRY_LIMIT and message.content[0].text != last_emsg:
-            sleep(__RETRY_TIMEOUT[_retry])
-            logging.info(f"Retrying {_retry + 1} time(s)...")
-            return _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry + 1, message.content[0].text)
-
-        return '{"ret": "failed", "response": "' + message.content[0].text + '"}'
-
-    return message.content[0].text
-
-
-def _do_request(model, temperature, max_tokens, formatted_messages, _retry=0, last_emsg=None):
-    sleep(0.2)  # avoid rate limit
-    if "--" in model:
-        model = model.split("--")[0]
-
-    if model.startswith("ollama/"):
-        model = model[7:]
-        return _ollama_do_request(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
-    elif model.startswith("openrouter/"):
-        model = model[11:]
-        provider = model.split("/")[0]
-        model = model[len(provider) + 1:]
-        return open_router_request_single_provider(formatted_messages, model, provider, _retry, __API_RETRY_LIMIT, __RETRY_TIMEOUT)
-    elif "claude" in model:
-        if "claude-3-7-sonnet" in model:
-            # return _claude_beta_do_request(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
-            return _claude_beta_do_request_streaming(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
-        return _claude_do_request(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
-    elif "gemini" in model:
-        return _gemini_do_request(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
-    else:
-        return _oai_do_request(model, temperature, max_tokens, formatted_messages, _retry, last_emsg)
+        logging.error(f"Failed to call {provider} API: {e}")
+        result = LLMResult(_failed_response(str(e)), provider)
+    # the route names the provider, one handler serves several of them
+    result.provider = provider
+    result.latency = time.perf_counter() - start
+    result.retries = max(attempts - 1, 0)
+    return result
 
 
 def __is_failed(response):
     return response.startswith('{"ret": "failed"')
 
 
-def do_request_llm(model, temperature, max_tokens, formatted_messages, cur_prompt, round='N/A', case_id='N/A'):
+def _record_call(result, cur_prompt, model, round, case_id):
+    logging.info(f"Round: {round}, Case {case_id}, Response: {result.text}")
+    logging.info(f"Round: {round}, Case {case_id}, Usage: {result.input_tokens} input tokens "
+                 f"({result.cached_tokens} cached), {result.output_tokens} output tokens, "
+                 f"{result.latency or 0:.1f}s, {result.retries} retries")
+    stage = get_stage(round)
+    usage_tracker.record(stage, case_id, result)
+    insert_log(cur_prompt, result.text, model, round, case_id, dict(result.to_log_fields(), stage=stage))
+
+
+def do_request_llm(model, temperature, max_tokens, formatted_messages, cur_prompt, round='N/A', case_id='N/A', sample=0):
     # formatted_messages.append({"role": "system", "content": cur_prompt})
-    response = _do_request(model, temperature, max_tokens, formatted_messages)
-    logging.info(f"Round: {round}, Case {case_id}, Response: {response}")
-    insert_log(cur_prompt, response, model, round, case_id)
-    return response
+    logged = resume_log.take(case_id, model, round, cur_prompt)
+    if logged is not None:
+        # already in llm_logs, not logged again
+        logging.info(f"Round: {round}, Case {case_id}, reused the logged response")
+        return logged
+
+    cache_key = response_cache.make_key(model, formatted_messages, temperature, max_tokens, sample)
+    response = response_cache.get(cache_key)
+    if response is None:
+        result = _do_request(model, temperature, max_tokens, formatted_messages)
+        if not __is_failed(result.text):
+            response_cache.put(cache_key, result.text)
+    else:
+        result = LLMResult(response, 'cache')
+    _record_call(result, cur_prompt, model, round, case_id)
+    return result.text
 
 
 def get_params(args, task):
@@ -391,35 +318,51 @@ def get_params(args, task):
     return res
 
 
-def do_request_series(model, temperature, max_tokens, prompts, task):
-    formatted_messages = []
+def _build_prompt(cur_prompt, task):
+    if 'args' in cur_prompt:
+        params = get_params(cur_prompt['args'], task)
+        if params is None:
+            logging.error(f"Failed to get params for {cur_prompt['args']}")
+            return None
+
+        return cur_prompt['text'].format(*params)
+    return cur_prompt['text']
+
+
+def _get_round(task_id, index):
+    if task_id != 'N/A':
+        return 'Task ' + task_id + ' - ' + str(index + 1)
+    return 'N/A'
+
+
+def do_request_series(model, temperature, max_tokens, prompts, task, formatted_messages=None, start=0):
+    # `formatted_messages`/`start` continue a conversation whose first `start` prompts were already answered
+    if formatted_messages is None:
+        formatted_messages = []
     task_id = task['id']
     case_id = task['case_id']
+    # index of the majority voting iteration, keeps cached samples independent
+    sample = task.get('sample', 0)
     task['model'] = model
     
-    cb.clear_counter()
+    cb.clear_counter(task)
 
     # prompts[0] = prompts[0].format(**init_info)
-    for index, cur_prompt in enumerate(prompts):
-        if task_id != 'N/A':
-            round = 'Task ' + task_id + ' - ' + str(index + 1)
-        else:
-            round = 'N/A'
-        if 'args' in cur_prompt:
-            params = get_params(cur_prompt['args'], task)
-            if params is None:
-                logging.error(f"Failed to get params for {cur_prompt['args']}")
-                return None
-
-            prompt = cur_prompt['text'].format(*params)
-        else:
-            prompt = cur_prompt['text']
+    for index, cur_prompt in enumerate(prompts[start:], start=start):
+        round = _get_round(task_id, index)
+        prompt = _build_prompt(cur_prompt, task)
+        if prompt is None:
+            return None
 
         # handle callbacks
         for cb_iter in range(__CALLBACK_ITER_MAX_LIMIT):
+            # another voting iteration already settled the result
+            if 'cancel_event' in task and task['cancel_event'].is_set():
+                return None
+
             formatted_messages.append({"role": "user", "content": prompt})
             ret = do_request_llm(model, temperature, max_tokens,
-                                 formatted_messages, prompt, round, case_id)
+                                 formatted_messages, prompt, round, case_id, sample=sample)
             formatted_messages.append({"role": "assistant", "content": ret})
 
             if __is_failed(ret):
@@ -461,3 +404,114 @@ def do_request_series(model, temperature, max_tokens, prompts, task):
                 break
 
     return formatted_messages
+
+
+def supports_multi_sample(model):
+    return route(model).provider.multi_sample
+
+
+def _multi_sample_request(model, temperature, max_tokens, formatted_messages, n):
+    """
+    Returns one LLMResult per choice, the usage of the request is split evenly among them
+    """
+    model_route = route(model)
+    provider = model_route.provider.name
+    attempts = 0
+
+    def _attempt():
+        nonlocal attempts
+        attempts += 1
+        rate_limiter.acquire(provider, estimate_tokens(formatted_messages))
+        return client.chat.completions.create(
+            model=model_route.model,
+            messages=formatted_messages,
+            n=n,
+        )
+
+    start = time.perf_counter()
+    try:
+        client = model_route.provider.client
+        completion = __retry_policy.call(_attempt)
+        results = [LLMResult(choice.message.content, provider) for choice in completion.choices]
+        usage = LLMResult(None, provider, completion.usage)
+    except Exception as e:
+        logging.error(f"Failed to call {provider} API: {e}")
+        results = [LLMResult(_failed_response(str(e)), provider)]
+        usage = None
+
+    latency = time.perf_counter() - start
+    for result in results:
+        if usage is not None:
+            for field in ('input_tokens', 'output_tokens', 'reasoning_tokens', 'cached_tokens'):
+                value = getattr(usage, field)
+                setattr(result, field, value // len(results) if value is not None else None)
+        result.latency = latency
+        result.retries = max(attempts - 1, 0)
+    return results
+
+
+def do_request_llm_multi(model, temperature, max_tokens, formatted_messages, cur_prompt, n, round='N/A', case_id='N/A'):
+    """
+    Ask for `n` independent answers of the same conversation in a single request,
+    answer i is cached as voting sample i.
+    """
+    responses = [resume_log.take(case_id, model, round, cur_prompt) for _ in range(n)]
+    missing = [sample for sample, response in enumerate(responses) if response is None]
+    if len(missing) < n:
+        # already in llm_logs, not logged again
+        logging.info(f"Round: {round}, Case {case_id}, reused {n - len(missing)} logged responses")
+    if not missing:
+        return responses
+
+    cache_keys = [response_cache.make_key(model, formatted_messages, temperature, max_tokens, sample)
+                  for sample in missing]
+    cached = [response_cache.get(key) for key in cache_keys]
+    if any(response is None for response in cached):
+        results = _multi_sample_request(model, temperature, max_tokens, formatted_messages, len(missing))
+        for key, result in zip(cache_keys, results):
+            if not __is_failed(result.text):
+                response_cache.put(key, result.text)
+    else:
+        results = [LLMResult(response, 'cache') for response in cached]
+
+    for result in results:
+        _record_call(result, cur_prompt, model, round, case_id)
+    # a failed request has a single result, every missing sample failed
+    failed = len(results) == 1 and __is_failed(results[0].text)
+    for i, sample in enumerate(missing):
+        if failed or i >= len(results):
+            responses[sample] = results[0].text if failed else _failed_response("no answer for this sample")
+        else:
+            responses[sample] = results[i].text
+    return responses
+
+
+def do_request_series_multi(model, temperature, max_tokens, prompts, task, n):
+    """
+    Run `n` samples of a callback-free prompt series: the first (and largest) prompt
+    is sent once with `n` choices, every choice is then continued as its own conversation.
+    Returns a list of conversations (None for the failed ones), or None if the first request failed.
+    """
+    task['model'] = model
+    prompt = _build_prompt(prompts[0], task)
+    if prompt is None:
+        return None
+
+    formatted_messages = [{"role": "user", "content": prompt}]
+    responses = do_request_llm_multi(model, temperature, max_tokens, formatted_messages, prompt, n,
+                                     _get_round(task['id'], 0), task['case_id'])
+    if not responses or __is_failed(responses[0]):
+        return None
+
+    def _continue(sample):
+        ret = responses[sample]
+        history = formatted_messages + [{"role": "assistant", "content": ret}]
+        if __is_failed(ret):
+            return None
+        if len(prompts) == 1:
+            return history
+        return do_request_series(model, temperature, max_tokens, prompts,
+                                 dict(task, sample=sample), history, start=1)
+
+    with ThreadPoolExecutor(max_workers=len(responses)) as executor:
+        return list(executor.map(_continue, range(len(responses))))
@@ -0,0 +1,66 @@
+# `do_request_series` only appends to `formatted_messages`, so each turn resends
+# the previous turns as an unchanged prefix. OpenAI, DeepSeek and Gemini cache
+# such prefixes automatically; Anthropic only caches up to blocks marked with
+# `cache_control`, which `anthropic_messages` adds (on a copy of the history).
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def _with_cache_control(message):
+    content = message['content']
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [dict(block) for block in content]
+    blocks[-1] = dict(blocks[-1], cache_control=EPHEMERAL)
+    return {"role": message['role'], "content": blocks}
+
+
+def anthropic_messages(formatted_messages, cache_first=False):
+    """
+    Copy of the messages with a cache breakpoint on the latest assistant turn
+    (the end of the prefix the next turn will resend) and, if `cache_first`,
+    on the first message (the stable prompt with the kernel source).
+    Together with the system prompt this stays within Anthropic's 4 breakpoints.
+    """
+    messages = [dict(message) for message in formatted_messages]
+    if cache_first and messages:
+        messages[0] = _with_cache_control(messages[0])
+    for i in range(len(messages) - 1, 0, -1):
+        if messages[i]['role'] == 'assistant' and messages[i]['content']:
+            messages[i] = _with_cache_control(messages[i])
+            break
+    return messages
+
+
+def _get(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def get_cache_usage(usage):
+    """
+    (cached input tokens, total input tokens) from the usage of any provider,
+    None for the values the provider did not report.
+    """
+    if usage is None:
+        return None, None
+
+    # Anthropic: input_tokens only counts the uncached part
+    cache_read = _get(usage, 'cache_read_input_tokens')
+    if cache_read is not None:
+        total = (_get(usage, 'input_tokens') or 0) + cache_read + (_get(usage, 'cache_creation_input_tokens') or 0)
+        return cache_read, total
+
+    # DeepSeek
+    cache_hit = _get(usage, 'prompt_cache_hit_tokens')
+    if cache_hit is not None:
+        return cache_hit, _get(usage, 'prompt_tokens')
+
+    # OpenAI / Gemini / OpenRouter
+    cached = _get(_get(usage, 'prompt_tokens_details'), 'cached_tokens')
+    return cached or 0, _get(usage, 'prompt_tokens')
+
@@ -0,0 +1,66 @@
+import importlib.util
+import logging
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.config import HTTP_POOL
+
+# one keep-alive pool per process, shared by every worker thread, so a turn
+# reuses an open TLS connection instead of doing a new handshake
+__lock = threading.Lock()
+__session = None
+__httpx_client = None
+
+
+def get_timeout():
+    """
+    (connect, read) timeout in seconds, as `requests` expects it
+    """
+    return (HTTP_POOL['connect_timeout'], HTTP_POOL['read_timeout'])
+
+
+def get_httpx_timeout():
+    return httpx.Timeout(HTTP_POOL['read_timeout'], connect=HTTP_POOL['connect_timeout'])
+
+
+def get_session():
+    """
+    Shared `requests.Session` (used for OpenRouter)
+    """
+    global __session
+    with __lock:
+        if __session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL['pool_size'],
+                                  pool_maxsize=HTTP_POOL['pool_size'])
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            __session = session
+        return __session
+
+
+def __http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_httpx_client():
+    """
+    Shared `httpx.Client` for the OpenAI-compatible SDK clients
+    """
+    global __httpx_client
+    with __lock:
+        if __httpx_client is None:
+            http2 = HTTP_POOL['http2']
+            if http2 and not __http2_available():
+                logging.warning("HTTP/2 requested but the `h2` package is missing, using HTTP/1.1")
+                http2 = False
+            __httpx_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_POOL['pool_size'],
+                                    max_keepalive_connections=HTTP_POOL['pool_size']),
+                timeout=get_httpx_timeout(),
+                http2=http2,
+            )
+        return __httpx_client
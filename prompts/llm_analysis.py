@@ -1,9 +1,12 @@
-from prompts.call_api import do_request_series, get_from_response
+from prompts.call_api import do_request_series, do_request_series_multi, supports_multi_sample, get_from_response
+from prompts.telemetry import usage_tracker
 from helper.dao import * 
 import yaml
 import re
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from rich.progress import track
 
 
@@ -18,6 +21,45 @@ def _read_prompt_file():
 PROMPT = _read_prompt_file()
 
 
+def _run_bug_groups(bug_groups, description, run_case, workers=1):
+    # most of the time of a case is spent waiting for the LLM, so cases are
+    # run on a thread pool; each case writes its own rows to the DB.
+    # Each case runs its voting samples on its own pool (see
+    # run_with_majority_voting), up to `workers * (max_iters + 1)` requests
+    # are in flight; the rate limiter of prompts/rate_limit.py makes the
+    # extra ones wait, it is what bounds the load on the provider
+    if workers <= 1:
+        for bug_group in track(bug_groups, description=description):
+            run_case(bug_group)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_case, bug_group): bug_group for bug_group in bug_groups}
+            for future in track(as_completed(futures), total=len(futures), description=description):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Bug group {futures[future].group_id} failed: {e}")
+    # the next stage reads these results
+    flush_writes()
+    usage_tracker.log_summary()
+
+
+def _prepare_cases(proj, model, bug_groups, column, resume=False):
+    """
+    Load the stage's `cases` rows in one query and, if resuming,
+    drop the bug groups whose `column` already holds a result
+    """
+    case_prefix = f"{proj.proj_id}:"
+    prefetch_cases(case_prefix, model)
+    if not resume:
+        return bug_groups
+    completed = get_completed_cases(case_prefix, model, column)
+    remaining = [bug_group for bug_group in bug_groups
+                 if f"{case_prefix}{bug_group.group_id:04d}" not in completed]
+    logging.info(f"Resuming: {len(bug_groups) - len(remaining)} of {len(bug_groups)} cases already have a {column}")
+    return remaining
+
+
 def run_with_majority_voting(context, prompts, task, model, temperature, max_tokens, xml_tag, case_id, max_iters):
     res_count = {}
     # optimize: if any result appears more than half of the time, we can directly return it
@@ -30,38 +72,96 @@ def run_with_majority_voting(context, prompts, task, model, temperature, max_tok
     if not task or not task['context']:
         logging.error(f"Task {task['id']} has no context")
         return None
-    
-    for _ in range(max_iters):
-        msg = do_request_series(model, temperature, max_tokens, prompts, task)
+
+    # without callbacks the conversations do not depend on our answers, so
+    # providers supporting it can return every sample from a single request
+    if max_iters > 1 and not any('callback' in p for p in prompts) and supports_multi_sample(model):
+        return _run_multi_sample_voting(prompts, task, model, temperature, max_tokens, xml_tag, max_iters)
+
+    # all iterations run at the same time, once a majority is reached the
+    # unfinished ones are told to stop (they check it before every turn)
+    cancel_event = threading.Event()
+
+    def _run_sample(sample):
+        sample_task = dict(task, sample=sample, cancel_event=cancel_event)
+        return do_request_series(model, temperature, max_tokens, prompts, sample_task)
+
+    executor = ThreadPoolExecutor(max_workers=max_iters + 1)
+    try:
+        pending = {executor.submit(_run_sample, sample) for sample in range(max_iters)}
+        next_sample = max_iters
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                msg = future.result()
+                if msg is None:
+                    if failed_before:
+                        return None
+                    failed_before = True
+                    continue
+                
+                response = msg[-1]['content']
+                res = get_from_response(response, xml_tag)
+                if res:
+                    if res in res_count:
+                        res_count[res] += 1
+                    else:
+                        res_count[res] = 1
+                else:
+                    continue
+                
+                if res == "uncertain" and one_more_iter:
+                    pending.add(executor.submit(_run_sample, next_sample))
+                    next_sample += 1
+                    one_more_iter = False
+                
+                if res_count and max(res_count.values()) >= abs_majority:
+                    pending = set()
+                    break
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+    # find the most common result
+    return max(res_count, key=res_count.get) if res_count else None
+
+
+def _run_multi_sample_voting(prompts, task, model, temperature, max_tokens, xml_tag, max_iters):
+    res_count = {}
+    failed = 0
+    abs_majority = max_iters // 2 + 1
+
+    msgs = do_request_series_multi(model, temperature, max_tokens, prompts, task, max_iters)
+    if msgs is None:
+        return None
+
+    results = []
+    for msg in msgs:
         if msg is None:
-            if failed_before:
-                return None
-            failed_before = True
+            failed += 1
             continue
-        
-        response = msg[-1]['content']
-        res = get_from_response(response, xml_tag)
+        results.append(get_from_response(msg[-1]['content'], xml_tag))
+
+    # same as the sequential voting: one more iteration if "uncertain" showed up
+    # and no answer has the majority yet
+    for res in results:
         if res:
-            if res in res_count:
-                res_count[res] += 1
-            else:
-                res_count[res] = 1
+            res_count[res] = res_count.get(res, 0) + 1
+    if "uncertain" in res_count and max(res_count.values()) < abs_majority:
+        msg = do_request_series(model, temperature, max_tokens, prompts, dict(task, sample=max_iters))
+        if msg is None:
+            failed += 1
         else:
-            continue
-        
-        
-        if res == "uncertain" and one_more_iter:
-            max_iters += 1
-            one_more_iter = False
-        
-        if res_count and max(res_count.values()) >= abs_majority:
-            break
-        
-    # find the most common result
+            res = get_from_response(msg[-1]['content'], xml_tag)
+            if res:
+                res_count[res] = res_count.get(res, 0) + 1
+
+    if failed >= 2:
+        return None
     return max(res_count, key=res_count.get) if res_count else None
 
 
-def infer_variable_name_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
+def infer_variable_name_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
     prompts = PROMPT['infer_variable_name']
     bug_groups = proj.bug_groups
 
@@ -69,8 +169,7 @@ def infer_variable_name_llm(proj, model, temperature=1.0, max_tokens=2048, range
         range_end = len(bug_groups)
     bug_groups = bug_groups[range_start:range_end]
 
-    # for bug_group in bug_groups:
-    for bug_group in track(bug_groups, description="Infer variable name"):
+    def _run_case(bug_group):
         context = bug_group.get_last_context()
         task = {"id": "var_name", "proj_dir": proj.proj_dir, "context": context,
                 "case_id": f"{proj.proj_id}:{bug_group.group_id:04d}"}
@@ -87,8 +186,11 @@ def infer_variable_name_llm(proj, model, temperature=1.0, max_tokens=2048, range
             logging.error(
                 f"Failed to infer variable name for {task['case_id']}")
 
+    bug_groups = _prepare_cases(proj, model, bug_groups, 'var_name', resume)
+    _run_bug_groups(bug_groups, "Infer variable name", _run_case, workers)
 
-def smart_bug_analysis_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
+
+def smart_bug_analysis_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
     prompts = PROMPT['smart_bug_analysis']
     bug_groups = proj.bug_groups
 
@@ -97,8 +199,7 @@ def smart_bug_analysis_llm(proj, model, temperature=1.0, max_tokens=2048, range_
         range_end = len(bug_groups)
     bug_groups = bug_groups[range_start:range_end]
 
-    # for bug_group in bug_groups:
-    for bug_group in track(bug_groups, description="Smart bug analysis"):
+    def _run_case(bug_group):
         context = bug_group.get_last_context()
         task = {"id": "smart_bug_analysis", "proj_dir": proj.proj_dir,
                 "context": context, "case_id": f"{proj.proj_id}:{bug_group.group_id:04d}"}
@@ -109,6 +210,9 @@ def smart_bug_analysis_llm(proj, model, temperature=1.0, max_tokens=2048, range_
         else:
             logging.error(
                 f"Failed to infer analysis for {task['case_id']}")
+
+    bug_groups = _prepare_cases(proj, model, bug_groups, 'analysis_result', resume)
+    _run_bug_groups(bug_groups, "Smart bug analysis", _run_case, workers)
             
 def __is_false_alarm_by_analysis(case_id, model):
     # t = find_analysis_result(case_id, model)[0]
@@ -121,13 +225,13 @@ def __is_false_alarm_by_analysis(case_id, model):
     # return not "<bug_eval>potential_bug</bug_eval>" in t
     return 'not_a_bug' in t
     
-def sanitizer_detection_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
-    # sanitizer_detection_p1(proj, model, temperature, max_tokens, range_start, range_end, max_iters)
-    # sanitizer_detection_p2(proj, model, temperature, max_tokens, range_start, range_end, max_iters)
-    sanitizer_detection(proj, model, temperature, max_tokens, range_start, range_end, max_iters)
+def sanitizer_detection_llm(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
+    # sanitizer_detection_p1(proj, model, temperature, max_tokens, range_start, range_end, max_iters, workers, resume)
+    # sanitizer_detection_p2(proj, model, temperature, max_tokens, range_start, range_end, max_iters, workers, resume)
+    sanitizer_detection(proj, model, temperature, max_tokens, range_start, range_end, max_iters, workers, resume)
     
     
-def sanitizer_detection(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
+def sanitizer_detection(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
     prompts = PROMPT['sanitizer_detection']
     bug_groups = proj.bug_groups
 
@@ -136,12 +240,11 @@ def sanitizer_detection(proj, model, temperature=1.0, max_tokens=2048, range_sta
         range_end = len(bug_groups)
     bug_groups = bug_groups[range_start:range_end]
 
-    # for bug_group in bug_groups:
-    for bug_group in track(bug_groups, description="Sanitizer detection"):
+    def _run_case(bug_group):
         # filter: if "smart bug analysis" is not a bug
         if __is_false_alarm_by_analysis(f"{proj.proj_id}:{bug_group.group_id:04d}", model):
             insert_or_update_sanitizer(f"{proj.proj_id}:{bug_group.group_id:04d}", "not_a_bug", model)
-            continue
+            return
         
         context = bug_group.get_last_context()
         task = {"id": "sanitizer_detection_p1", "proj_dir": proj.proj_dir,
@@ -155,7 +258,10 @@ def sanitizer_detection(proj, model, temperature=1.0, max_tokens=2048, range_sta
             logging.error(
                 f"Failed to infer analysis for {task['case_id']}")
 
-def sanitizer_detection_p1(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
+    bug_groups = _prepare_cases(proj, model, bug_groups, 'sanitize_result', resume)
+    _run_bug_groups(bug_groups, "Sanitizer detection", _run_case, workers)
+
+def sanitizer_detection_p1(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
     prompts = PROMPT['sanitizer_detection_p1']
     bug_groups = proj.bug_groups
 
@@ -164,11 +270,10 @@ def sanitizer_detection_p1(proj, model, temperature=1.0, max_tokens=2048, range_
         range_end = len(bug_groups)
     bug_groups = bug_groups[range_start:range_end]
 
-    # for bug_group in bug_groups:
-    for bug_group in track(bug_groups, description="Sanitizer detection"):
+    def _run_case(bug_group):
         # filter: if "smart bug analysis" is not "bug", the skip:
         if __is_false_alarm_by_analysis(f"{proj.proj_id}:{bug_group.group_id:04d}", model):
-            continue
+            return
         
         context = bug_group.get_last_context()
         task = {"id": "sanitizer_detection_p1", "proj_dir": proj.proj_dir,
@@ -183,8 +288,11 @@ def sanitizer_detection_p1(proj, model, temperature=1.0, max_tokens=2048, range_
         else:
             logging.error(
                 f"Failed to infer analysis for {task['case_id']}")
+
+    bug_groups = _prepare_cases(proj, model, bug_groups, 'detected_sanitizer', resume)
+    _run_bug_groups(bug_groups, "Sanitizer detection", _run_case, workers)
             
-def sanitizer_detection_p2(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1):
+def sanitizer_detection_p2(proj, model, temperature=1.0, max_tokens=2048, range_start=0, range_end=None, max_iters=1, workers=1, resume=False):
     prompts = PROMPT['sanitizer_detection_p2']
     bug_groups = proj.bug_groups
 
@@ -193,11 +301,10 @@ def sanitizer_detection_p2(proj, model, temperature=1.0, max_tokens=2048, range_
         range_end = len(bug_groups)
     bug_groups = bug_groups[range_start:range_end]
 
-    # for bug_group in bug_groups:
-    for bug_group in track(bug_groups, description="Sanitizer detection"):
+    def _run_case(bug_group):
         # filter: if "smart bug analysis" is not "bug", the skip:
         if __is_false_alarm_by_analysis(f"{proj.proj_id}:{bug_group.group_id:04d}", model):
-            continue
+            return
         
         context = bug_group.get_last_context()
         task = {"id": "sanitizer_detection_p2", "proj_dir": proj.proj_dir,
@@ -208,4 +315,7 @@ def sanitizer_detection_p2(proj, model, temperature=1.0, max_tokens=2048, range_
             insert_or_update_sanitizer(task['case_id'], res, model)
         else:
             logging.error(
-                f"Failed to infer analysis for {task['case_id']}")
\ No newline at end of file
+                f"Failed to infer analysis for {task['case_id']}")
+
+    bug_groups = _prepare_cases(proj, model, bug_groups, 'sanitize_result', resume)
+    _run_bug_groups(bug_groups, "Sanitizer detection", _run_case, workers)
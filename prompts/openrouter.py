@@ -1,59 +1,43 @@
-import os
-import requests
-from time import sleep
+from prompts.http_pool import get_session, get_timeout
+from prompts.retry import LLMRequestError
+from prompts.telemetry import LLMResult
 
-# openrouter_api_key
-__openrouter_dir = "../openrouter.key"
-if 'OPENROUTER_API_KEY' not in os.environ:
-    with open(__openrouter_dir, "r") as f:
-        __openrouter_api_key = f.read().strip()
-else:
-    __openrouter_api_key = os.environ['OPENROUTER_API_KEY']
-__headers = {
-    'Authorization': 'Bearer ' + __openrouter_api_key,
-    'X-Title': 'LMSuture',
-    'Content-Type': 'application/json',
-}
 
-
-def open_router_request_single_provider(formatted_msg, model, provider, retry=0, max_retry=3, retry_timeout=[1, 2, 4], last_error=None):
-    sleep(1)
+def open_router_request_single_provider(formatted_msg, model, provider, headers):
+    # throttling is done by the caller's rate limiter (see prompts/rate_limit.py)
+    # and errors are raised to the caller's retry policy (see prompts/retry.py)
+    response = get_session().post('https://openrouter.ai/api/v1/chat/completions',
+                                  headers=headers, json={
+                                      'model': model,
+                                      'messages': formatted_msg,
+                                      'provider': {
+                                          'order': [
+                                              provider,
+                                          ],
+                                          'allow_fallbacks': False
+                                      }
+                                  }, timeout=get_timeout())
     try:
-        response = requests.post('https://openrouter.ai/api/v1/chat/completions',
-                                 headers=__headers, json={
-                                     'model': model,
-                                     'messages': formatted_msg,
-                                     'provider': {
-                                         'order': [
-                                             provider,
-                                         ],
-                                         'allow_fallbacks': False
-                                     }
-                                 })
         res = response.json()
-    except Exception as e:
-        e_msg = str(e)
-        if e_msg == last_error:
-            return "Same Error: " + e_msg
-        if retry < max_retry:
-            sleep(retry_timeout[retry])
-            return open_router_request_single_provider(formatted_msg, model, provider, retry + 1, max_retry, retry_timeout, e_msg)
+    except ValueError:
+        res = None
     if not res or 'error' in res:
         if not res or 'error' not in res:
             err_msg = "No Response"
+            status_code = response.status_code
         else:
             err_msg = res['error']['message']
-        if err_msg == last_error:
-            return "Same Error: " + err_msg
-        if retry < max_retry:
-            sleep(retry_timeout[retry])
-            return open_router_request_single_provider(formatted_msg, model, provider, retry + 1, max_retry, retry_timeout, err_msg)
+            status_code = res['error'].get('code', response.status_code)
+        raise LLMRequestError(err_msg, status_code=status_code,
+                              retry_after=response.headers.get('retry-after'))
     
-    return res['choices'][0]['message']['content']
+    return LLMResult(res['choices'][0]['message']['content'], 'openrouter', res.get('usage'))
     
 
 
 if __name__ == "__main__":
+    from prompts.providers import get_client
+
     formatted_msg = [{
         "role": "user",
         "content": "what is the meaning of life?"
@@ -61,5 +45,5 @@ if __name__ == "__main__":
     model = "gpt-4o"
     provider = "OpenAI"
     response = open_router_request_single_provider(
-        formatted_msg, model, provider)
-    print(response)
+        formatted_msg, model, provider, get_client("openrouter"))
+    print(response.text)
@@ -0,0 +1,139 @@
+import os
+import threading
+
+from prompts.http_pool import get_httpx_client, get_httpx_timeout
+
+
+def load_api_key(env_var, key_file):
+    """
+    Read the API key from the environment, or from the first line of `key_file`
+    """
+    if env_var not in os.environ and os.path.exists(key_file):
+        with open(key_file, 'r') as f:
+            os.environ[env_var] = f.read().splitlines()[0].strip()
+    if env_var not in os.environ:
+        raise KeyError(f"{env_var} is not set and {key_file} does not exist")
+    return os.environ[env_var]
+
+
+class Provider:
+    """
+    A LLM backend whose client is only created (and its SDK only imported)
+    the first time a model routed to it is used.
+    """
+
+    def __init__(self, name, create_client, multi_sample=False):
+        self.name = name
+        self.multi_sample = multi_sample
+        self._create_client = create_client
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._create_client()
+            return self._client
+
+
+class Route:
+    def __init__(self, provider, handler, model):
+        self.provider = provider
+        self.handler = handler
+        self.model = model
+
+
+# the SDKs retry 429/5xx on their own by default; retries and their backoff are
+# left to the RetryPolicy of prompts/call_api.py, so they are counted once
+_SDK_MAX_RETRIES = 0
+
+
+def _create_openai_client():
+    import openai
+    return openai.OpenAI(api_key=load_api_key('OPENAI_API_KEY', "../openai.key"),
+                         http_client=get_httpx_client(), timeout=get_httpx_timeout(),
+                         max_retries=_SDK_MAX_RETRIES)
+
+
+def _create_deepseek_client():
+    import openai
+    return openai.OpenAI(api_key=load_api_key('DEEPSEEK_API_KEY', "../deepseek.key"),
+                         base_url="https://api.deepseek.com",
+                         http_client=get_httpx_client(), timeout=get_httpx_timeout(),
+                         max_retries=_SDK_MAX_RETRIES)
+
+
+def _create_gemini_client():
+    import openai
+    return openai.OpenAI(api_key=load_api_key('GEMINI_API_KEY', "../gemini.key"),
+                         base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+                         http_client=get_httpx_client(), timeout=get_httpx_timeout(),
+                         max_retries=_SDK_MAX_RETRIES)
+
+
+def _create_anthropic_client():
+    import anthropic
+    return anthropic.Anthropic(api_key=load_api_key('ANTHROPIC_API_KEY', "../claude.key"),
+                               max_retries=_SDK_MAX_RETRIES)
+
+
+def _create_ollama_client():
+    import ollama
+    return ollama.Client()
+
+
+def _create_openrouter_client():
+    # OpenRouter is called over plain HTTP, its "client" is the request headers
+    return {
+        'Authorization': 'Bearer ' + load_api_key('OPENROUTER_API_KEY', "../openrouter.key"),
+        'X-Title': 'LMSuture',
+        'Content-Type': 'application/json',
+    }
+
+
+PROVIDERS = {}
+
+
+def register_provider(name, create_client, multi_sample=False):
+    PROVIDERS[name] = Provider(name, create_client, multi_sample)
+
+
+register_provider("openai", _create_openai_client, multi_sample=True)
+register_provider("deepseek", _create_deepseek_client)
+register_provider("gemini", _create_gemini_client, multi_sample=True)
+register_provider("anthropic", _create_anthropic_client)
+register_provider("ollama", _create_ollama_client)
+register_provider("openrouter", _create_openrouter_client)
+
+
+# model name -> (provider, request handler), first matching rule wins.
+# "prefix" rules strip the prefix from the model name sent to the provider,
+# handlers are the request functions registered in prompts/call_api.py
+ROUTES = [
+    ("prefix", "ollama/", "ollama", "ollama"),
+    ("prefix", "openrouter/", "openrouter", "openrouter"),
+    ("contains", "claude-3-7-sonnet", "anthropic", "claude_thinking"),
+    ("contains", "claude", "anthropic", "claude"),
+    ("contains", "gemini", "gemini", "openai_compatible"),
+    ("contains", "deepseek", "deepseek", "deepseek"),
+    ("default", None, "openai", "openai_compatible"),
+]
+
+
+def route(model):
+    # "model--tag" names the same model under another label
+    if "--" in model:
+        model = model.split("--")[0]
+    for kind, pattern, provider, handler in ROUTES:
+        if kind == "prefix" and model.startswith(pattern):
+            return Route(PROVIDERS[provider], handler, model[len(pattern):])
+        elif kind == "contains" and pattern in model:
+            return Route(PROVIDERS[provider], handler, model)
+        elif kind == "default":
+            return Route(PROVIDERS[provider], handler, model)
+    raise ValueError(f"No provider for model {model}")
+
+
+def get_client(name):
+    return PROVIDERS[name].client
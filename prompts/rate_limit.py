@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+
+from common.config import RATE_LIMITS
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `per_minute` units, refilled continuously.
+
+    `acquire` returns immediately while the bucket has enough units and only
+    blocks the calling thread when it runs dry. A request larger than the
+    whole bucket is let through once the bucket is full (it goes into debt),
+    otherwise it could never be served.
+    """
+
+    def __init__(self, per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, amount=1):
+        """
+        Take `amount` units if available, returns the seconds to wait otherwise (0 on success)
+        """
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return 0
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, amount=1):
+        waited = 0
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return waited
+            # sleep outside of the lock so other callers can still refill/take
+            self._sleep(wait)
+            waited += wait
+
+
+class RateLimiter:
+    """
+    Per-provider requests-per-minute and tokens-per-minute buckets, shared by all worker threads.
+    A limit of None means the provider is not throttled on that axis.
+    """
+
+    def __init__(self, limits, clock=time.monotonic, sleep=time.sleep):
+        self._buckets = {}
+        for provider, limit in limits.items():
+            rpm = limit.get('rpm')
+            tpm = limit.get('tpm')
+            self._buckets[provider] = (
+                TokenBucket(rpm, clock, sleep) if rpm else None,
+                TokenBucket(tpm, clock, sleep) if tpm else None,
+            )
+
+    def acquire(self, provider, tokens=0):
+        if provider not in self._buckets:
+            return 0
+        rpm_bucket, tpm_bucket = self._buckets[provider]
+        waited = 0
+        if rpm_bucket:
+            waited += rpm_bucket.acquire(1)
+        if tpm_bucket and tokens:
+            waited += tpm_bucket.acquire(tokens)
+        if waited > 0:
+            logging.debug(f"Rate limited on {provider} for {waited:.2f}s")
+        return waited
+
+
+def estimate_tokens(formatted_messages):
+    # rough estimate (~4 characters per token), good enough for budgeting
+    n_chars = 0
+    for msg in formatted_messages:
+        content = msg.get('content', '')
+        if isinstance(content, str):
+            n_chars += len(content)
+        else:
+            n_chars += sum(len(part.get('text', '')) for part in content)
+    return n_chars // 4 + 1
+
+
+rate_limiter = RateLimiter(RATE_LIMITS)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import threading
+
+from diskcache import Cache
+
+from common.config import RESPONSE_CACHE
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = [OFF, RECORD, REPLAY]
+
+
+class ResponseCache:
+    """
+    On-disk LLM response cache, keyed by the hash of everything that decides the answer.
+
+    - "off": the cache is not touched
+    - "record": every call goes to the provider, successful responses are stored
+    - "replay": stored responses are returned without calling the provider,
+      misses are sent to the provider and recorded
+
+    `sample` is part of the key so every majority voting iteration gets its own
+    (independent) answer instead of replaying the first one.
+    """
+
+    def __init__(self, cache_dir, mode=OFF, size_limit=4 * 1024 ** 3):
+        if mode not in MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.size_limit = size_limit
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _get_cache(self):
+        with self._lock:
+            if self._cache is None:
+                self._cache = Cache(self.cache_dir, size_limit=self.size_limit)
+            return self._cache
+
+    @staticmethod
+    def make_key(model, formatted_messages, temperature, max_tokens, sample=0):
+        payload = json.dumps({
+            "model": model,
+            "messages": formatted_messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "sample": sample,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if self.mode != REPLAY:
+            return None
+        res = self._get_cache().get(key)
+        if res is not None:
+            logging.debug(f"Replayed response {key[:12]}")
+        return res
+
+    def put(self, key, response):
+        if self.mode == OFF:
+            return
+        self._get_cache().set(key, response)
+
+    def close(self):
+        with self._lock:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+
+response_cache = ResponseCache(RESPONSE_CACHE['dir'], RESPONSE_CACHE['mode'], RESPONSE_CACHE['size_limit'])
+
+
+def set_mode(mode):
+    if mode not in MODES:
+        raise ValueError(f"Unknown response cache mode: {mode}")
+    response_cache.mode = mode
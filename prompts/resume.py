@@ -0,0 +1,53 @@
+import logging
+import threading
+from collections import deque
+
+from helper.dao import get_logged_responses
+
+
+class ResumeLog:
+    """
+    Answers of an interrupted run, read back from llm_logs.
+
+    With `--reuse_logs` a resumed case replays the turns its conversation
+    already went through: a turn whose round and prompt were logged for the
+    case gets the logged response instead of a new LLM call. Each logged
+    response is handed out once, so voting samples replay different answers.
+    The logs of a case are loaded with one query, on its first turn.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._cases = {}
+
+    def _load(self, case_id, model):
+        responses = {}
+        for round, prompt, response in get_logged_responses(case_id, model):
+            if response and '"ret": "failed"' not in response:
+                responses.setdefault((round, prompt), deque()).append(response)
+        if responses:
+            logging.info(f"Case {case_id}: {sum(map(len, responses.values()))} logged responses to reuse")
+        return responses
+
+    def take(self, case_id, model, round, prompt):
+        """
+        A logged response of this turn, or None
+        """
+        if not self.enabled or case_id == 'N/A':
+            return None
+        with self._lock:
+            logged = self._cases.get((case_id, model))
+        if logged is None:
+            # the samples of a case start together, at worst they load it more than once
+            logged = self._load(case_id, model)
+            with self._lock:
+                logged = self._cases.setdefault((case_id, model), logged)
+        with self._lock:
+            responses = logged.get((round, prompt))
+            if responses:
+                return responses.popleft()
+        return None
+
+
+resume_log = ResumeLog()
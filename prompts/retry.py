@@ -0,0 +1,134 @@
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+RETRYABLE = "retryable"
+RATE_LIMITED = "rate_limited"
+FATAL = "fatal"
+
+# errors that will fail the same way however often they are retried
+_FATAL_PATTERNS = [
+    "context_length_exceeded",
+    "maximum context length",
+    "prompt is too long",
+    "insufficient_quota",
+    "invalid_api_key",
+    "invalid x-api-key",
+    "authentication",
+    "permission_denied",
+    "model_not_found",
+]
+
+_RATE_LIMIT_PATTERNS = [
+    "rate limit",
+    "rate_limit",
+    "too many requests",
+    "resource_exhausted",
+]
+
+
+class LLMRequestError(Exception):
+    """
+    An error reported inside a provider response (instead of raised by its client)
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _get_status_code(e):
+    status = getattr(e, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_retry_after(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        # HTTP-date form
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_retry_after(e):
+    if getattr(e, 'retry_after', None) is not None:
+        return _parse_retry_after(e.retry_after)
+    headers = getattr(getattr(e, 'response', None), 'headers', None)
+    if not headers or not hasattr(headers, 'get'):
+        return None
+    if headers.get('retry-after-ms'):
+        retry_after_ms = _parse_retry_after(headers.get('retry-after-ms'))
+        if retry_after_ms is not None:
+            return retry_after_ms / 1000
+    return _parse_retry_after(headers.get('retry-after'))
+
+
+def classify_error(e):
+    """
+    Sort an exception into RETRYABLE, RATE_LIMITED or FATAL.
+    Returns (kind, retry_after), retry_after is None when the provider did not send one.
+    """
+    msg = str(e).lower()
+    status = _get_status_code(e)
+    retry_after = _get_retry_after(e)
+
+    if any(p in msg for p in _FATAL_PATTERNS):
+        return FATAL, None
+    if status == 429 or any(p in msg for p in _RATE_LIMIT_PATTERNS):
+        return RATE_LIMITED, retry_after
+    if status is not None:
+        if status in (408, 409, 425) or status >= 500:
+            return RETRYABLE, retry_after
+        if 400 <= status < 500:
+            # bad request, auth, unknown model...
+            return FATAL, None
+    # network errors, timeouts and anything unknown
+    return RETRYABLE, retry_after
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter; a Retry-After sent by the provider
+    is used as the lower bound of the delay. Only the calling thread sleeps,
+    other in-flight cases keep running.
+    """
+
+    def __init__(self, max_retries=3, base_delay=2.0, max_delay=120.0, sleep=time.sleep, rand=random.random):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._rand = rand
+
+    def backoff(self, attempt, retry_after=None):
+        delay = self._rand() * min(self.max_delay, self.base_delay * (2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                kind, retry_after = classify_error(e)
+                if kind == FATAL or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                logging.warning(f"{kind} error: {str(e)[:200]}, retrying {attempt + 1} time(s) in {delay:.1f}s")
+                self._sleep(delay)
+                attempt += 1
@@ -0,0 +1,93 @@
+import logging
+import threading
+
+from prompts.conversation import _get, get_cache_usage
+
+# token/latency fields stored with every llm_logs row
+USAGE_FIELDS = ['input_tokens', 'output_tokens', 'reasoning_tokens', 'cached_tokens',
+                'ttft_ms', 'latency_ms', 'retries', 'provider']
+
+
+class LLMResult:
+    """
+    The answer of one LLM call and how much it cost us.
+    Token counts are None when the provider does not report them,
+    `ttft` (time to first token) is only known for streamed answers.
+    """
+
+    def __init__(self, text, provider=None, usage=None):
+        self.text = text
+        self.provider = provider
+        self.cached_tokens, self.input_tokens = get_cache_usage(usage)
+        self.output_tokens = _get_output_tokens(usage)
+        self.reasoning_tokens = _get(_get(usage, 'completion_tokens_details'), 'reasoning_tokens')
+        self.ttft = None
+        self.latency = None
+        self.retries = 0
+
+    def to_log_fields(self):
+        return {
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'reasoning_tokens': self.reasoning_tokens,
+            'cached_tokens': self.cached_tokens,
+            'ttft_ms': int(self.ttft * 1000) if self.ttft is not None else None,
+            'latency_ms': int(self.latency * 1000) if self.latency is not None else None,
+            'retries': self.retries,
+            'provider': self.provider,
+        }
+
+
+def _get_output_tokens(usage):
+    for name in ('output_tokens', 'completion_tokens', 'eval_count'):
+        value = _get(usage, name)
+        if value is not None:
+            return value
+    return None
+
+
+def get_stage(round):
+    # round: "Task <stage> - <prompt index>[ - callback - <n>]"
+    if round.startswith('Task '):
+        return round[5:].split(' - ')[0]
+    return round
+
+
+class UsageTracker:
+    """
+    In-process per-stage and per-case rollups of LLMResult
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_stage = {}
+        self.by_case = {}
+
+    @staticmethod
+    def _add(totals, result):
+        totals['calls'] = totals.get('calls', 0) + 1
+        for field in ('input_tokens', 'output_tokens', 'reasoning_tokens', 'cached_tokens', 'retries'):
+            totals[field] = totals.get(field, 0) + (getattr(result, field) or 0)
+        totals['latency'] = totals.get('latency', 0) + (result.latency or 0)
+
+    def record(self, stage, case_id, result):
+        with self._lock:
+            self._add(self.by_stage.setdefault(stage, {}), result)
+            self._add(self.by_case.setdefault((stage, case_id), {}), result)
+
+    @staticmethod
+    def _describe(totals):
+        return (f"{totals['calls']} calls, {totals['input_tokens']} input tokens "
+                f"({totals['cached_tokens']} cached), {totals['output_tokens']} output tokens "
+                f"({totals['reasoning_tokens']} reasoning), {totals['retries']} retries, "
+                f"{totals['latency']:.1f}s waiting for the LLM")
+
+    def log_summary(self):
+        with self._lock:
+            for (stage, case_id), totals in self.by_case.items():
+                logging.info(f"Usage of {stage} for case {case_id}: {self._describe(totals)}")
+            for stage, totals in self.by_stage.items():
+                logging.info(f"Usage of {stage}: {self._describe(totals)}")
+
+
+usage_tracker = UsageTracker()
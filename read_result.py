@@ -274,13 +274,33 @@ def get_source_line_set(context, proj_dir):
 #     last_order = warn.orders[-1]
 #     last_context = last_order.contexts_and_instructions[-1]
 
+def print_usage(model, case_prefix=''):
+    """
+    The token usage logged for `model` per stage, and per case of each stage
+    """
+    # connects to the database only when the usage is asked for
+    from helper.dao import get_usage_by_case, get_usage_by_stage
+    columns = "calls, input, output, reasoning, cached tokens, latency_ms, retries"
+    print(f"Usage of {model} per stage: stage, {columns}")
+    for row in get_usage_by_stage(model, case_prefix):
+        print(*row, sep=', ')
+    print(f"Usage of {model} per case: case_id, stage, {columns}")
+    for row in get_usage_by_case(model, case_prefix):
+        print(*row, sep=', ')
+
+
 if __name__ == "__main__":
     # Usage example:
     # file_path = 'example_sound.cmd'
     parser = argparse.ArgumentParser(description='Read result file')
     parser.add_argument('--file_path', type=str, help='Path to the result file', default='all_sound.cmd')
+    parser.add_argument('--usage', type=str, help='Print the token usage logged for this model instead')
+    parser.add_argument('--case_prefix', type=str, help='Only the cases of --usage starting with this prefix', default='')
     
     args = parser.parse_args()
+    if args.usage:
+        print_usage(args.usage, args.case_prefix)
+        exit(0)
     file_path = args.file_path
     bug_groups = parse_static_taint_analysis(file_path)
     # p = Project("msm-android-10", "all_sound.cmd")
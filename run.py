@@ -4,17 +4,23 @@ from prompts.llm_analysis import infer_variable_name_llm, smart_bug_analysis_llm
 from read_result import Project
 from rich.logging import RichHandler
 from parse_sarif import create_bug_groups_from_sarif
+from prompts.response_cache import set_mode as set_cache_mode
+from prompts.resume import resume_log
+from helper.codequery import build_indexes
+from helper.prewarm import prewarm
 import os
 
 import argparse
 
 def run_per_proj(proj, args):
+    if args.prewarm:
+        prewarm(proj.proj_dir, proj.bug_groups[args.range_start:args.range_end], workers=args.prewarm_workers)
     if args.infer_var_name:
-        infer_variable_name_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters)
+        infer_variable_name_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters, workers=args.workers, resume=args.resume)
     if args.smart_bug_analysis:
-        smart_bug_analysis_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters)
+        smart_bug_analysis_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters, workers=args.workers, resume=args.resume)
     if args.sanitizer_detection:
-        sanitizer_detection_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters)
+        sanitizer_detection_llm(proj, model=args.model, range_start=args.range_start, range_end=args.range_end, max_iters=args.max_iters, workers=args.workers, resume=args.resume)
     
 
 
@@ -29,6 +35,16 @@ if __name__ == "__main__":
     parser.add_argument('--single_case', type=int, help='Single case index', default=None)
     parser.add_argument('--max_iters', type=int, help='Max iterations for majority voting', default=1)    
     parser.add_argument('--model', type=str, help='Model name', default='o3-mini')
+    parser.add_argument('--workers', type=int, help='Number of bug groups analyzed concurrently, each runs its --max_iters voting samples at once', default=1)
+    parser.add_argument('--resume', action='store_true', help='Skip the cases a stage already has a result for', default=False)
+    parser.add_argument('--reuse_logs', action='store_true', help='With --resume, replay the logged turns of unfinished conversations', default=False)
+    parser.add_argument('--build_cq_db', action='store_true', help='Build the codequery database of the project before the analysis', default=False)
+    parser.add_argument('--rebuild_cq_db', action='store_true', help='With --build_cq_db, rebuild an existing codequery database', default=False)
+    parser.add_argument('--refresh_cq_db', action='store_true', help='Index the sources changed since the last codequery database build before the analysis', default=False)
+    parser.add_argument('--cq_jobs', type=int, help='Parallel ctags jobs of the codequery database build (default: one per core)', default=None)
+    parser.add_argument('--prewarm', action='store_true', help='Resolve the functions and structs of the bug groups into the lookup cache before the analysis', default=False)
+    parser.add_argument('--prewarm_workers', type=int, help='Processes of the prewarm stage (default: one per core)', default=None)
+    parser.add_argument('--cache_mode', type=str, choices=['off', 'record', 'replay'], help='LLM response cache mode', default=None)
 
     parser.add_argument('--no-infer_var_name', action='store_false', help='Do not infer variable name', dest='infer_var_name', default=True)
     parser.add_argument('--no-smart_bug_analysis', action='store_false', help='Do not perform smart bug analysis', dest='smart_bug_analysis', default=True)
@@ -63,6 +79,16 @@ if __name__ == "__main__":
         projs = [Project(proj_name, PROJ_CONFIG[proj_name]['cmd_file'], PROJ_CONFIG[proj_name]['proj_dir'])]
 
 
+    if args.build_cq_db or args.refresh_cq_db:
+        build_indexes([proj.proj_dir for proj in projs], jobs=args.cq_jobs, force=args.rebuild_cq_db,
+                      incremental=args.refresh_cq_db)
+
+    if args.cache_mode is not None:
+        set_cache_mode(args.cache_mode)
+
+    if args.resume and args.reuse_logs:
+        resume_log.enabled = True
+
     if args.model in MODEL_ABBR:
         args.model = MODEL_ABBR[args.model]
     
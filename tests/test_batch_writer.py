@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+
+from helper.batch_writer import BatchWriter
+
+
+class TestBatchWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.flushed = threading.Event()
+
+    def _flush(self, logs, upserts):
+        self.batches.append((logs, upserts))
+        self.flushed.set()
+
+    def test_coalesce_upserts(self):
+        writer = BatchWriter(self._flush, batch_size=100, flush_interval=60)
+        writer.upsert("c1", "m", "var_name", "a")
+        writer.upsert("c1", "m", "var_name", "b")
+        writer.upsert("c1", "m", "analysis_result", "bug")
+        writer.add_log(["prompt"], ["p"])
+        self.assertEqual(writer.pending("c1", "m", "var_name"), (True, "b"))
+        self.assertEqual(writer.pending("c1", "m", "sanitize_result"), (False, None))
+        writer.flush()
+        self.assertEqual(self.batches, [([(("prompt",), ("p",))],
+                                         {("c1", "m"): {"var_name": "b", "analysis_result": "bug"}})])
+        self.assertEqual(writer.pending("c1", "m", "var_name"), (False, None))
+        writer.close()
+
+    def test_synchronous(self):
+        writer = BatchWriter(self._flush, background=False)
+        writer.add_log(["prompt"], ["p"])
+        self.assertEqual(len(self.batches), 1)
+
+    def test_flush_on_size(self):
+        writer = BatchWriter(self._flush, batch_size=3, flush_interval=60)
+        for i in range(3):
+            writer.add_log(["prompt"], [str(i)])
+        self.assertTrue(self.flushed.wait(5))
+        self.assertEqual(len(self.batches[0][0]), 3)
+        writer.close()
+
+    def test_flush_on_time(self):
+        writer = BatchWriter(self._flush, batch_size=100, flush_interval=0.1)
+        start = time.monotonic()
+        writer.upsert("c1", "m", "var_name", "a")
+        self.assertTrue(self.flushed.wait(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        writer.close()
+
+    def test_close_flushes(self):
+        writer = BatchWriter(self._flush, batch_size=100, flush_interval=60)
+        writer.add_log(["prompt"], ["p"])
+        writer.close()
+        self.assertEqual(len(self.batches), 1)
+        # writes after close are committed synchronously
+        writer.add_log(["prompt"], ["q"])
+        self.assertEqual(len(self.batches), 2)
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from helper.cindex import build_index, scan_source
+from helper.codequery import build_indexes, get_func_def_codequery, get_global_var_def_codequery, get_struct_def_codequery
+from helper.cqdb import open_cq_db
+from helper.lookup_cache import LookupCache
+
+SOURCE = """\
+#include <linux/slab.h>
+#define MAX_PORTS 8
+#define SLIM_CFG(x) \\
+\tdo { x++; } while (0)
+
+/* a comment with { brace */
+enum slim_port_type {
+\tPORT_RX = 0,
+\tPORT_TX, // "}"
+\tPORT_MAX
+};
+
+typedef struct {
+\tint a;
+} slim_cfg_t;
+
+struct slim_port {
+\tint id;
+\tchar *name;
+};
+
+union ioctl_arg {
+\tint i;
+\tlong l;
+};
+
+static struct slim_port slim_rx_cfg[] = {
+\t{ .id = 1, .name = "a{" },
+};
+
+static int debug_level;
+int (*handler)(int) = NULL;
+static DEFINE_MUTEX(slim_lock);
+int slim_setup(struct slim_port *port);
+struct slim_port;
+extern int ext_var;
+
+static int __init
+slim_init(void)
+{
+\tif (debug_level) {
+\t\treturn 1;
+\t}
+\treturn 0;
+}
+module_init(slim_init);
+
+struct slim_hdr {
+\tint len;
+} __packed;
+
+struct slim_desc {
+\tint len;
+} slim_desc_table[4] __aligned(8);
+
+struct __packed slim_wire {
+\tint len;
+};
+
+struct __randomize_layout __kernel_slim {
+\tint id;
+};
+"""
+
+
+class TestCIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.project = os.path.join(tempfile.mkdtemp(), "linux")
+        os.makedirs(os.path.join(self.project, "sound"))
+        with open(os.path.join(self.project, "sound", "slim.c"), 'w') as f:
+            f.write(SOURCE)
+
+    def test_scan_source(self):
+        symbols = {(name, sym_type, line) for name, sym_type, line, _ in
+                   scan_source(os.path.join(self.project, "sound", "slim.c"))}
+        self.assertEqual(symbols, {
+            ("MAX_PORTS", "#", 2),
+            ("SLIM_CFG", "#", 3),
+            ("slim_port_type", "e", 7),
+            ("PORT_RX", "m", 8),
+            ("PORT_TX", "m", 9),
+            ("PORT_MAX", "m", 10),
+            ("slim_cfg_t", "t", 15),
+            ("slim_port", "s", 17),
+            ("ioctl_arg", "u", 22),
+            ("slim_rx_cfg", "g", 27),
+            ("debug_level", "g", 31),
+            ("handler", "g", 32),
+            ("slim_init", "$", 39),
+            ("slim_hdr", "s", 48),
+            ("slim_desc", "s", 52),
+            ("slim_desc_table", "g", 54),
+            ("slim_wire", "s", 56),
+            ("__kernel_slim", "s", 60),
+        })
+
+    def test_build_index(self):
+        index = open_cq_db(build_index(self.project, jobs=2), self.project)
+        self.assertEqual([(s.file, s.line, s.kind) for s in index.lookup("slim_init")],
+                         [("sound/slim.c", 39, "function")])
+        self.assertEqual(index.lookup("slim_port", ["c", "s"])[0].text, "struct slim_port {")
+
+    def test_build_indexes_without_toolchain(self):
+        with patch('helper.codequery.__HAS_DEPENDENCY', False):
+            build_indexes([self.project], jobs=1)
+        self.assertTrue(os.path.exists(os.path.join(self.project, "cq_py.db")))
+        self.assertFalse(os.path.exists(os.path.join(self.project, "cq.db")))
+
+    def test_refresh_index(self):
+        index_path = build_index(self.project, jobs=1)
+        self.assertEqual(build_index(self.project, jobs=1, refresh=True), index_path)
+        stat = os.stat(index_path)
+        self.assertEqual(os.stat(build_index(self.project, jobs=1, refresh=True)).st_mtime_ns, stat.st_mtime_ns)
+
+        path = os.path.join(self.project, "sound", "slim.c")
+        with open(path, 'a') as f:
+            f.write("int slim_exit(void)\n{\n\treturn 0;\n}\n")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(open_cq_db(build_index(self.project, jobs=1), self.project).lookup("slim_exit"), [])
+        with patch('helper.codequery.__HAS_DEPENDENCY', False):
+            build_indexes([self.project], jobs=1, incremental=True)
+        self.assertEqual([s.line for s in open_cq_db(index_path, self.project).lookup("slim_exit")], [63])
+
+    @unittest.skipIf(shutil.which('cqmakedb'), "cq.db is built with the codequery toolchain")
+    def test_lookups_without_toolchain(self):
+        cache = LookupCache(tempfile.mkdtemp())
+        self.addCleanup(cache.close)
+        for module in ['helper.codequery', 'helper.get_func_def']:
+            patcher = patch(module + '.lookup_cache', cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.assertEqual(get_func_def_codequery(self.project, "slim_init"), [["sound/slim.c", "39"]])
+        self.assertEqual(get_struct_def_codequery(self.project, "ioctl_arg"), [["sound/slim.c", "22"]])
+        self.assertEqual(get_global_var_def_codequery(self.project, "slim_rx_cfg"), [["sound/slim.c", "27"]])
+        self.assertEqual(get_global_var_def_codequery(self.project, "MAX_PORTS", is_marco=True),
+                         [["sound/slim.c", "2"]])
+        self.assertFalse(os.path.exists(os.path.join(self.project, "cq.db")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from prompts.conversation import anthropic_messages, get_cache_usage
+
+
+class TestConversation(unittest.TestCase):
+
+    def test_anthropic_breakpoints(self):
+        history = [
+            {"role": "user", "content": "analyze this function"},
+            {"role": "assistant", "content": "<requests>...</requests>"},
+            {"role": "user", "content": "Struct foo is defined as ..."},
+            {"role": "assistant", "content": "<requests>...</requests>"},
+            {"role": "user", "content": "Function bar is defined as ..."},
+        ]
+        messages = anthropic_messages(history, cache_first=True)
+
+        self.assertEqual(messages[0]["content"][-1]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(messages[3]["content"][-1]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(messages[1]["content"], "<requests>...</requests>")
+        self.assertEqual(messages[4]["content"], "Function bar is defined as ...")
+        # the shared history is left untouched
+        self.assertEqual(history[0]["content"], "analyze this function")
+        self.assertEqual(history[3]["content"], "<requests>...</requests>")
+
+    def test_cache_usage(self):
+        anthropic_usage = {"input_tokens": 10, "cache_read_input_tokens": 900, "cache_creation_input_tokens": 90}
+        self.assertEqual(get_cache_usage(anthropic_usage), (900, 1000))
+        deepseek_usage = {"prompt_tokens": 1000, "prompt_cache_hit_tokens": 768}
+        self.assertEqual(get_cache_usage(deepseek_usage), (768, 1000))
+        openai_usage = {"prompt_tokens": 2000, "prompt_tokens_details": {"cached_tokens": 1024}}
+        self.assertEqual(get_cache_usage(openai_usage), (1024, 2000))
+        self.assertEqual(get_cache_usage({"prompt_tokens": 30}), (0, 30))
+        self.assertEqual(get_cache_usage(None), (None, None))
@@ -0,0 +1,97 @@
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from helper.cqbuild import build_lock, changed_sources, merge_tags
+
+
+class TestCQBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def _write(self, name, lines):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        return path
+
+    def test_merge_tags(self):
+        header = ['!_TAG_FILE_FORMAT\t2', '!_TAG_FILE_SORTED\t1']
+        shards = [
+            self._write('tags.0', header + ['alloc\t./mm/a.c\t3;"\tf', 'kfree\t./mm/slub.c\t9;"\tf']),
+            self._write('tags.1', header + ['free_page\t./mm/b.c\t5;"\tf']),
+            self._write('tags.2', header),
+        ]
+        merge_tags(shards, os.path.join(self.dir, 'tags'))
+        with open(os.path.join(self.dir, 'tags')) as f:
+            self.assertEqual(f.read().splitlines(), header + [
+                'alloc\t./mm/a.c\t3;"\tf',
+                'free_page\t./mm/b.c\t5;"\tf',
+                'kfree\t./mm/slub.c\t9;"\tf',
+            ])
+
+    def test_changed_sources(self):
+        for name in ['a.c', 'b.c', 'c.c']:
+            self._write(name, [name])
+        sources = ['./a.c', './b.c', './c.c']
+        stats = {}
+        for source in sources:
+            stat = os.stat(os.path.join(self.dir, source))
+            stats[source] = [stat.st_mtime_ns, stat.st_size]
+        manifest = {'index_version': 1, 'revision': None, 'files': stats}
+        self.assertEqual(changed_sources(self.dir, manifest, sources), (set(), set(), set()))
+
+        self._write('b.c', ['b.c changed'])
+        os.remove(os.path.join(self.dir, 'c.c'))
+        self._write('d.c', ['d.c'])
+        self.assertEqual(changed_sources(self.dir, manifest, ['./a.c', './b.c', './d.c']),
+                         ({'./b.c'}, {'./d.c'}, {'./c.c'}))
+
+    def test_changed_sources_reverted(self):
+        def _git(*args):
+            subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                           cwd=self.dir, capture_output=True, check=True)
+
+        for name in ['a.c', 'b.c']:
+            self._write(name, [name])
+        _git('init', '-q')
+        _git('add', 'a.c', 'b.c')
+        _git('commit', '-q', '-m', 'init')
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=self.dir,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+
+        # b.c is dirty when the index is built
+        self._write('b.c', ['b.c changed'])
+        stat = os.stat(os.path.join(self.dir, 'b.c'))
+        manifest = {'index_version': 1, 'revision': revision,
+                    'files': {'./a.c': None, './b.c': [stat.st_mtime_ns, stat.st_size]}}
+        self.assertEqual(changed_sources(self.dir, manifest, ['./a.c', './b.c']), (set(), set(), set()))
+
+        _git('checkout', '--', 'b.c')
+        self.assertEqual(changed_sources(self.dir, manifest, ['./a.c', './b.c']), ({'./b.c'}, set(), set()))
+
+    def test_build_lock(self):
+        events = []
+
+        def _build(name):
+            with build_lock(self.dir):
+                events.append(name + ' start')
+                time.sleep(0.05)
+                events.append(name + ' end')
+
+        threads = [threading.Thread(target=_build, args=(str(i),)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # builds never overlap
+        for i in range(0, len(events), 2):
+            self.assertEqual(events[i].split()[0], events[i + 1].split()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
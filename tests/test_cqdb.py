@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from helper.codequery import get_func_def_codequery, get_global_var_def_codequery, get_struct_def_codequery
+from helper.cqdb import CodeQueryDB, Symbol, open_cq_db
+from helper.lookup_cache import LookupCache
+
+
+def make_cq_db(path, symbols):
+    """
+    A cq.db with the tables of cqmakedb, `symbols` is [(name, sym_type, file, line, text), ...]
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE filestbl (fileID INTEGER PRIMARY KEY, filePath TEXT);
+    CREATE TABLE linestbl (lineID INTEGER PRIMARY KEY, linenum INTEGER, fileID INTEGER, linetext TEXT);
+    CREATE TABLE symtbl (symID INTEGER PRIMARY KEY, symName TEXT, symType TEXT, lineID INTEGER);
+    """)
+    files = {}
+    for name, sym_type, file_path, line, text in symbols:
+        if file_path not in files:
+            files[file_path] = conn.execute("INSERT INTO filestbl (filePath) VALUES (?);", (file_path,)).lastrowid
+        line_id = conn.execute("INSERT INTO linestbl (linenum, fileID, linetext) VALUES (?, ?, ?);",
+                               (line, files[file_path], text)).lastrowid
+        conn.execute("INSERT INTO symtbl (symName, symType, lineID) VALUES (?, ?, ?);", (name, sym_type, line_id))
+    conn.commit()
+    conn.close()
+
+
+class TestCodeQueryDB(unittest.TestCase):
+
+    def setUp(self):
+        self.project = os.path.join(tempfile.mkdtemp(), "linux")
+        self.db_path = self.project + ".db"
+        make_cq_db(self.db_path, [
+            ("kfree", "$", "$HOME/src/linux/mm/slub.c", 4200, "void kfree(const void *x)"),
+            ("kfree", "$", "$HOME/src/linux/mm/slab.c", 3700, "void kfree(const void *objp)"),
+            ("kfree", "`", "$HOME/src/linux/fs/file.c", 10, "kfree(f);"),
+            ("sk_buff", "s", "$HOME/src/linux/include/linux/skbuff.h", 700, "struct sk_buff {"),
+            ("PAGE_SIZE", "#", "$HOME/src/linux/include/asm/page.h", 12, "#define PAGE_SIZE 4096"),
+        ])
+
+    def test_lookup(self):
+        db = CodeQueryDB(self.db_path, self.project)
+        self.assertTrue(db.supported)
+        self.assertEqual(db.lookup("kfree", ["$"]), [
+            Symbol("kfree", "mm/slab.c", 3700, "function", "void kfree(const void *objp)"),
+            Symbol("kfree", "mm/slub.c", 4200, "function", "void kfree(const void *x)"),
+        ])
+        self.assertEqual(len(db.lookup("kfree")), 3)
+        self.assertEqual(db.lookup("PAGE_SIZE")[0].kind, "macro")
+        self.assertEqual(db.lookup("missing"), [])
+
+    def test_lookup_many(self):
+        db = CodeQueryDB(self.db_path, self.project)
+        res = db.lookup_many(["sk_buff", "PAGE_SIZE", "missing"], ["s", "#"])
+        self.assertEqual(set(res), {"sk_buff", "PAGE_SIZE", "missing"})
+        self.assertEqual([s.file for s in res["sk_buff"]], ["include/linux/skbuff.h"])
+        self.assertEqual([s.line for s in res["PAGE_SIZE"]], [12])
+        self.assertEqual(res["missing"], [])
+
+    def test_open_cq_db(self):
+        db = open_cq_db(self.db_path, self.project)
+        self.assertIs(open_cq_db(self.db_path, self.project), db)
+        self.assertIsNone(open_cq_db(self.db_path + ".missing", self.project))
+
+    def test_unexpected_schema(self):
+        path = os.path.join(tempfile.mkdtemp(), "other.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE symtbl (symName TEXT);")
+        conn.close()
+        self.assertIsNone(open_cq_db(path, self.project))
+
+
+class TestDefinitionCandidates(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LookupCache(tempfile.mkdtemp())
+        self.addCleanup(self.cache.close)
+        patcher = patch('helper.codequery.lookup_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = os.path.join(tempfile.mkdtemp(), "linux")
+        os.makedirs(self.project)
+        make_cq_db(os.path.join(self.project, "cq.db"), [
+            ("slim_rx_cfg", "g", "/src/linux/sound/slim.c", 30, "static struct slim_cfg slim_rx_cfg[] = {"),
+            ("slim_rx_cfg", "`", "/src/linux/sound/slim.c", 90, "cfg = slim_rx_cfg[i];"),
+            ("debug_level", "g", "/src/linux/sound/slim.c", 12, "static int debug_level;"),
+            ("MAX_PORTS", "#", "/src/linux/sound/slim.h", 5, "#define MAX_PORTS 8"),
+            ("PORT_RX", "e", "/src/linux/sound/slim.h", 9, "\tPORT_RX,"),
+            ("ioctl_arg", "g", "/src/linux/sound/slim.h", 40, "union ioctl_arg {"),
+            ("slim_setup", "$", "/src/linux/sound/slim.c", 60, "static int slim_setup(struct slim_port *port)"),
+            ("roundup", "#", "/src/linux/include/linux/math.h", 8, "#define roundup(x, y) ("),
+        ])
+
+    def test_global_var(self):
+        self.assertEqual(get_global_var_def_codequery(self.project, "slim_rx_cfg"), [["sound/slim.c", "30"]])
+        self.assertEqual(get_global_var_def_codequery(self.project, "debug_level"), [["sound/slim.c", "12"]])
+        self.assertIsNone(get_global_var_def_codequery(self.project, "missing"))
+
+    def test_macro(self):
+        self.assertEqual(get_global_var_def_codequery(self.project, "MAX_PORTS", is_marco=True),
+                         [["sound/slim.h", "5"]])
+        self.assertEqual(get_global_var_def_codequery(self.project, "PORT_RX", is_marco=True),
+                         [["sound/slim.h", "9"]])
+
+    def test_negative_cache(self):
+        db_path = os.path.join(self.project, "cq.db")
+        self.assertIsNone(get_global_var_def_codequery(self.project, "new_var"))
+        stat = os.stat(db_path)
+        cached = self.cache.get('cq_var', f"{self.project}:{stat.st_mtime_ns}:{stat.st_size}:new_var")
+        self.assertEqual(cached, [])
+
+        # a rebuilt index is a new version, the miss is not reused
+        os.remove(db_path)
+        make_cq_db(db_path, [("new_var", "g", "/src/linux/sound/new.c", 3, "struct new_cfg new_var = {")])
+        os.utime(db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(get_global_var_def_codequery(self.project, "new_var"), [["sound/new.c", "3"]])
+
+    def test_function(self):
+        self.assertEqual(get_func_def_codequery(self.project, "slim_setup"), [["sound/slim.c", "60"]])
+        # function-like macros resolve as functions, like `cqsearch -p 2`
+        self.assertEqual(get_func_def_codequery(self.project, "roundup"), [["include/linux/math.h", "8"]])
+
+    def test_union(self):
+        self.assertEqual(get_struct_def_codequery(self.project, "ioctl_arg"), [["sound/slim.h", "40"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock, call
 from helper.dao import insert_log, create_connection
-from common.config import DB_CONFIG
+from helper.storage import SQLiteBackend
+from common.config import DB_CONFIG, LOG_BLOBS
 
 
 class TestDB(unittest.TestCase):
@@ -11,4 +14,72 @@ class TestDB(unittest.TestCase):
         create_connection()
         mock_connect.assert_called_once_with(**DB_CONFIG)
         
-        
\ No newline at end of file
+        
+    @patch('psycopg2.connect')
+    def test_prefetch_cases(self, mock_connect):
+        import helper.dao as dao
+        # the mocked connection cannot be migrated; the prefetched cases do not outlive the test
+        for patcher in [patch.object(getattr(dao, '__backend'), '_schema_ready', True),
+                        patch('helper.dao.__case_table', {}),
+                        patch('helper.dao.__prefetched', set())]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cursor = mock_connect.return_value.cursor.return_value
+        mock_connect.return_value.closed = 0
+        cursor.fetchall.return_value = [("proj:0001", "len", "bug", None, None, None)]
+        dao.prefetch_cases("proj:", "model")
+        cursor.execute.reset_mock()
+
+        self.assertEqual(dao.find_case_varname("proj:0001", "model"), ("len",))
+        self.assertEqual(dao.find_analysis_result("proj:0001", "model"), ("bug",))
+        # prefetched project without a row
+        self.assertIsNone(dao.find_case_varname("proj:0002", "model"))
+        dao.insert_or_update_varname("proj:0002", "size", "model")
+        dao.flush_writes()
+        self.assertEqual(dao.find_case_varname("proj:0002", "model"), ("size",))
+        self.assertFalse(any("SELECT" in str(c) for c in cursor.execute.mock_calls))
+
+
+class TestLogBlobs(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "test.db"))
+        patcher = patch('helper.dao.__backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _query(self, query, params=()):
+        def _run(conn):
+            cur = conn.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+        return self.backend.run(_run)
+
+    def test_large_response(self):
+        import helper.dao as dao
+        response = "x" * LOG_BLOBS['min_size']
+        insert_log("prompt 1", response, "model", "Task 1 - 0", "proj:0001")
+        insert_log("prompt 2", response, "model", "Task 1 - 1", "proj:0001")
+        dao.flush_writes()
+
+        # stored once, the log rows only keep its hash
+        self.assertEqual(self._query("SELECT COUNT(*) FROM llm_blobs;"), [(1,)])
+        self.assertEqual(self._query("SELECT COUNT(*) FROM llm_logs WHERE response IS NULL AND response_hash IS NOT NULL;"),
+                         [(2,)])
+        self.assertEqual(self._query("SELECT response FROM llm_logs_full WHERE prompt = %s;", ("prompt 1",)),
+                         [(response,)])
+        self.assertEqual(dao.get_logged_responses("proj:0001", "model"),
+                         [("Task 1 - 0", "prompt 1", response), ("Task 1 - 1", "prompt 2", response)])
+
+    def test_log_order(self):
+        import helper.dao as dao
+        large = "x" * LOG_BLOBS['min_size']
+        insert_log("a", "short", "model", "Task 1 - 0", "proj:0002")
+        insert_log("b", large, "model", "Task 1 - 1", "proj:0002")
+        insert_log("c", "short", "model", "Task 1 - 2", "proj:0002", {"stage": "1", "input_tokens": 3})
+        insert_log("d", "short", "model", "Task 1 - 3", "proj:0002")
+        dao.flush_writes()
+        self.assertEqual(self._query("SELECT prompt FROM llm_logs WHERE case_id = %s ORDER BY id;", ("proj:0002",)),
+                         [("a",), ("b",), ("c",), ("d",)])
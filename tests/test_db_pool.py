@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import MagicMock
+
+import psycopg2
+
+from helper.db_pool import ConnectionPool
+
+
+def _fake_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.status = psycopg2.extensions.STATUS_READY
+    return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_lazy_and_reused(self):
+        connect = MagicMock(side_effect=_fake_connection)
+        pool = ConnectionPool(connect, max_size=2)
+        connect.assert_not_called()
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        connect.assert_called_once()
+
+    def test_reconnect(self):
+        connect = MagicMock(side_effect=_fake_connection)
+        pool = ConnectionPool(connect)
+        calls = []
+
+        def query(conn):
+            calls.append(conn)
+            if len(calls) == 1:
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            return "ok"
+
+        self.assertEqual(pool.run(query), "ok")
+        self.assertIsNot(calls[0], calls[1])
+        calls[0].close.assert_called_once()
+
+    def test_health_check(self):
+        connect = MagicMock(side_effect=_fake_connection)
+        pool = ConnectionPool(connect, health_check_interval=0)
+        with pool.connection() as first:
+            pass
+        first.cursor.return_value.execute.side_effect = psycopg2.OperationalError("dead")
+        with pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_rollback_on_release(self):
+        pool = ConnectionPool(_fake_connection)
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                conn.status = psycopg2.extensions.STATUS_IN_TRANSACTION
+                raise ValueError()
+        conn.rollback.assert_called_once()
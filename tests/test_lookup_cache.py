@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from helper.get_func_def import read_struct_def
+from helper.lookup_cache import LookupCache
+
+
+class TestLookupCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = LookupCache(self.dir, memory_items=2)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_namespaces(self):
+        self.cache.set('cq_func', 'proj:kfree', [['mm/slub.c', '10']])
+        self.cache.set('cq_struct', 'proj:kfree', [['mm/slab.h', '3']])
+        self.assertEqual(self.cache.get('cq_func', 'proj:kfree'), [['mm/slub.c', '10']])
+        self.assertEqual(self.cache.get('cq_struct', 'proj:kfree'), [['mm/slab.h', '3']])
+        self.assertIsNone(self.cache.get('cq_var', 'proj:kfree'))
+
+    def test_memory_lru(self):
+        for i in range(3):
+            self.cache.set('func_start', str(i), i)
+        self.assertEqual(list(self.cache._memory), [('func_start', '1'), ('func_start', '2')])
+        # evicted from memory, still on disk
+        self.assertEqual(self.cache.get('func_start', '0'), 0)
+        self.assertEqual(list(self.cache._memory), [('func_start', '2'), ('func_start', '0')])
+
+    def test_persistent(self):
+        self.cache.set('func_read', 'proj:a.c:3', ("int a;\n", 3))
+        self.cache.close()
+        self.assertEqual(LookupCache(self.dir).get('func_read', 'proj:a.c:3'), ("int a;\n", 3))
+
+    def test_clear_namespace(self):
+        self.cache.set('cq_func', 'a', 1)
+        self.cache.set('cq_var', 'a', 2)
+        self.cache.clear('cq_func')
+        self.assertIsNone(self.cache.get('cq_func', 'a'))
+        self.assertEqual(self.cache.get('cq_var', 'a'), 2)
+
+    def test_edited_source(self):
+        project = tempfile.mkdtemp()
+        path = os.path.join(project, 'slim.h')
+        with open(path, 'w') as f:
+            f.write("struct slim_port {\n\tint id;\n};\n")
+        with patch('helper.get_func_def.lookup_cache', self.cache):
+            self.assertEqual(read_struct_def('slim.h', 1, project), "struct slim_port {\n\tint id;\n};\n")
+            with open(path, 'w') as f:
+                f.write("struct slim_port {\n\tint id;\n\tint rate;\n};\n")
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            # the cached read of the old source is not reused
+            self.assertEqual(read_struct_def('slim.h', 1, project),
+                             "struct slim_port {\n\tint id;\n\tint rate;\n};\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from helper.lookup_cache import LookupCache, lookup_cache
+from helper.prewarm import collect_symbols, prewarm, signature
+from test_cqdb import make_cq_db
+
+SOURCE = """\
+/*
+ * slim port setup
+ */
+static int slim_setup(struct slim_port *port, struct slim_cfg *cfg)
+{
+\treturn 0;
+}
+
+struct slim_port {
+\tint id;
+};
+"""
+
+
+def make_project():
+    project = os.path.join(tempfile.mkdtemp(), "linux")
+    os.makedirs(os.path.join(project, "sound"))
+    with open(os.path.join(project, "sound", "slim.c"), 'w') as f:
+        f.write(SOURCE)
+    make_cq_db(os.path.join(project, "cq.db"), [
+        ("slim_setup", "$", f"{project}/sound/slim.c", 4,
+         "static int slim_setup(struct slim_port *port, struct slim_cfg *cfg)"),
+        ("slim_port", "s", f"{project}/sound/slim.c", 9, "struct slim_port {"),
+    ])
+    return project
+
+
+class TestPrewarm(unittest.TestCase):
+
+    def test_signature(self):
+        self.assertEqual(signature(SOURCE), "static int slim_setup(struct slim_port *port, struct slim_cfg *cfg)")
+
+    def test_collect_symbols(self):
+        context = SimpleNamespace(call_chain=["ioctl", "slim_setup", "ioctl"])
+        text_group = SimpleNamespace(warns=[SimpleNamespace(orders=[SimpleNamespace(contexts_and_instructions=[context])])])
+        sarif_group = SimpleNamespace(func_list=[SimpleNamespace(full_function_definition=SOURCE),
+                                                 SimpleNamespace(full_function_definition=None)])
+        self.assertEqual(collect_symbols([text_group, sarif_group]),
+                         (["ioctl", "slim_setup"], ["slim_port", "slim_cfg"]))
+
+    def test_prewarm(self):
+        project = make_project()
+        # the workers are handed the directory of the process-wide cache
+        patcher = patch.object(lookup_cache, 'directory', tempfile.mkdtemp())
+        lookup_cache.close()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lookup_cache.close)
+        context = SimpleNamespace(call_chain=["slim_setup"])
+        group = SimpleNamespace(warns=[SimpleNamespace(orders=[SimpleNamespace(contexts_and_instructions=[context])])])
+        prewarm(project, [group], workers=2)
+
+        # filled by the worker processes
+        stat = os.stat(os.path.join(project, "cq.db"))
+        version = f"{stat.st_mtime_ns}:{stat.st_size}"
+        cache = LookupCache(lookup_cache.directory)
+        self.assertEqual(cache.get('cq_func', f"{project}:{version}:slim_setup"), [["sound/slim.c", "4"]])
+        self.assertEqual(cache.get('cq_struct', f"{project}:{version}:slim_port"), [["sound/slim.c", "9"]])
+        self.assertEqual(cache.get('cq_struct', f"{project}:{version}:slim_cfg"), [])
+        stat = os.stat(os.path.join(project, "sound", "slim.c"))
+        self.assertIsNotNone(cache.get('struct_read', f"{project}:sound/slim.c:{stat.st_mtime_ns}:{stat.st_size}:9"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from prompts.providers import route, Provider, PROVIDERS
+
+
+class TestProviders(unittest.TestCase):
+
+    def test_route(self):
+        cases = {
+            "ollama/qwq": ("ollama", "ollama", "qwq"),
+            "openrouter/Friendli/deepseek/deepseek-r1": ("openrouter", "openrouter", "Friendli/deepseek/deepseek-r1"),
+            "claude-3-7-sonnet-latest": ("anthropic", "claude_thinking", "claude-3-7-sonnet-latest"),
+            "claude-3-5-haiku-latest": ("anthropic", "claude", "claude-3-5-haiku-latest"),
+            "gemini-2.5-pro-preview-03-25": ("gemini", "openai_compatible", "gemini-2.5-pro-preview-03-25"),
+            "deepseek-reasoner": ("deepseek", "deepseek", "deepseek-reasoner"),
+            "o3-mini--run2": ("openai", "openai_compatible", "o3-mini"),
+        }
+        for model, (provider, handler, model_name) in cases.items():
+            r = route(model)
+            self.assertEqual((r.provider.name, r.handler, r.model), (provider, handler, model_name), model)
+
+    def test_multi_sample(self):
+        self.assertTrue(route("o3-mini").provider.multi_sample)
+        self.assertFalse(route("deepseek-chat").provider.multi_sample)
+
+    def test_no_sdk_retries(self):
+        keys = {name: "test" for name in ["OPENAI_API_KEY", "DEEPSEEK_API_KEY", "GEMINI_API_KEY", "ANTHROPIC_API_KEY"]}
+        with patch.dict("os.environ", keys):
+            for name in ["openai", "deepseek", "gemini", "anthropic"]:
+                # retried by the RetryPolicy of prompts/call_api.py only
+                self.assertEqual(PROVIDERS[name]._create_client().max_retries, 0, name)
+
+    def test_lazy_client(self):
+        create_client = MagicMock(return_value="client")
+        provider = Provider("test", create_client)
+        create_client.assert_not_called()
+        self.assertEqual(provider.client, "client")
+        self.assertEqual(provider.client, "client")
+        create_client.assert_called_once()
@@ -0,0 +1,54 @@
+import unittest
+
+from prompts.rate_limit import TokenBucket, RateLimiter, estimate_tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_bucket_no_wait_within_quota(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock, clock.sleep)
+        for _ in range(60):
+            self.assertEqual(bucket.acquire(1), 0)
+        self.assertEqual(clock.slept, [])
+
+    def test_bucket_waits_when_empty(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock, clock.sleep)
+        for _ in range(60):
+            bucket.acquire(1)
+        # one unit per second is refilled
+        self.assertAlmostEqual(bucket.acquire(1), 1.0)
+
+    def test_bucket_oversized_request(self):
+        clock = FakeClock()
+        bucket = TokenBucket(100, clock, clock.sleep)
+        self.assertEqual(bucket.acquire(250), 0)
+        self.assertGreater(bucket.acquire(1), 0)
+
+    def test_limiter_per_provider(self):
+        clock = FakeClock()
+        limiter = RateLimiter({"a": {"rpm": 1, "tpm": None}, "b": {"rpm": None, "tpm": None}},
+                              clock, clock.sleep)
+        self.assertEqual(limiter.acquire("a", 10), 0)
+        self.assertEqual(limiter.acquire("b", 10), 0)
+        self.assertEqual(limiter.acquire("unknown", 10), 0)
+        self.assertAlmostEqual(limiter.acquire("a", 10), 60.0)
+
+    def test_estimate_tokens(self):
+        msgs = [{"role": "user", "content": "a" * 400},
+                {"role": "user", "content": [{"type": "text", "text": "b" * 400}]}]
+        self.assertEqual(estimate_tokens(msgs), 201)
@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+
+from prompts.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.messages = [{"role": "user", "content": "where is the sanitizer?"}]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key(self):
+        key = ResponseCache.make_key("o3-mini", self.messages, 1.0, 2048)
+        self.assertEqual(key, ResponseCache.make_key("o3-mini", list(self.messages), 1.0, 2048))
+        self.assertNotEqual(key, ResponseCache.make_key("o3-mini", self.messages, 1.0, 2048, sample=1))
+        self.assertNotEqual(key, ResponseCache.make_key("o1", self.messages, 1.0, 2048))
+        self.assertNotEqual(key, ResponseCache.make_key("o3-mini", self.messages, 0.2, 2048))
+
+    def test_record_then_replay(self):
+        key = ResponseCache.make_key("o3-mini", self.messages, 1.0, 2048)
+        recorder = ResponseCache(self.tmp_dir.name, "record")
+        self.assertIsNone(recorder.get(key))
+        recorder.put(key, "<final_res>still_a_bug</final_res>")
+        recorder.close()
+
+        replayer = ResponseCache(self.tmp_dir.name, "replay")
+        self.assertEqual(replayer.get(key), "<final_res>still_a_bug</final_res>")
+        replayer.close()
+
+    def test_off(self):
+        cache = ResponseCache(self.tmp_dir.name, "off")
+        cache.put("k", "v")
+        self.assertIsNone(cache.get("k"))
+        with self.assertRaises(ValueError):
+            ResponseCache(self.tmp_dir.name, "sometimes")
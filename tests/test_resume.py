@@ -0,0 +1,24 @@
+import unittest
+from unittest.mock import patch
+
+from prompts.resume import ResumeLog
+
+
+class TestResumeLog(unittest.TestCase):
+
+    @patch('prompts.resume.get_logged_responses')
+    def test_take(self, mock_logged):
+        mock_logged.return_value = [
+            ("Task var_name - 1", "prompt", "answer 1"),
+            ("Task var_name - 1", "prompt", '{"ret": "failed", "response": "timeout"}'),
+            ("Task var_name - 1", "prompt", "answer 2"),
+        ]
+        resume_log = ResumeLog()
+        self.assertIsNone(resume_log.take("p:0001", "m", "Task var_name - 1", "prompt"))
+
+        resume_log.enabled = True
+        self.assertEqual(resume_log.take("p:0001", "m", "Task var_name - 1", "prompt"), "answer 1")
+        self.assertEqual(resume_log.take("p:0001", "m", "Task var_name - 1", "prompt"), "answer 2")
+        self.assertIsNone(resume_log.take("p:0001", "m", "Task var_name - 1", "prompt"))
+        self.assertIsNone(resume_log.take("p:0001", "m", "Task var_name - 2", "other prompt"))
+        mock_logged.assert_called_once_with("p:0001", "m")
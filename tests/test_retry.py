@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import MagicMock
+
+from prompts.retry import RetryPolicy, LLMRequestError, classify_error, RETRYABLE, RATE_LIMITED, FATAL
+
+
+class HTTPError(Exception):
+    def __init__(self, msg, status_code, headers=None):
+        super().__init__(msg)
+        self.response = MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_classify(self):
+        self.assertEqual(classify_error(HTTPError("slow down", 429, {"retry-after": "7"})), (RATE_LIMITED, 7.0))
+        self.assertEqual(classify_error(HTTPError("overloaded", 529))[0], RETRYABLE)
+        self.assertEqual(classify_error(HTTPError("bad key", 401))[0], FATAL)
+        self.assertEqual(classify_error(HTTPError("unknown model", 404))[0], FATAL)
+        self.assertEqual(classify_error(ConnectionError("reset by peer"))[0], RETRYABLE)
+        self.assertEqual(classify_error(LLMRequestError("context_length_exceeded"))[0], FATAL)
+        self.assertEqual(classify_error(LLMRequestError("Rate limit exceeded", retry_after="3")), (RATE_LIMITED, 3.0))
+
+    def test_backoff_jitter_and_retry_after(self):
+        policy = RetryPolicy(base_delay=2, max_delay=30, rand=lambda: 0.5)
+        self.assertEqual(policy.backoff(0), 1.0)
+        self.assertEqual(policy.backoff(3), 8.0)
+        self.assertEqual(policy.backoff(10), 15.0)
+        self.assertEqual(policy.backoff(0, retry_after=20), 20)
+
+    def test_fatal_not_retried(self):
+        sleep = MagicMock()
+        func = MagicMock(side_effect=HTTPError("invalid request", 400))
+        policy = RetryPolicy(max_retries=3, sleep=sleep)
+        with self.assertRaises(HTTPError):
+            policy.call(func)
+        self.assertEqual(func.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_retry_until_success(self):
+        sleep = MagicMock()
+        func = MagicMock(side_effect=[ConnectionError("reset"), HTTPError("busy", 503), "ok"])
+        policy = RetryPolicy(max_retries=3, sleep=sleep)
+        self.assertEqual(policy.call(func), "ok")
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_give_up_after_max_retries(self):
+        func = MagicMock(side_effect=ConnectionError("reset"))
+        policy = RetryPolicy(max_retries=2, sleep=MagicMock())
+        with self.assertRaises(ConnectionError):
+            policy.call(func)
+        self.assertEqual(func.call_count, 3)
@@ -17,7 +17,7 @@ class TestSarif(unittest.TestCase):
         self.proj = Project('codeql/ioctl-to-cfu', proj['sarif_file'], proj['proj_dir'])
         self.proj.bug_groups = create_bug_groups_from_sarif(proj['sarif_file'], proj['proj_dir'])
         with patch('prompts.call_api.do_request_llm') as mock_do_request_llm:
-            def mock_behavior(model, temperature, max_tokens, formatted_messages, cur_prompt, round='N/A', case_id='N/A'):
+            def mock_behavior(model, temperature, max_tokens, formatted_messages, cur_prompt, round='N/A', case_id='N/A', sample=0):
                 # logging.info(formatted_messages)
                 print(formatted_messages)
                 return "TEST_RESPONSE_IS_RESPONSE"
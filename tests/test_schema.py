@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from helper.schema import migrate, ensure_log_partitions, current_version, LATEST_VERSION
+from helper.storage import SQLiteBackend
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_migrate_sqlite(self):
+        backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "test.db"), auto_migrate=False)
+        migrate(backend)
+        migrate(backend)
+
+        def _check(conn):
+            cur = conn.cursor()
+            self.assertEqual(current_version(cur), LATEST_VERSION)
+            cur.execute("PRAGMA index_list(cases);")
+            self.assertIn("cases_model_case_idx", [row[1] for row in cur.fetchall()])
+            cur.execute("PRAGMA table_info(llm_logs);")
+            self.assertIn("latency_ms", [row[1] for row in cur.fetchall()])
+        backend.run(_check)
+
+    def test_logs_view(self):
+        backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "test.db"), compress=True)
+
+        def _run(conn):
+            cur = conn.cursor()
+            compression, data = backend.encode_blob("a long prompt")
+            cur.execute("INSERT INTO llm_blobs (hash, compression, data) VALUES (%s, %s, %s);", ("h1", compression, data))
+            cur.execute("INSERT INTO llm_logs (prompt_hash, response, model, round, case_id) VALUES (%s, %s, %s, %s, %s);",
+                        ("h1", "answer", "m", "Task t - 1", "p:0001"))
+            cur.execute("SELECT prompt, response FROM llm_logs_full;")
+            return cur.fetchall()
+        self.assertEqual(backend.run(_run), [("a long prompt", "answer")])
+
+    def test_log_partitions(self):
+        cur = MagicMock()
+        cur.fetchone.return_value = (1,)
+        ensure_log_partitions(cur, now=datetime(2025, 12, 15), ahead=1)
+        statements = " ".join(str(c.args[0]) for c in cur.execute.mock_calls)
+        self.assertIn("llm_logs_y2025m12 PARTITION OF llm_logs", statements)
+        self.assertIn("FROM ('2025-12-01') TO ('2026-01-01')", statements)
+        self.assertIn("FROM ('2026-01-01') TO ('2026-02-01')", statements)
+        self.assertIn("llm_logs_default", statements)
+
+    def test_unpartitioned_logs(self):
+        cur = MagicMock()
+        cur.fetchone.return_value = None
+        ensure_log_partitions(cur)
+        self.assertEqual(cur.execute.call_count, 1)
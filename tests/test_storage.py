@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from helper.storage import SQLiteBackend
+
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "test.db"))
+
+    def _query(self, query, params=()):
+        def _run(conn):
+            cur = conn.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+        return self.backend.run(_run)
+
+    def test_wal(self):
+        self.assertEqual(self._query("PRAGMA journal_mode;"), [("wal",)])
+
+    def test_upsert(self):
+        query = """
+        INSERT INTO cases (case_id, model, var_name) VALUES %s
+        ON CONFLICT (case_id, model) DO UPDATE SET var_name = EXCLUDED.var_name;
+        """
+
+        def _write(rows):
+            def _run(conn):
+                cur = conn.cursor()
+                self.backend.execute_values(cur, query, rows)
+                conn.commit()
+            self.backend.run(_run)
+
+        _write([("p:0001", "m", "a"), ("p:0002", "m", "b")])
+        _write([("p:0001", "m", "c")])
+        self.assertEqual(self._query("SELECT case_id, var_name FROM cases WHERE model = %s ORDER BY case_id;", ("m",)),
+                         [("p:0001", "c"), ("p:0002", "b")])
+
+    def test_add_columns(self):
+        def _run(conn):
+            cur = conn.cursor()
+            self.backend.add_columns(cur, "cases", {"note": "TEXT"})
+            self.backend.add_columns(cur, "cases", {"note": "TEXT"})
+            conn.commit()
+        self.backend.run(_run)
+        columns = [row[1] for row in self._query("PRAGMA table_info(cases);")]
+        self.assertIn("note", columns)
+
+    def test_failed_migration(self):
+        backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "test.db"))
+        with patch("helper.schema.migrate", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                backend.run(lambda conn: None)
+        # the schema is not marked ready, the next operation migrates again
+        self.assertFalse(backend._schema_ready)
+        backend.run(lambda conn: None)
+        self.assertTrue(backend._schema_ready)
@@ -0,0 +1,61 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import prompts.call_api
+from prompts.telemetry import LLMResult, UsageTracker, get_stage
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_result_usage(self):
+        usage = {"prompt_tokens": 1000, "completion_tokens": 300,
+                 "prompt_tokens_details": {"cached_tokens": 768},
+                 "completion_tokens_details": {"reasoning_tokens": 200}}
+        result = LLMResult("answer", "openai", usage)
+        result.latency = 1.5
+        result.retries = 1
+        fields = result.to_log_fields()
+        self.assertEqual(fields['input_tokens'], 1000)
+        self.assertEqual(fields['output_tokens'], 300)
+        self.assertEqual(fields['reasoning_tokens'], 200)
+        self.assertEqual(fields['cached_tokens'], 768)
+        self.assertEqual(fields['latency_ms'], 1500)
+        self.assertIsNone(fields['ttft_ms'])
+        self.assertEqual(fields['provider'], "openai")
+
+        anthropic_usage = {"input_tokens": 10, "output_tokens": 50, "cache_read_input_tokens": 90}
+        result = LLMResult("answer", "anthropic", anthropic_usage)
+        self.assertEqual((result.input_tokens, result.cached_tokens, result.output_tokens), (100, 90, 50))
+
+    def test_provider_from_route(self):
+        # gemini is served by the OpenAI-compatible handler
+        gemini = SimpleNamespace(provider=SimpleNamespace(name="gemini", client=None),
+                                 handler="openai_compatible", model="gemini-2.0-flash")
+        handlers = {"openai_compatible": lambda *args: LLMResult("answer", usage={"prompt_tokens": 3})}
+        with patch("prompts.call_api.route", return_value=gemini), patch.dict(prompts.call_api._HANDLERS, handlers):
+            result = prompts.call_api._do_request("gemini-2.0-flash", 0, 100, [])
+        self.assertEqual(result.provider, "gemini")
+        self.assertEqual(result.input_tokens, 3)
+
+    def test_no_usage(self):
+        result = LLMResult("answer", "cache")
+        self.assertIsNone(result.input_tokens)
+        self.assertIsNone(result.output_tokens)
+
+    def test_get_stage(self):
+        self.assertEqual(get_stage("Task smart_bug_analysis - 0"), "smart_bug_analysis")
+        self.assertEqual(get_stage("Task infer_var_name - 1 - callback - 2"), "infer_var_name")
+        self.assertEqual(get_stage("N/A"), "N/A")
+
+    def test_rollup(self):
+        tracker = UsageTracker()
+        for case_id in ["a", "a", "b"]:
+            tracker.record("stage", case_id, LLMResult("x", "openai", {"prompt_tokens": 10, "completion_tokens": 2}))
+        self.assertEqual(tracker.by_stage["stage"]["calls"], 3)
+        self.assertEqual(tracker.by_stage["stage"]["input_tokens"], 30)
+        self.assertEqual(tracker.by_case[("stage", "a")]["output_tokens"], 4)
+        with self.assertLogs(level="INFO") as logs:
+            tracker.log_summary()
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn("Usage of stage for case a: 2 calls, 20 input tokens", logs.output[0])
@@ -0,0 +1,162 @@
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from prompts.llm_analysis import _run_bug_groups, run_with_majority_voting
+from prompts.resume import ResumeLog
+from prompts.telemetry import UsageTracker
+
+PROMPTS = [{"text": "Is it a bug?"}]
+
+
+def answer(res):
+    return [{"role": "user", "content": "Is it a bug?"}, {"role": "assistant", "content": f"<res>{res}</res>"}]
+
+
+class TestMajorityVoting(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('prompts.llm_analysis.supports_multi_sample', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.task = {"id": "sanitizer", "context": "ctx", "case_id": "proj:0001"}
+        self.samples = []
+
+    def _vote(self, run_sample, max_iters=3):
+        def _do_request_series(model, temperature, max_tokens, prompts, task):
+            self.samples.append(task['sample'])
+            return run_sample(task)
+
+        with patch('prompts.llm_analysis.do_request_series', side_effect=_do_request_series):
+            return run_with_majority_voting(None, PROMPTS, self.task, "m", 1.0, 100, 'res',
+                                            self.task['case_id'], max_iters)
+
+    def test_early_stop(self):
+        cancelled = threading.Event()
+
+        def _run_sample(task):
+            if task['sample'] == 2:
+                # still running when the first two samples agree
+                if task['cancel_event'].wait(timeout=5):
+                    cancelled.set()
+                return None
+            return answer("bug")
+
+        self.assertEqual(self._vote(_run_sample), "bug")
+        self.assertTrue(cancelled.wait(timeout=5))
+        self.assertEqual(sorted(self.samples), [0, 1, 2])
+
+    def test_uncertain(self):
+        answers = {0: "uncertain", 1: "bug", 2: "not_a_bug", 3: "bug"}
+        self.assertEqual(self._vote(lambda task: answer(answers[task['sample']])), "bug")
+        # one extra sample for the "uncertain" one, and no more
+        self.assertIn(3, self.samples)
+        self.assertNotIn(4, self.samples)
+
+    def test_two_failures(self):
+        answers = {0: None, 1: None, 2: answer("bug")}
+        self.assertIsNone(self._vote(lambda task: answers[task['sample']]))
+
+    def test_one_failure(self):
+        answers = {0: None, 1: answer("bug"), 2: answer("bug")}
+        self.assertEqual(self._vote(lambda task: answers[task['sample']]), "bug")
+
+
+class FakeClient:
+    """
+    OpenAI-style client: the first prompt is answered with `n` choices "sample i",
+    the continuation of sample i with `answers[i]`
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.requests = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, n=None, **kwargs):
+        with self._lock:
+            self.requests.append((n, len(messages)))
+        if n is not None:
+            contents = [f"sample {i}" for i in range(n)]
+        else:
+            sample = int(messages[1]['content'].split()[1])
+            contents = [self.answers[sample]]
+        choices = [SimpleNamespace(message=SimpleNamespace(content=content)) for content in contents]
+        return SimpleNamespace(choices=choices, usage=None)
+
+
+class TestMultiSampleVoting(unittest.TestCase):
+
+    def _vote(self, answers, max_iters=3, resume_log=None):
+        client = FakeClient(answers)
+        model_route = SimpleNamespace(provider=SimpleNamespace(name="test", client=client, multi_sample=True),
+                                      handler="openai_compatible", model="m")
+        task = {"id": "sanitizer", "context": "ctx", "case_id": "proj:0001"}
+        prompts = [{"text": "Is it a bug?"}, {"text": "Answer in <res>"}]
+        with patch('prompts.call_api.route', return_value=model_route), \
+                patch('prompts.call_api.insert_log'), \
+                patch('prompts.call_api.usage_tracker', UsageTracker()), \
+                patch('prompts.call_api.resume_log', resume_log or ResumeLog()):
+            res = run_with_majority_voting(None, prompts, task, "m", 1.0, 100, 'res', task['case_id'], max_iters)
+        return res, client.requests
+
+    def test_single_request(self):
+        res, requests = self._vote({0: "<res>bug</res>", 1: "<res>not_a_bug</res>", 2: "<res>bug</res>"})
+        self.assertEqual(res, "bug")
+        # one request for the 3 samples of the first prompt, then each sample on its own
+        self.assertEqual(requests[0], (3, 1))
+        self.assertEqual(sorted(requests[1:]), [(None, 3)] * 3)
+
+    def test_failed_samples(self):
+        failed = '{"ret": "failed", "response": "timeout"}'
+        res, _ = self._vote({0: "<res>bug</res>", 1: failed, 2: "<res>bug</res>"})
+        self.assertEqual(res, "bug")
+        res, _ = self._vote({0: "<res>bug</res>", 1: failed, 2: failed})
+        self.assertIsNone(res)
+
+    @patch('prompts.resume.get_logged_responses')
+    def test_reuse_logs(self, mock_logged):
+        # two of the three samples of the first prompt were logged before the interruption
+        mock_logged.return_value = [("Task sanitizer - 1", "Is it a bug?", "sample 0"),
+                                    ("Task sanitizer - 1", "Is it a bug?", "sample 1")]
+        resume_log = ResumeLog()
+        resume_log.enabled = True
+        res, requests = self._vote({0: "<res>bug</res>", 1: "<res>bug</res>"}, resume_log=resume_log)
+        self.assertEqual(res, "bug")
+        self.assertEqual(requests[0], (1, 1))
+        self.assertEqual(sorted(requests[1:]), [(None, 3)] * 3)
+
+
+class TestBugGroups(unittest.TestCase):
+
+    def _run(self, workers, failing=()):
+        bug_groups = [SimpleNamespace(group_id=i) for i in range(8)]
+        done = []
+        lock = threading.Lock()
+
+        def _run_case(bug_group):
+            if bug_group.group_id in failing:
+                raise RuntimeError("no answer")
+            with lock:
+                done.append(bug_group.group_id)
+
+        with patch('prompts.llm_analysis.flush_writes') as flush_writes, \
+                patch('prompts.llm_analysis.usage_tracker') as usage_tracker:
+            _run_bug_groups(bug_groups, "test", _run_case, workers)
+        flush_writes.assert_called_once()
+        usage_tracker.log_summary.assert_called_once()
+        return sorted(done)
+
+    def test_sequential(self):
+        self.assertEqual(self._run(1), list(range(8)))
+
+    def test_workers(self):
+        self.assertEqual(self._run(3), list(range(8)))
+        # a failed group does not stop the others
+        self.assertEqual(self._run(3, failing={2}), [0, 1, 3, 4, 5, 6, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()